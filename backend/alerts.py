@@ -0,0 +1,261 @@
+"""Schwellwert-Alarme, ausgewertet bei jedem Ingest-Ereignis.
+
+Regeln:
+- Belegung über ALERT_MAX_OCCUPANCY
+- Eintritte in den letzten 5 Minuten über ALERT_INFLOW_PER_5MIN
+- Keine Sensordaten seit ALERT_SILENCE_MINUTES (nur während der Öffnungszeiten)
+
+Jede Regel hat eine Hysterese (Alarm endet erst ALERT_HYSTERESIS unter der
+Schwelle) und eine Sperrzeit gegen wiederholtes Auslösen. Die Auswertung
+kostet pro Ereignis O(1): die 5-Minuten-Summe kommt aus einem Zähler mit
+festen Minuten-Slots.
+
+Alarme werden nicht direkt versendet, sondern in eine begrenzte
+Warteschlange gestellt. Ein Hintergrund-Task liefert sie an die
+konfigurierten Ziele (log, file, webhook) aus, mit Wiederholungen.
+
+Jeder Standort hat eine eigene AlertEngine; seine ID steht im Ereignis.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from config import (
+    ALERT_MAX_OCCUPANCY, ALERT_INFLOW_PER_5MIN, ALERT_SILENCE_MINUTES,
+    ALERT_HYSTERESIS, ALERT_COOLDOWN_MINUTES, ALERT_SINKS, ALERT_WEBHOOK_URL,
+    ALERT_FILE_PATH, ALERT_QUEUE_SIZE, ALERT_RETRIES
+)
+from sites import PerSite
+from timeutil import from_epoch, now_epoch, now_local
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowCounter:
+    """Summe der letzten `minutes` Minuten mit einem Slot pro Minute."""
+
+    def __init__(self, minutes: int):
+        self.minutes = minutes
+        self._values = [0] * minutes
+        self._slot_minute = [-1] * minutes
+
+    def add(self, minute: int, value: int):
+        slot = minute % self.minutes
+        if self._slot_minute[slot] > minute:
+            return  # nachgespielter Wert, älter als das Fenster
+        if self._slot_minute[slot] != minute:
+            # Slot gehört zu einer abgelaufenen Minute - wiederverwenden
+            self._slot_minute[slot] = minute
+            self._values[slot] = 0
+        self._values[slot] += value
+
+    def total(self, minute: int) -> int:
+        return sum(
+            value for value, slot_minute in zip(self._values, self._slot_minute)
+            if minute - self.minutes < slot_minute <= minute
+        )
+
+
+class ThresholdRule:
+    """Schwellwert-Regel mit Hysterese und Sperrzeit."""
+
+    def __init__(self, name: str, threshold: int, hysteresis: int = ALERT_HYSTERESIS,
+                 cooldown_minutes: int = ALERT_COOLDOWN_MINUTES, message: str = ""):
+        self.name = name
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.cooldown = timedelta(minutes=cooldown_minutes)
+        self.message = message
+        self.active = False
+        self.last_fired: Optional[datetime] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def evaluate(self, value: int, now: datetime) -> Optional[dict]:
+        """Gibt ein Alarm-Ereignis zurück, wenn sich der Zustand ändert."""
+        if not self.enabled:
+            return None
+        if not self.active and value > self.threshold:
+            if self.last_fired and now - self.last_fired < self.cooldown:
+                return None
+            self.active = True
+            self.last_fired = now
+            return self._event("firing", value, now)
+        if self.active and value <= self.threshold - self.hysteresis:
+            self.active = False
+            return self._event("resolved", value, now)
+        return None
+
+    def _event(self, state: str, value: int, now: datetime) -> dict:
+        if state == "firing":
+            message = self.message.format(value=value, threshold=self.threshold)
+        else:
+            message = f"Wieder im Normalbereich ({value}, Grenzwert {self.threshold})"
+        return {
+            "rule": self.name,
+            "state": state,
+            "value": value,
+            "threshold": self.threshold,
+            "message": message,
+            "timestamp": now.isoformat(timespec="seconds"),
+        }
+
+
+class AlertEngine:
+    """Wertet die Regeln inkrementell aus und stellt Alarme in die Versand-Warteschlange."""
+
+    def __init__(self, site: str):
+        self.site = site
+        self.occupancy_rule = ThresholdRule(
+            "occupancy", ALERT_MAX_OCCUPANCY,
+            message="Belegung {value} über Grenzwert {threshold}"
+        )
+        self.inflow_rule = ThresholdRule(
+            "inflow", ALERT_INFLOW_PER_5MIN,
+            message="{value} Eintritte in 5 Minuten (Grenzwert {threshold})"
+        )
+        self.silence_rule = ThresholdRule(
+            # endet, sobald wieder Daten kommen (max. 1 Minute alt)
+            "silence", ALERT_SILENCE_MINUTES, hysteresis=ALERT_SILENCE_MINUTES - 1,
+            message="Seit {value} Minuten keine Sensordaten (Grenzwert {threshold})"
+        )
+        self._inflow = SlidingWindowCounter(5)
+        self._last_count_in: Optional[int] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def observe(self, count_in: int, count_out: int, occupancy: int,
+                epoch: Optional[int] = None):
+        """Wird vom Ingest nach jedem geschriebenen Wert aufgerufen."""
+        # Fenster-Schlüssel aus der UTC-Epoch: eindeutig auch bei Zeitumstellung
+        epoch = now_epoch() if epoch is None else epoch
+        minute = epoch // 60
+        now = from_epoch(epoch)
+
+        # Eintritte seit dem letzten Ereignis (nach Tages-Reset neu beginnen)
+        if self._last_count_in is not None and count_in >= self._last_count_in:
+            self._inflow.add(minute, count_in - self._last_count_in)
+        self._last_count_in = count_in
+
+        for rule, value in (
+            (self.occupancy_rule, occupancy),
+            (self.inflow_rule, self._inflow.total(minute)),
+            # Daten sind gerade angekommen - ein Stille-Alarm ist damit erledigt
+            (self.silence_rule, 0),
+        ):
+            self._emit(rule.evaluate(value, now))
+
+    def check_silence(self, last_update: Optional[str], is_open: bool,
+                      now: Optional[datetime] = None):
+        """Periodische Prüfung: wie lange kamen keine Sensordaten mehr?"""
+        if not is_open or not last_update:
+            return
+        now = now or now_local()
+        silent_minutes = int((now - datetime.fromisoformat(last_update)).total_seconds() // 60)
+        self._emit(self.silence_rule.evaluate(silent_minutes, now))
+
+    def _emit(self, event: Optional[dict]):
+        if event is None:
+            return
+        event["site"] = self.site
+        if self._queue is None:
+            logger.warning(f"Alarm ohne laufenden Versand: {event['message']}")
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.error(f"Alarm-Warteschlange voll, verworfen: {event['message']}")
+
+    def start(self):
+        """Startet den Versand-Task (im laufenden Event-Loop)."""
+        self._queue = asyncio.Queue(maxsize=ALERT_QUEUE_SIZE)
+        self._task = asyncio.create_task(self._dispatcher())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _dispatcher(self):
+        sinks = build_sinks()
+        while True:
+            event = await self._queue.get()
+            for sink in sinks:
+                await _deliver(sink, event)
+
+
+async def _deliver(sink: Callable, event: dict):
+    """Liefert einen Alarm an ein Ziel aus, mit exponentiellem Backoff."""
+    for attempt in range(ALERT_RETRIES + 1):
+        try:
+            await sink(event)
+            return
+        except Exception as e:
+            if attempt == ALERT_RETRIES:
+                logger.error(f"Alarm-Versand an {sink.__name__} fehlgeschlagen: {e}")
+                return
+            await asyncio.sleep(2 ** attempt)
+
+
+# ============== Alarm-Ziele ==============
+
+async def log_sink(event: dict):
+    """Schreibt den Alarm ins Log."""
+    level = logging.WARNING if event["state"] == "firing" else logging.INFO
+    logger.log(level, f"Alarm [{event['site']}/{event['rule']}] {event['state']}: {event['message']}")
+
+
+async def file_sink(event: dict):
+    """Hängt den Alarm als JSON-Zeile an ALERT_FILE_PATH an."""
+    def append():
+        with open(ALERT_FILE_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    await asyncio.to_thread(append)
+
+
+async def webhook_sink(event: dict):
+    """Sendet den Alarm per HTTP POST an ALERT_WEBHOOK_URL."""
+    import httpx
+
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        response = await client.post(ALERT_WEBHOOK_URL, json=event)
+        response.raise_for_status()
+
+
+SINKS: Dict[str, Callable] = {
+    "log": log_sink,
+    "file": file_sink,
+    "webhook": webhook_sink,
+}
+
+
+def register_sink(name: str, sink: Callable):
+    """Weiteres Alarm-Ziel registrieren (async Funktion, die ein Ereignis erhält)."""
+    SINKS[name] = sink
+
+
+def build_sinks(names: str = ALERT_SINKS) -> List[Callable]:
+    sinks = []
+    for name in (n.strip() for n in names.split(",")):
+        if not name:
+            continue
+        if name not in SINKS:
+            logger.error(f"Unbekanntes Alarm-Ziel: {name}")
+            continue
+        if name == "webhook" and not ALERT_WEBHOOK_URL:
+            logger.error("Alarm-Ziel webhook ohne ALERT_WEBHOOK_URL")
+            continue
+        sinks.append(SINKS[name])
+    return sinks
+
+
+# Eine Instanz je Standort
+alert_engines = PerSite(AlertEngine)
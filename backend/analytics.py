@@ -0,0 +1,269 @@
+"""Materialisierte Aggregate für Langzeit-Vergleiche.
+
+Abgeschlossene Tage werden einmal aus der counts-Tabelle verdichtet:
+
+- daily_totals:    Tagessummen, Tages-Peak, Wochentag
+- hourly_totals:   Stundenwerte je Tag
+- weekday_profile: Summen je Wochentag und Stunde ("durchschnittlicher Dienstag")
+- monthly_totals:  Monatssummen (Jahreswerte ergeben sich aus max. 12 Zeilen)
+
+Die Aktualisierung ist inkrementell: es werden nur abgeschlossene Tage
+ohne Tageszeile verarbeitet - auch ältere, die ein CSV-Import nachträgt.
+Ein erneut materialisierter Tag ersetzt seine alten Werte im
+Wochentagsprofil.
+Abfragen lesen nur diese kleinen Tabellen und sind damit unabhängig von
+der Größe der Historie.
+
+Mit jedem Tag werden auch seine Fluss-Rollups (flow.py) aus counts neu
+berechnet.
+
+Jeder Tag trägt die Kalender-Flags aus opening_hours (is_open, is_holiday,
+Öffnungszeit). Geschlossene Tage fließen nicht ins Wochentagsprofil ein
+und werden bei Durchschnittswerten per Index ausgefiltert.
+"""
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+import aiosqlite
+
+from database import get_hourly_stats
+from drift import correct_day
+from flow import rebuild_day as rebuild_flow_day
+from opening_hours import opening_calendar
+from sites import site_db
+from timeutil import day_from_key, day_key, now_local
+
+logger = logging.getLogger(__name__)
+
+
+async def materialize_day(date: str):
+    """Verdichtet einen Tag (YYYY-MM-DD) in die Aggregat-Tabellen."""
+    day = datetime.strptime(date, "%Y-%m-%d")
+    hours = await get_hourly_stats(day)
+    info = opening_calendar.day_info(day)
+
+    async with site_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+
+        # Alte Werte dieses Tages aus dem Wochentagsprofil herausrechnen
+        # (nur wenn der Tag damals als geöffnet gezählt wurde)
+        async with db.execute("""
+            SELECT h.hour, h.total_in, h.total_out, h.max_occupancy
+            FROM hourly_totals h
+            JOIN daily_totals d ON d.date = h.date
+            WHERE h.date = ? AND d.is_open = 1
+        """, (date,)) as cursor:
+            old_hours = await cursor.fetchall()
+        for hour, total_in, total_out, max_occupancy in old_hours:
+            await db.execute("""
+                UPDATE weekday_profile SET
+                    days = days - 1,
+                    sum_in = sum_in - ?,
+                    sum_out = sum_out - ?,
+                    sum_max_occupancy = sum_max_occupancy - ?
+                WHERE weekday = ? AND hour = ?
+            """, (total_in, total_out, max_occupancy, day.weekday(), hour))
+        await db.execute("DELETE FROM hourly_totals WHERE date = ?", (date,))
+        await db.execute("DELETE FROM daily_totals WHERE date = ?", (date,))
+
+        if hours:
+            for row in hours:
+                hour = int(row["hour"])
+                await db.execute(
+                    "INSERT INTO hourly_totals (date, hour, total_in, total_out, max_occupancy) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (date, hour, row["total_in"], row["total_out"], row["max_occupancy"] or 0)
+                )
+                if not info["is_open"]:
+                    continue
+                await db.execute("""
+                    INSERT INTO weekday_profile (weekday, hour, days, sum_in, sum_out, sum_max_occupancy)
+                    VALUES (?, ?, 1, ?, ?, ?)
+                    ON CONFLICT(weekday, hour) DO UPDATE SET
+                        days = days + 1,
+                        sum_in = sum_in + excluded.sum_in,
+                        sum_out = sum_out + excluded.sum_out,
+                        sum_max_occupancy = sum_max_occupancy + excluded.sum_max_occupancy
+                """, (day.weekday(), hour, row["total_in"], row["total_out"],
+                      row["max_occupancy"] or 0))
+
+            peak = max(hours, key=lambda h: h["total_in"])
+            await db.execute("""
+                INSERT INTO daily_totals
+                    (date, year, month, weekday, total_in, total_out, max_occupancy,
+                     peak_hour, peak_hour_in, is_open, is_holiday, open_minute, close_minute)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (date, day.year, day.month, day.weekday(),
+                  sum(h["total_in"] for h in hours),
+                  sum(h["total_out"] for h in hours),
+                  max(h["max_occupancy"] or 0 for h in hours),
+                  int(peak["hour"]), peak["total_in"],
+                  int(info["is_open"]), int(info["is_holiday"]),
+                  info["open_minute"], info["close_minute"]))
+
+        # Monat aus den (max. 31) Tageszeilen neu berechnen
+        await db.execute("DELETE FROM monthly_totals WHERE year = ? AND month = ?",
+                         (day.year, day.month))
+        await db.execute("""
+            INSERT INTO monthly_totals (year, month, days, total_in, total_out, max_occupancy)
+            SELECT year, month, COUNT(*), SUM(total_in), SUM(total_out), MAX(max_occupancy)
+            FROM daily_totals WHERE year = ? AND month = ?
+            GROUP BY year, month
+        """, (day.year, day.month))
+
+        # Drift-Korrektur zuerst, der Fluss baut auf der korrigierten Belegung auf
+        await correct_day(db, date)
+        await rebuild_flow_day(db, date)
+        await db.commit()
+
+
+async def refresh_aggregates() -> int:
+    """Materialisiert alle abgeschlossenen Tage, die noch keine Tageszeile haben
+    oder noch Einträge ohne Drift-Korrektur enthalten.
+
+    Das erfasst auch Tage vor dem zuletzt materialisierten, z.B. aus einem
+    CSV-Import der Historie, und Bestandsdaten von vor Drift-Korrektur und
+    Fluss-Rollups: materialize_day() korrigiert jeden Tag und baut seine
+    Rollups neu auf.
+    """
+    today = day_key(now_local())
+    async with site_db() as db:
+        # DISTINCT über idx_counts_local, Anti-Join gegen den Primärschlüssel;
+        # unkorrigierte Einträge enthält nur der kleine idx_counts_uncorrected
+        async with db.execute("""
+            SELECT local_day FROM (
+                SELECT DISTINCT local_day FROM counts WHERE local_day < ?
+            ) c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM daily_totals d
+                WHERE d.date = printf('%04d-%02d-%02d', c.local_day / 10000,
+                                      c.local_day / 100 % 100, c.local_day % 100)
+            )
+            UNION
+            SELECT DISTINCT local_day FROM counts
+            WHERE local_day < ? AND occupancy_corrected IS NULL
+            ORDER BY 1
+        """, (today, today)) as cursor:
+            dates = [day_from_key(row[0]) for row in await cursor.fetchall()]
+
+    for date in dates:
+        await materialize_day(date)
+    if dates:
+        logger.info(f"Aggregate aktualisiert: {len(dates)} Tage ({dates[0]} bis {dates[-1]})")
+    return len(dates)
+
+
+async def refresh_calendar_flags() -> int:
+    """Gleicht die Kalender-Flags aller Tage mit der aktuellen Konfiguration ab.
+
+    Tage, deren Öffnungsstatus sich geändert hat, werden neu materialisiert,
+    damit auch das Wochentagsprofil stimmt.
+    """
+    async with site_db() as db:
+        async with db.execute(
+            "SELECT date, is_open, is_holiday, open_minute, close_minute FROM daily_totals"
+        ) as cursor:
+            rows = await cursor.fetchall()
+
+    changed = []
+    for date, is_open, is_holiday, open_minute, close_minute in rows:
+        info = opening_calendar.day_info(date)
+        if (int(info["is_open"]), int(info["is_holiday"]), info["open_minute"],
+                info["close_minute"]) != (is_open, is_holiday, open_minute, close_minute):
+            changed.append(date)
+
+    for date in changed:
+        await materialize_day(date)
+    if changed:
+        logger.info(f"Kalender-Flags für {len(changed)} Tage aktualisiert")
+    return len(changed)
+
+
+async def get_open_day_averages(start: str, end: str) -> dict:
+    """Durchschnittswerte über die geöffneten Tage eines Zeitraums (inkl. Grenzen)."""
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("""
+            SELECT COUNT(*) as open_days,
+                   ROUND(AVG(total_in), 1) as avg_in,
+                   ROUND(AVG(total_out), 1) as avg_out,
+                   ROUND(AVG(max_occupancy), 1) as avg_max_occupancy
+            FROM daily_totals
+            WHERE is_open = 1 AND date BETWEEN ? AND ?
+        """, (start, end)) as cursor:
+            return dict(await cursor.fetchone())
+
+
+async def get_yearly_totals() -> List[dict]:
+    """Jahressummen aller Jahre."""
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("""
+            SELECT year, SUM(days) as days, SUM(total_in) as total_in,
+                   SUM(total_out) as total_out, MAX(max_occupancy) as max_occupancy
+            FROM monthly_totals
+            GROUP BY year
+            ORDER BY year
+        """) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def get_year_comparison(year: int) -> List[dict]:
+    """Monatssummen eines Jahres im Vergleich zum Vorjahr."""
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("""
+            SELECT cur.month as month, cur.days as days,
+                   cur.total_in as total_in, cur.total_out as total_out,
+                   cur.max_occupancy as max_occupancy,
+                   prev.total_in as previous_year_in
+            FROM monthly_totals cur
+            LEFT JOIN monthly_totals prev
+                ON prev.year = cur.year - 1 AND prev.month = cur.month
+            WHERE cur.year = ?
+            ORDER BY cur.month
+        """, (year,)) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def get_weekday_profile(weekday: Optional[int] = None) -> List[dict]:
+    """Durchschnittswerte je Wochentag (0 = Montag) und Stunde.
+
+    Geteilt wird durch alle geöffneten Tage des Wochentags (daily_totals),
+    nicht nur durch die Tage mit Verkehr in der jeweiligen Stunde - sonst
+    fielen ruhige Stunden zu hoch aus.
+    """
+    query = """
+        SELECT p.weekday, p.hour, d.days,
+               ROUND(CAST(p.sum_in AS REAL) / d.days, 1) as avg_in,
+               ROUND(CAST(p.sum_out AS REAL) / d.days, 1) as avg_out,
+               ROUND(CAST(p.sum_max_occupancy AS REAL) / d.days, 1) as avg_max_occupancy
+        FROM weekday_profile p
+        JOIN (SELECT weekday, COUNT(*) as days FROM daily_totals
+              WHERE is_open = 1 GROUP BY weekday) d ON d.weekday = p.weekday
+        WHERE p.days > 0
+    """
+    params = ()
+    if weekday is not None:
+        query += " AND p.weekday = ?"
+        params = (weekday,)
+    query += " ORDER BY p.weekday, p.hour"
+
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(query, params) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def get_peak_days(limit: int = 10) -> List[dict]:
+    """Die Tage mit den meisten Eintritten."""
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("""
+            SELECT date, weekday, total_in, total_out, max_occupancy, peak_hour, peak_hour_in
+            FROM daily_totals
+            ORDER BY total_in DESC
+            LIMIT ?
+        """, (limit,)) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
@@ -0,0 +1,151 @@
+"""Online-Backup der SQLite-Datenbank.
+
+Nutzt die Backup-API von SQLite und kopiert die Datenbank in einem
+Schritt. Im WAL-Modus liest das Backup einen festen Stand, Webhooks
+schreiben währenddessen ungehindert ins WAL. (Schrittweise Kopien würden
+bei jedem Schreibzugriff von vorne beginnen und bei laufendem Betrieb
+unter Umständen nie fertig.) Das Backup läuft in einem eigenen Thread und
+blockiert den Event-Loop nicht. Die Kopie wird gzip-komprimiert
+und es werden nur die neuesten BACKUP_KEEP Dateien behalten.
+
+Bei mehreren Standorten (sites.py) sichert der geplante Job jede
+Standort-Datenbank in ein eigenes Unterverzeichnis BACKUP_DIR/<standort>;
+die Kommandozeile arbeitet weiterhin mit DATABASE_PATH.
+
+Verwendung:
+    python backup.py backup            # Backup jetzt erstellen
+    python backup.py list              # vorhandene Backups anzeigen
+    python backup.py verify <datei>    # Backup auf Integrität prüfen
+    python backup.py restore <datei>   # Backup zurückspielen (Container vorher stoppen!)
+"""
+import asyncio
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from config import DATABASE_PATH, BACKUP_DIR, BACKUP_KEEP
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PATTERN = "xovis_counts-*.db.gz"
+
+
+def list_backups(backup_dir: str = BACKUP_DIR) -> list:
+    """Vorhandene Backups, älteste zuerst."""
+    return sorted(glob.glob(os.path.join(backup_dir, BACKUP_PATTERN)))
+
+
+def rotate_backups(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> list:
+    """Löscht alle bis auf die neuesten `keep` Backups."""
+    backups = list_backups(backup_dir)
+    removed = backups[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def backup_database(backup_dir: str = BACKUP_DIR, database: str = DATABASE_PATH) -> str:
+    """Erstellt ein komprimiertes Backup. Gibt den Pfad der Backup-Datei zurück."""
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    target = os.path.join(backup_dir, f"xovis_counts-{stamp}.db.gz")
+    tmp_db = os.path.join(backup_dir, f".xovis_counts-{stamp}.db.tmp")
+
+    started = time.monotonic()
+
+    try:
+        src = sqlite3.connect(database)
+        dst = sqlite3.connect(tmp_db)
+        try:
+            src.backup(dst, pages=-1)
+        finally:
+            dst.close()
+            src.close()
+
+        with open(tmp_db, "rb") as f_in, gzip.open(f"{target}.tmp", "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.replace(f"{target}.tmp", target)
+    finally:
+        for path in (tmp_db, f"{target}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    removed = rotate_backups(backup_dir)
+    logger.info(
+        f"Backup erstellt: {target} ({os.path.getsize(target) // 1024} KB, "
+        f"{time.monotonic() - started:.1f}s), {len(removed)} alte Backups gelöscht"
+    )
+    return target
+
+
+async def run_backup(backup_dir: str = BACKUP_DIR, database: str = DATABASE_PATH) -> str:
+    """Backup im Hintergrund-Thread ausführen (blockiert den Event-Loop nicht)."""
+    return await asyncio.to_thread(backup_database, backup_dir, database)
+
+
+def _decompress(path: str, target: str):
+    with gzip.open(path, "rb") as f_in, open(target, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+
+
+def verify_backup(path: str) -> dict:
+    """Entpackt ein Backup temporär und prüft es mit PRAGMA integrity_check."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_db = os.path.join(tmp_dir, "verify.db")
+        _decompress(path, tmp_db)
+        conn = sqlite3.connect(tmp_db)
+        try:
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )]
+            rows = conn.execute("SELECT COUNT(*) FROM counts").fetchone()[0] if "counts" in tables else 0
+        finally:
+            conn.close()
+    return {"ok": integrity == "ok", "integrity": integrity, "tables": tables, "counts": rows}
+
+
+def restore_backup(path: str, target: str = DATABASE_PATH):
+    """Spielt ein geprüftes Backup zurück. Die App darf dabei nicht laufen."""
+    result = verify_backup(path)
+    if not result["ok"]:
+        raise ValueError(f"Backup {path} ist beschädigt: {result['integrity']}")
+
+    tmp_target = f"{target}.restore"
+    _decompress(path, tmp_target)
+    # WAL-Dateien der alten Datenbank gehören nicht zum Backup
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    os.replace(tmp_target, target)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if command == "backup":
+        print(backup_database())
+    elif command == "list":
+        for backup in list_backups():
+            print(f"{backup}  ({os.path.getsize(backup) // 1024} KB)")
+    elif command == "verify" and len(sys.argv) > 2:
+        result = verify_backup(sys.argv[2])
+        print(f"Integrität: {result['integrity']}")
+        print(f"Tabellen:   {', '.join(result['tables'])}")
+        print(f"counts:     {result['counts']} Einträge")
+        sys.exit(0 if result["ok"] else 1)
+    elif command == "restore" and len(sys.argv) > 2:
+        print(f"Stelle {sys.argv[2]} nach {DATABASE_PATH} wieder her...")
+        restore_backup(sys.argv[2])
+        print("Wiederherstellung abgeschlossen.")
+    else:
+        print("Verwendung: python backup.py backup | list | verify <datei> | restore <datei>")
+        sys.exit(1)
@@ -0,0 +1,100 @@
+"""HTTP-Caching für Frontend-Dateien und API-Antworten.
+
+Statische Dateien werden in index.html mit einem Inhalts-Hash versioniert
+(/static/app.js?v=<hash>) und mit diesem Parameter als "immutable"
+ausgeliefert. Eine Änderung an der Datei ergibt eine neue URL.
+
+API-Endpoints setzen ihre Cache-Dauer mit set_cache(). Die ETag-Middleware
+ergänzt bei GET-Antworten unter /api/ einen ETag und beantwortet passende
+If-None-Match-Anfragen mit 304. Mit diesen Headern kann nginx die Antworten
+kurz zwischenspeichern (Micro-Cache), auch wenn viele Displays gleichzeitig
+pollen.
+"""
+import hashlib
+import os
+import re
+from typing import Dict, Tuple
+
+from fastapi import Request, Response
+from fastapi.staticfiles import StaticFiles
+
+from config import FRONTEND_DIR
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+_ASSET_PATTERN = re.compile(r'(["\'])/static/([^"\'?]+)\1')
+
+# Gerenderte index.html, neu erzeugt wenn sich eine Datei ändert
+_index_cache: Dict[str, Tuple[tuple, str]] = {}
+
+
+def file_hash(path: str) -> str:
+    """Kurzer Inhalts-Hash einer Datei."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def render_index(frontend_dir: str = FRONTEND_DIR) -> str:
+    """index.html mit versionierten /static-URLs."""
+    with open(os.path.join(frontend_dir, "index.html"), "r", encoding="utf-8") as f:
+        html = f.read()
+
+    paths = {name: os.path.join(frontend_dir, name)
+             for name in {m.group(2) for m in _ASSET_PATTERN.finditer(html)}}
+    paths = {name: path for name, path in paths.items() if os.path.exists(path)}
+    key = (html, tuple(sorted((name, os.path.getmtime(path)) for name, path in paths.items())))
+
+    cached = _index_cache.get(frontend_dir)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    versions = {name: file_hash(path) for name, path in paths.items()}
+
+    def versioned(match):
+        quote, name = match.group(1), match.group(2)
+        if name not in versions:
+            return match.group(0)
+        return f"{quote}/static/{name}?v={versions[name]}{quote}"
+
+    rendered = _ASSET_PATTERN.sub(versioned, html)
+    _index_cache[frontend_dir] = (key, rendered)
+    return rendered
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles mit Cache-Control: versionierte URLs sind unveränderlich."""
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            if b"v=" in scope.get("query_string", b""):
+                response.headers["Cache-Control"] = IMMUTABLE
+            else:
+                response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+def set_cache(response: Response, max_age: int):
+    """Setzt die Cache-Dauer einer API-Antwort (0 = nicht cachen)."""
+    if max_age > 0:
+        response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    else:
+        response.headers["Cache-Control"] = "no-store"
+
+
+async def etag_middleware(request: Request, call_next):
+    """Ergänzt GET-Antworten unter /api/ um einen ETag, beantwortet If-None-Match mit 304."""
+    response = await call_next(request)
+    if (request.method != "GET" or not request.url.path.startswith("/api/")
+            or response.status_code != 200
+            or "public" not in response.headers.get("cache-control", "")):
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    etag = f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    headers["ETag"] = etag
+
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, status_code=response.status_code, headers=headers)
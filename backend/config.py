@@ -18,5 +18,92 @@ XOVIS_API_LIVE = os.getenv("XOVIS_API_LIVE", "/api/v5/live")
 # Datenbank
 DATABASE_PATH = os.getenv("DATABASE_PATH", "/data/xovis_counts.db")
 
+# Zeitzone des Standorts (Tages-/Stunden-Auswertung, Mitternachts-Reset)
+SITE_TIMEZONE = os.getenv("SITE_TIMEZONE", os.getenv("TZ", "Europe/Vienna"))
+
+# Standorte (siehe sites.py). Ohne SITES_FILE: ein Standort mit DATABASE_PATH
+SITES_FILE = os.getenv("SITES_FILE", "")
+DEFAULT_SITE = os.getenv("DEFAULT_SITE", "default")
+SITE_NAME = os.getenv("SITE_NAME", "MedZentrum Weiz")
+# Optionaler Token für /api/webhook (Header X-Webhook-Token)
+WEBHOOK_TOKEN = os.getenv("WEBHOOK_TOKEN", "")
+# Max. offen gehaltene, freie Datenbank-Verbindungen (alle Standorte zusammen)
+SITE_DB_CACHE_SIZE = int(os.getenv("SITE_DB_CACHE_SIZE", "16"))
+
 # Polling Intervall in Sekunden
 POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "60"))
+
+# Anzahl Worker-Prozesse (uvicorn --workers)
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# Gültigkeit des Leader-Locks für geplante Jobs in Sekunden
+LEADER_LOCK_TTL = int(os.getenv("LEADER_LOCK_TTL", "60"))
+
+
+# Webhook-Überlastschutz
+WEBHOOK_MAX_BODY_BYTES = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", str(1024 * 1024)))
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "32"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Zeitfenster (Sekunden) in dem wartende Pushes zu einem DB-Schreibvorgang zusammengefasst werden
+WEBHOOK_COALESCE_WINDOW = float(os.getenv("WEBHOOK_COALESCE_WINDOW", "0.05"))
+WEBHOOK_RETRY_AFTER = int(os.getenv("WEBHOOK_RETRY_AFTER", "5"))
+WEBHOOK_RESPONSE_TIMEOUT = float(os.getenv("WEBHOOK_RESPONSE_TIMEOUT", "10"))
+
+# Write-Ahead-Spool für Webhooks (eine Datei pro Worker, siehe spool.py)
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(os.path.dirname(DATABASE_PATH), "spool"))
+# Ab dieser Größe wird eine vollständig angewendete Spool-Datei durch eine neue ersetzt
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(1024 * 1024)))
+
+# Kumulative Sensorzähler: Überlaufgrenze und max. Sprung, der noch als Überlauf gilt
+COUNTER_WRAP = int(os.getenv("COUNTER_WRAP", str(2 ** 32)))
+COUNTER_WRAP_WINDOW = int(os.getenv("COUNTER_WRAP_WINDOW", "10000"))
+# Neustart nur, wenn der Rohwert höchstens so weit über 0 liegt (sonst veralteter Wert)
+COUNTER_RESET_WINDOW = int(os.getenv("COUNTER_RESET_WINDOW", "100"))
+
+# Snapshot des In-Memory-Puffers für heutige Minutenwerte
+TIMESERIES_SNAPSHOT_PATH = os.getenv(
+    "TIMESERIES_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(DATABASE_PATH), "today_buffer.bin")
+)
+
+# Online-Backup der Datenbank
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(DATABASE_PATH), "backups"))
+BACKUP_HOUR = int(os.getenv("BACKUP_HOUR", "3"))
+BACKUP_MINUTE = int(os.getenv("BACKUP_MINUTE", "30"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "14"))
+
+# Öffnungszeiten und Feiertage, z.B. "Mo-Fr 07:00-19:00; Sa 08:00-12:00"
+OPENING_HOURS = os.getenv("OPENING_HOURS", "Mo-Fr 06:00-20:00")
+# Feiertage/Schließtage als Liste "YYYY-MM-DD,YYYY-MM-DD" und/oder Datei (ein Datum pro Zeile)
+HOLIDAYS = os.getenv("HOLIDAYS", "")
+HOLIDAYS_FILE = os.getenv("HOLIDAYS_FILE", "")
+
+# Drift-Korrektur der Belegung (siehe drift.py): Gebäude gilt so viele Minuten
+# nach Schließung als leer bzw. nach so vielen Minuten ohne Ein-/Austritt (0 = aus)
+DRIFT_CLOSE_GRACE_MINUTES = int(os.getenv("DRIFT_CLOSE_GRACE_MINUTES", "30"))
+DRIFT_IDLE_MINUTES = int(os.getenv("DRIFT_IDLE_MINUTES", "120"))
+
+# Alarmierung (0 = Regel deaktiviert)
+ALERT_MAX_OCCUPANCY = int(os.getenv("ALERT_MAX_OCCUPANCY", "50"))
+ALERT_INFLOW_PER_5MIN = int(os.getenv("ALERT_INFLOW_PER_5MIN", "0"))
+ALERT_SILENCE_MINUTES = int(os.getenv("ALERT_SILENCE_MINUTES", "30"))
+# Alarm endet erst, wenn der Wert um ALERT_HYSTERESIS unter die Schwelle fällt
+ALERT_HYSTERESIS = int(os.getenv("ALERT_HYSTERESIS", "5"))
+ALERT_COOLDOWN_MINUTES = int(os.getenv("ALERT_COOLDOWN_MINUTES", "15"))
+# Ziele: log, file, webhook (kommagetrennt)
+ALERT_SINKS = os.getenv("ALERT_SINKS", "log")
+ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL", "")
+ALERT_FILE_PATH = os.getenv(
+    "ALERT_FILE_PATH", os.path.join(os.path.dirname(DATABASE_PATH), "alerts.jsonl")
+)
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "100"))
+ALERT_RETRIES = int(os.getenv("ALERT_RETRIES", "3"))
+
+# Cache-Dauer (Sekunden) für API-Antworten (Cache-Control max-age)
+CACHE_LIVE_SECONDS = int(os.getenv("CACHE_LIVE_SECONDS", "2"))
+CACHE_TODAY_SECONDS = int(os.getenv("CACHE_TODAY_SECONDS", "30"))
+CACHE_STATS_SECONDS = int(os.getenv("CACHE_STATS_SECONDS", "300"))
+CACHE_CLOSED_SECONDS = int(os.getenv("CACHE_CLOSED_SECONDS", "86400"))
+
+# Frontend-Verzeichnis
+FRONTEND_DIR = os.getenv("FRONTEND_DIR", "/app/frontend")
@@ -0,0 +1,70 @@
+"""Koordination mehrerer Worker-Prozesse über SQLite.
+
+Geplante Jobs (z.B. der Mitternachts-Reset) dürfen nur von einem Prozess
+ausgeführt werden. Dazu hält ein Worker einen zeitlich begrenzten Lock in
+der Tabelle ``locks`` und verlängert ihn regelmäßig. Fällt er aus, läuft
+der Lock ab und ein anderer Worker übernimmt.
+
+Die Locks liegen in der Datenbank des ersten Standorts (siehe sites.py).
+"""
+import functools
+import logging
+import os
+import socket
+import time
+
+from config import LEADER_LOCK_TTL
+from sites import PRIMARY_SITE, site_db
+
+logger = logging.getLogger(__name__)
+
+# Eindeutige Kennung dieses Worker-Prozesses
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+LEADER_LOCK = "scheduler"
+
+
+async def try_acquire_lock(name: str, ttl: int = LEADER_LOCK_TTL) -> bool:
+    """Holt oder verlängert einen Lock. Gibt True zurück wenn wir ihn halten."""
+    now = time.time()
+    async with site_db(PRIMARY_SITE) as db:
+        await db.execute("""
+            INSERT INTO locks (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                owner = excluded.owner,
+                expires_at = excluded.expires_at
+            WHERE locks.owner = excluded.owner OR locks.expires_at < ?
+        """, (name, OWNER_ID, now + ttl, now))
+        await db.commit()
+        async with db.execute("SELECT owner FROM locks WHERE name = ?", (name,)) as cursor:
+            row = await cursor.fetchone()
+            return row is not None and row[0] == OWNER_ID
+
+
+async def release_lock(name: str):
+    """Gibt einen Lock frei, falls wir ihn halten (z.B. beim Herunterfahren)."""
+    async with site_db(PRIMARY_SITE) as db:
+        await db.execute(
+            "DELETE FROM locks WHERE name = ? AND owner = ?", (name, OWNER_ID)
+        )
+        await db.commit()
+
+
+async def renew_leadership():
+    """Periodischer Job: Leader-Lock holen bzw. verlängern."""
+    try:
+        if await try_acquire_lock(LEADER_LOCK):
+            logger.debug(f"Leader-Lock gehalten von {OWNER_ID}")
+    except Exception as e:
+        logger.error(f"Fehler beim Verlängern des Leader-Locks: {e}")
+
+
+def leader_only(job):
+    """Decorator: Geplanten Job nur im Worker ausführen, der den Leader-Lock hält."""
+    @functools.wraps(job)
+    async def wrapper(*args, **kwargs):
+        if not await try_acquire_lock(LEADER_LOCK):
+            logger.debug(f"Job {job.__name__} übersprungen (kein Leader)")
+            return None
+        return await job(*args, **kwargs)
+    return wrapper
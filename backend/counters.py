@@ -0,0 +1,66 @@
+"""Erkennung von Zähler-Resets und Überläufen bei kumulativen Sensorwerten.
+
+Der Live Data Push liefert kumulative Zählerstände. Der Tageswert ergibt
+sich als `roh - base`. Startet der Sensor neu oder läuft der Zähler über,
+springt der Rohwert zurück - ohne Korrektur würde der Tageswert auf 0
+geklemmt und die Zählungen seit dem Sprung gingen verloren.
+
+Pro Zähler wird deshalb der zuletzt gesehene Rohwert gehalten (Spalten
+raw_in/raw_out der live-Zeile). Ein Rückschritt wird in O(1) eingeordnet
+und der Base-Offset so verschoben, dass der Tageswert nahtlos weiterläuft:
+
+- wrap:  Zähler ist über COUNTER_WRAP gelaufen -> base - COUNTER_WRAP
+- reset: Zähler beginnt wieder bei 0           -> base - letzter Rohwert
+- stale: jeder andere Rückschritt (verspäteter oder wiederholter Push,
+         Spool-Replay) -> wird ignoriert, Base und Rohwert bleiben
+
+Als Reset gilt ein Rohwert nahe 0 (höchstens COUNTER_RESET_WINDOW). Meldet
+ein neu gestarteter Sensor seinen ersten Wert erst später, ist auch dieser
+zunächst "stale". Der verworfene Rohwert wird gemerkt (stale_in/stale_out):
+steigt der nächste Rückschritt von dort aus weiter, läuft der Zähler auf dem
+neuen Niveau - das gilt dann als Reset. Ein normaler Wert löscht die Merkung.
+"""
+from typing import Optional, Tuple
+
+from config import COUNTER_RESET_WINDOW, COUNTER_WRAP, COUNTER_WRAP_WINDOW
+
+RESET = "reset"
+WRAP = "wrap"
+STALE = "stale"
+
+
+def classify(last_raw: Optional[int], raw: int,
+             wrap: int = COUNTER_WRAP, window: int = COUNTER_WRAP_WINDOW,
+             reset_window: int = COUNTER_RESET_WINDOW,
+             last_stale: Optional[int] = None) -> Optional[str]:
+    """Ordnet einen neuen Rohwert ein: None (normal), "wrap", "reset" oder "stale".
+
+    last_stale: zuletzt als "stale" verworfener Rohwert (None, wenn seitdem
+    ein normaler Wert kam).
+    """
+    if last_raw is None or raw >= last_raw:
+        return None
+    # Überlauf: kurz vor der Grenze gewesen, jetzt wieder knapp über 0
+    if 0 <= wrap - last_raw + raw <= window:
+        return WRAP
+    # Neustart: Zähler beginnt wieder bei (fast) 0
+    if raw <= reset_window:
+        return RESET
+    # Neustart, erst später gemeldet: zählt vom verworfenen Wert aus weiter
+    if last_stale is not None and last_stale < raw:
+        return RESET
+    return STALE
+
+
+def rebase(base: int, last_raw: Optional[int], raw: int,
+           last_stale: Optional[int] = None) -> Tuple[int, Optional[str]]:
+    """Neuer Base-Offset für einen Rohwert und ggf. die erkannte Unstetigkeit.
+
+    Bei "stale" bleibt der Base-Offset unverändert; der Wert ist zu verwerfen.
+    """
+    kind = classify(last_raw, raw, last_stale=last_stale)
+    if kind == WRAP:
+        return base - COUNTER_WRAP, kind
+    if kind == RESET:
+        return base - last_raw, kind
+    return base, kind
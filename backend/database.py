@@ -1,13 +1,35 @@
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime
+from typing import Optional, Tuple
 
 import aiosqlite
 
-from config import DATABASE_PATH
+from counters import STALE, rebase
+from drift import SCHEMA as DRIFT_SCHEMA, advance as advance_drift, state_from_live
+from flow import SCHEMA as FLOW_SCHEMA, close_flow, record_flow
+from sites import site_db
+from timeutil import (
+    day_from_key, day_key, day_range, from_epoch, local_keys, now_epoch, now_local, utc_offset
+)
+
+logger = logging.getLogger(__name__)
+
+# Callbacks nach einem Tages-Reset (z.B. um In-Memory-Caches zu leeren)
+_reset_hooks = []
+
+
+def on_daily_reset(callback):
+    """Registriert einen Callback, der nach jedem Tages-Reset aufgerufen wird."""
+    _reset_hooks.append(callback)
+    return callback
 
 
 async def init_db():
     """Initialisiert die Datenbank."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with site_db() as db:
+        # WAL erlaubt parallele Leser neben einem Schreiber (mehrere Worker)
+        await db.execute("PRAGMA journal_mode=WAL")
+
         # Historische Zählungen
         await db.execute("""
             CREATE TABLE IF NOT EXISTS counts (
@@ -20,6 +42,31 @@ async def init_db():
         """)
         await db.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON counts(timestamp)")
 
+        # UTC-Epoch und vorberechnete lokale Schlüssel (siehe timeutil.py)
+        for column in [
+            "ts_epoch INTEGER",
+            "local_day INTEGER",
+            "local_hour INTEGER",
+            "local_minute INTEGER",
+            # driftkorrigierte Belegung (siehe drift.py), occupancy bleibt der Rohwert
+            "occupancy_corrected INTEGER",
+        ]:
+            try:
+                await db.execute(f"ALTER TABLE counts ADD COLUMN {column}")
+            except aiosqlite.OperationalError:
+                pass  # Spalte existiert bereits
+        # Indizes vor der Migration: sie aktualisiert stundenweise über local_day/local_hour
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_counts_epoch ON counts(ts_epoch)")
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_counts_local ON counts(local_day, local_hour)"
+        )
+        await _backfill_time_keys(db)
+        # Klein: nur Einträge, die noch keine Drift-Korrektur haben
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_counts_uncorrected ON counts(local_day) "
+            "WHERE occupancy_corrected IS NULL"
+        )
+
         # Live-Werte (nur eine Zeile)
         await db.execute("""
             CREATE TABLE IF NOT EXISTS live (
@@ -37,6 +84,19 @@ async def init_db():
             "last_reset_date TEXT",
             "base_in INTEGER DEFAULT 0",
             "base_out INTEGER DEFAULT 0",
+            # zuletzt empfangener kumulativer Rohwert (Reset-/Überlauf-Erkennung)
+            "raw_in INTEGER",
+            "raw_out INTEGER",
+            # zuletzt als veraltet verworfener Rohwert (später gemeldeter Reset)
+            "stale_in INTEGER",
+            "stale_out INTEGER",
+            # bis hierhin ist die Belegung in flow_hourly verbucht (siehe flow.py)
+            "flow_epoch INTEGER",
+            # Drift-Korrektur: Offset und Stand beim letzten Anker (siehe drift.py)
+            "occupancy_corrected INTEGER",
+            "drift_offset INTEGER DEFAULT 0",
+            "drift_anchor_epoch INTEGER",
+            "drift_anchor_in INTEGER DEFAULT 0",
         ]:
             try:
                 await db.execute(f"ALTER TABLE live ADD COLUMN {column}")
@@ -46,82 +106,207 @@ async def init_db():
         # Initialen Live-Eintrag erstellen (mit last_reset_date für korrekten ersten Reset)
         await db.execute("""
             INSERT OR IGNORE INTO live (id, count_in, count_out, occupancy, last_reset_date)
-            VALUES (1, 0, 0, 0, date('now', 'localtime'))
+            VALUES (1, 0, 0, 0, ?)
+        """, (now_local().strftime("%Y-%m-%d"),))
+
+        # Personenfluss und Verweildauer (siehe flow.py)
+        for statement in FLOW_SCHEMA:
+            await db.execute(statement)
+        await db.execute(DRIFT_SCHEMA)
+
+        # Erkannte Zähler-Resets und -Überläufe des Sensors (siehe counters.py)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS counter_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME,
+                ts_epoch INTEGER,
+                counter TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                last_raw INTEGER,
+                raw INTEGER NOT NULL,
+                base_before INTEGER,
+                base_after INTEGER
+            )
+        """)
+        try:
+            # Standort-Zeit statt Container-Zeitzone (Migration für bestehende DBs)
+            await db.execute("ALTER TABLE counter_events ADD COLUMN ts_epoch INTEGER")
+        except aiosqlite.OperationalError:
+            pass  # Spalte existiert bereits
+
+        # Koordination zwischen Worker-Prozessen (Spool-Offsets in meta, Leader-Lock)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS locks (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
         """)
 
-        # Bei jedem Start: Reset erzwingen damit akkumulierte Fehler bereinigt werden.
-        # Setzt last_reset_date auf gestern, sodass check_daily_reset() beim nächsten
-        # Aufruf einen sauberen Tages-Reset mit korrekten Base-Offsets durchführt.
-        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        # Materialisierte Aggregate abgeschlossener Tage (siehe analytics.py)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS daily_totals (
+                date TEXT PRIMARY KEY,
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                weekday INTEGER NOT NULL,
+                total_in INTEGER DEFAULT 0,
+                total_out INTEGER DEFAULT 0,
+                max_occupancy INTEGER DEFAULT 0,
+                peak_hour INTEGER,
+                peak_hour_in INTEGER DEFAULT 0
+            )
+        """)
         await db.execute(
-            "UPDATE live SET last_reset_date = ? WHERE id = 1",
-            (yesterday,)
+            "CREATE INDEX IF NOT EXISTS idx_daily_totals_total_in ON daily_totals(total_in)"
         )
-
+        # Kalender-Flags pro Tag (Migration für bestehende DBs, siehe opening_hours.py)
+        for column in [
+            "is_open INTEGER DEFAULT 1",
+            "is_holiday INTEGER DEFAULT 0",
+            "open_minute INTEGER",
+            "close_minute INTEGER",
+        ]:
+            try:
+                await db.execute(f"ALTER TABLE daily_totals ADD COLUMN {column}")
+            except aiosqlite.OperationalError:
+                pass  # Spalte existiert bereits
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_daily_totals_open ON daily_totals(is_open, date)"
+        )
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS hourly_totals (
+                date TEXT NOT NULL,
+                hour INTEGER NOT NULL,
+                total_in INTEGER DEFAULT 0,
+                total_out INTEGER DEFAULT 0,
+                max_occupancy INTEGER DEFAULT 0,
+                PRIMARY KEY (date, hour)
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS weekday_profile (
+                weekday INTEGER NOT NULL,
+                hour INTEGER NOT NULL,
+                days INTEGER DEFAULT 0,
+                sum_in INTEGER DEFAULT 0,
+                sum_out INTEGER DEFAULT 0,
+                sum_max_occupancy INTEGER DEFAULT 0,
+                PRIMARY KEY (weekday, hour)
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS monthly_totals (
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                days INTEGER DEFAULT 0,
+                total_in INTEGER DEFAULT 0,
+                total_out INTEGER DEFAULT 0,
+                max_occupancy INTEGER DEFAULT 0,
+                PRIMARY KEY (year, month)
+            )
+        """)
         await db.commit()
 
 
-async def update_live_count(count_in: int, count_out: int, occupancy: int):
-    """Aktualisiert die Live-Zählwerte."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+async def _backfill_time_keys(db):
+    """Migration: Zeit-Schlüssel für bestehende Einträge (lokaler Zeitstempel-Text) nachtragen.
+
+    Tag, Stunde und Minute stehen direkt im Text. Der UTC-Offset wird je
+    lokaler Stunde einmal bestimmt, nicht je Zeile.
+    """
+    await db.execute("""
+        UPDATE counts SET
+            local_day = CAST(replace(substr(timestamp, 1, 10), '-', '') AS INTEGER),
+            local_hour = CAST(substr(timestamp, 12, 2) AS INTEGER),
+            local_minute = CAST(substr(timestamp, 12, 2) AS INTEGER) * 60
+                         + CAST(substr(timestamp, 15, 2) AS INTEGER)
+        WHERE local_day IS NULL
+    """)
+    async with db.execute("""
+        SELECT DISTINCT local_day, local_hour FROM counts WHERE ts_epoch IS NULL
+    """) as cursor:
+        hours = await cursor.fetchall()
+    for local_day, local_hour in hours:
+        local = datetime.strptime(f"{local_day} {local_hour:02d}", "%Y%m%d %H")
+        # strftime('%s') liest den Text als UTC - Standort-Offset abziehen
         await db.execute("""
-            UPDATE live SET
-                count_in = ?,
-                count_out = ?,
-                occupancy = ?,
-                last_update = ?,
-                last_reset_date = COALESCE(last_reset_date, date('now', 'localtime'))
-            WHERE id = 1
-        """, (count_in, count_out, occupancy, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        await db.commit()
+            UPDATE counts SET ts_epoch = CAST(strftime('%s', timestamp) AS INTEGER) - ?
+            WHERE local_day = ? AND local_hour = ? AND ts_epoch IS NULL
+        """, (utc_offset(local), local_day, local_hour))
+    await db.commit()
 
 
 async def check_daily_reset():
     """Prüft ob ein täglicher Reset nötig ist und führt ihn durch."""
-    global _last_saved_values
+    today = now_local().strftime("%Y-%m-%d")
 
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with site_db() as db:
         db.row_factory = aiosqlite.Row
+
+        # Schneller Lesezugriff ohne Schreibsperre (wird bei jedem Poll aufgerufen)
+        async with db.execute("SELECT last_reset_date FROM live WHERE id = 1") as cursor:
+            row = await cursor.fetchone()
+            if not row or row["last_reset_date"] == today:
+                return False
+
+        # Schreibsperre holen und erneut prüfen - ein anderer Worker könnte
+        # den Reset inzwischen schon durchgeführt haben
+        await db.execute("BEGIN IMMEDIATE")
         async with db.execute("SELECT * FROM live WHERE id = 1") as cursor:
             row = await cursor.fetchone()
-            if row:
-                last_reset = row["last_reset_date"]
-                today = datetime.now().strftime("%Y-%m-%d")
-
-                if not last_reset or last_reset != today:
-                    # Neuer Tag - Base-Offset für kumulative Sensorwerte aktualisieren
-                    new_base_in = (row["base_in"] or 0) + (row["count_in"] or 0)
-                    new_base_out = (row["base_out"] or 0) + (row["count_out"] or 0)
-
-                    # Counter zurücksetzen, Base-Offset speichern
-                    await db.execute("""
-                        UPDATE live SET
-                            count_in = 0,
-                            count_out = 0,
-                            occupancy = 0,
-                            base_in = ?,
-                            base_out = ?,
-                            last_reset_date = ?
-                        WHERE id = 1
-                    """, (new_base_in, new_base_out, today))
-
-                    # Alte counts-Einträge von heute löschen (enthalten
-                    # akkumulierte Werte von vor dem Reset)
-                    await db.execute(
-                        "DELETE FROM counts WHERE date(timestamp) = ?",
-                        (today,)
-                    )
-                    await db.commit()
-
-                    # In-Memory-Cache zurücksetzen
-                    _last_saved_values = {"count_in": -1, "count_out": -1}
-                    return True
-    return False
+        if row["last_reset_date"] == today:
+            await db.rollback()
+            return False
+
+        # Neuer Tag - Base-Offset für kumulative Sensorwerte aktualisieren
+        # (auf den letzten Rohwert, sonst aus Base + Tageswert)
+        new_base_in = row["raw_in"]
+        if new_base_in is None:
+            new_base_in = (row["base_in"] or 0) + (row["count_in"] or 0)
+        new_base_out = row["raw_out"]
+        if new_base_out is None:
+            new_base_out = (row["base_out"] or 0) + (row["count_out"] or 0)
+
+        # Belegung bis zum Reset noch in den Fluss-Rollups verbuchen
+        await close_flow(db, row, now_epoch())
+
+        # Counter zurücksetzen, Base-Offset speichern, Drift-Korrektur neu beginnen
+        await db.execute("""
+            UPDATE live SET
+                count_in = 0,
+                count_out = 0,
+                occupancy = 0,
+                occupancy_corrected = 0,
+                drift_offset = 0,
+                drift_anchor_epoch = ?,
+                drift_anchor_in = 0,
+                base_in = ?,
+                base_out = ?,
+                last_reset_date = ?
+            WHERE id = 1
+        """, (now_epoch(), new_base_in, new_base_out, today))
+
+        # Alte counts-Einträge von heute löschen (enthalten
+        # akkumulierte Werte von vor dem Reset)
+        for table in ("counts", "flow_hourly", "flow_minutes", "drift_anchors"):
+            await db.execute(f"DELETE FROM {table} WHERE local_day = ?", (day_key(today),))
+        await db.commit()
+
+    for callback in _reset_hooks:
+        callback(today)
+    return True
 
 
 async def get_live_count() -> dict:
     """Holt die aktuellen Live-Werte."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with site_db() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("SELECT * FROM live WHERE id = 1") as cursor:
             row = await cursor.fetchone()
@@ -130,65 +315,21 @@ async def get_live_count() -> dict:
             return {"count_in": 0, "count_out": 0, "occupancy": 0, "last_update": None}
 
 
-async def get_today_totals() -> dict:
-    """Holt die heutigen Tagessummen aus der counts-Tabelle."""
-    today = datetime.now().strftime("%Y-%m-%d")
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("""
-            SELECT
-                COALESCE(MAX(count_in), 0) as count_in,
-                COALESCE(MAX(count_out), 0) as count_out,
-                COALESCE(MAX(occupancy), 0) as occupancy
-            FROM counts
-            WHERE date(timestamp) = ?
-        """, (today,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return dict(row)
-            return {"count_in": 0, "count_out": 0, "occupancy": 0}
-
-
-async def save_count(count_in: int, count_out: int, occupancy: int):
-    """Speichert einen Zählwert in der Historie (mit lokaler Zeitzone)."""
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            "INSERT INTO counts (timestamp, count_in, count_out, occupancy) VALUES (?, ?, ?, ?)",
-            (now, count_in, count_out, occupancy)
-        )
-        await db.commit()
-
-
-async def get_latest_count():
-    """Holt den letzten gespeicherten Wert."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM counts ORDER BY timestamp DESC LIMIT 1"
-        ) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
-
-
 async def get_hourly_stats(date: datetime):
     """Stündliche Statistiken für einen Tag - Differenzwerte pro Stunde."""
-    start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-    end = start + timedelta(days=1)
-
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with site_db() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("""
             SELECT
-                strftime('%H', timestamp) as hour,
+                printf('%02d', local_hour) as hour,
                 MAX(count_in) as cumulative_in,
                 MAX(count_out) as cumulative_out,
                 MAX(occupancy) as max_occupancy
             FROM counts
-            WHERE timestamp BETWEEN ? AND ?
-            GROUP BY strftime('%H', timestamp)
-            ORDER BY hour
-        """, (start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S"))) as cursor:
+            WHERE local_day = ?
+            GROUP BY local_hour
+            ORDER BY local_hour
+        """, (day_key(date),)) as cursor:
             rows = [dict(row) for row in await cursor.fetchall()]
 
     # Berechne Differenz pro Stunde
@@ -210,63 +351,309 @@ async def get_hourly_stats(date: datetime):
     return result
 
 
-async def get_daily_stats(start_date: datetime, days: int = 7):
-    """Tägliche Statistiken."""
-    start = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    end = start + timedelta(days=days)
-
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+async def get_interval_stats(date: datetime, minutes: int):
+    """Statistiken für einen Tag in Intervallen von `minutes` Minuten - Differenzwerte."""
+    async with site_db() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("""
             SELECT
-                date(timestamp) as date,
-                MAX(count_in) as total_in,
-                MAX(count_out) as total_out,
+                local_minute / ? as bucket,
+                MAX(count_in) as cumulative_in,
+                MAX(count_out) as cumulative_out,
                 MAX(occupancy) as max_occupancy
             FROM counts
-            WHERE timestamp BETWEEN ? AND ?
-            GROUP BY date(timestamp)
-            ORDER BY date
-        """, (start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S"))) as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+            WHERE local_day = ?
+            GROUP BY bucket
+            ORDER BY bucket
+        """, (minutes, day_key(date))) as cursor:
+            rows = [dict(row) for row in await cursor.fetchall()]
+
+    result = []
+    prev_in = 0
+    prev_out = 0
+    for row in rows:
+        minute = row['bucket'] * minutes
+        result.append({
+            'time': f"{minute // 60:02d}:{minute % 60:02d}",
+            'total_in': row['cumulative_in'] - prev_in,
+            'total_out': row['cumulative_out'] - prev_out,
+            'max_occupancy': row['max_occupancy']
+        })
+        prev_in = row['cumulative_in']
+        prev_out = row['cumulative_out']
+
+    return result
+
+
+async def get_counts_since(since_epoch: int):
+    """Rohwerte der Historie ab einem UTC-Epoch (für den Aufbau von Caches)."""
+    async with site_db() as db:
+        async with db.execute(
+            "SELECT ts_epoch, count_in, count_out, occupancy FROM counts "
+            "WHERE ts_epoch > ? ORDER BY ts_epoch",
+            (since_epoch,)
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+async def get_daily_stats(start_date: datetime, days: int = 7):
+    """Tägliche Statistiken."""
+    return await _get_days(*day_range(start_date, days))
 
 
 async def get_monthly_stats(year: int, month: int):
     """Monatliche Statistiken."""
-    start = datetime(year, month, 1)
-    if month == 12:
-        end = datetime(year + 1, 1, 1)
-    else:
-        end = datetime(year, month + 1, 1)
+    return await _get_days(year * 10000 + month * 100 + 1, year * 10000 + month * 100 + 31)
 
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+
+async def _get_days(first_day: int, last_day: int):
+    """Tageswerte für local_day-Schlüssel im Bereich (inkl. Grenzen)."""
+    async with site_db() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("""
             SELECT
-                date(timestamp) as date,
+                local_day,
                 MAX(count_in) as total_in,
                 MAX(count_out) as total_out,
                 MAX(occupancy) as max_occupancy
             FROM counts
-            WHERE timestamp BETWEEN ? AND ?
-            GROUP BY date(timestamp)
-            ORDER BY date
-        """, (start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S"))) as cursor:
+            WHERE local_day BETWEEN ? AND ?
+            GROUP BY local_day
+            ORDER BY local_day
+        """, (first_day, last_day)) as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {'date': day_from_key(row['local_day']), 'total_in': row['total_in'],
+         'total_out': row['total_out'], 'max_occupancy': row['max_occupancy']}
+        for row in rows
+    ]
+
+
+async def _insert_count_if_changed(db, count_in: int, count_out: int, occupancy: int,
+                                   occupancy_corrected: Optional[int] = None,
+                                   epoch: Optional[int] = None) -> bool:
+    """Fügt einen Historien-Eintrag nur ein, wenn er sich vom letzten unterscheidet.
+
+    Der Vergleich läuft in SQL statt über einen prozesslokalen Cache, damit
+    mehrere Worker-Prozesse keine doppelten Einträge erzeugen.
+    """
+    if epoch is None:
+        epoch = now_epoch()
+    timestamp, local_day, local_hour, local_minute = local_keys(epoch)
+    cursor = await db.execute("""
+        INSERT INTO counts (timestamp, ts_epoch, local_day, local_hour, local_minute,
+                            count_in, count_out, occupancy, occupancy_corrected)
+        SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM (SELECT count_in, count_out FROM counts ORDER BY id DESC LIMIT 1)
+            WHERE count_in = ? AND count_out = ?
+        )
+    """, (timestamp, epoch, local_day, local_hour, local_minute,
+          count_in, count_out, occupancy, occupancy_corrected, count_in, count_out))
+    return cursor.rowcount > 0
+
+
+async def _track_raw(db, live, counter: str, raw: int, epoch: int) -> Optional[int]:
+    """Merkt sich den Rohwert eines Zählers und gibt den gültigen Base-Offset zurück.
+
+    Erkannte Resets/Überläufe verschieben den Offset und werden in
+    counter_events protokolliert. Veraltete Werte (Rückschritt ohne Reset)
+    ändern Base und Rohwert nicht und ergeben None; sie werden nur als
+    stale_* vermerkt (siehe counters.py). Läuft in der Transaktion von apply_counts().
+    """
+    base = live[f"base_{counter}"] or 0
+    last_raw = live[f"raw_{counter}"]
+    if last_raw is None:
+        # Bestehende DB ohne Rohwert: letzter Rohwert = Base + Tageswert
+        last_raw = base + (live[f"count_{counter}"] or 0)
+
+    new_base, kind = rebase(base, last_raw, raw, live[f"stale_{counter}"])
+    if kind == STALE:
+        logger.warning(f"Zähler {counter}: veralteter Wert ignoriert ({last_raw} -> {raw})")
+        await db.execute(f"UPDATE live SET stale_{counter} = ? WHERE id = 1", (raw,))
+        return None
+    if kind:
+        logger.warning(
+            f"Zähler {counter}: {kind} erkannt ({last_raw} -> {raw}), Base {base} -> {new_base}"
+        )
+        await db.execute("""
+            INSERT INTO counter_events (timestamp, ts_epoch, counter, kind, last_raw, raw,
+                                        base_before, base_after)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (from_epoch(epoch).strftime("%Y-%m-%d %H:%M:%S"), epoch,
+              counter, kind, last_raw, raw, base, new_base))
+    await db.execute(
+        f"UPDATE live SET raw_{counter} = ?, base_{counter} = ?, stale_{counter} = NULL "
+        f"WHERE id = 1",
+        (raw, new_base)
+    )
+    return new_base
+
+
+async def get_counter_events(limit: int = 50):
+    """Die zuletzt erkannten Zähler-Resets und -Überläufe."""
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            "SELECT * FROM counter_events ORDER BY id DESC LIMIT ?", (limit,)
+        ) as cursor:
             return [dict(row) for row in await cursor.fetchall()]
 
 
-# Letzter gespeicherter Wert (Cache um doppelte Einträge zu vermeiden)
-_last_saved_values = {"count_in": -1, "count_out": -1}
+async def get_spool_offset(name: str) -> int:
+    """Bis zu welchem Offset eine Spool-Datei bereits angewendet ist."""
+    async with site_db() as db:
+        async with db.execute("SELECT value FROM meta WHERE key = ?", (f"spool:{name}",)) as cursor:
+            row = await cursor.fetchone()
+    return int(row[0]) if row else 0
 
 
-async def save_count_if_changed(count_in: int, count_out: int, occupancy: int):
-    """Speichert Werte nur wenn sie sich geändert haben."""
-    global _last_saved_values
+async def purge_spool_offsets(existing: list):
+    """Entfernt Offsets von Spool-Dateien, die nicht mehr existieren."""
+    keys = [f"spool:{name}" for name in existing]
+    placeholders = ",".join("?" * len(keys))
+    async with site_db() as db:
+        await db.execute(
+            f"DELETE FROM meta WHERE key LIKE 'spool:%' AND key NOT IN ({placeholders})", keys
+        )
+        await db.commit()
 
-    # Nur speichern wenn sich die Werte geändert haben
-    if count_in != _last_saved_values["count_in"] or count_out != _last_saved_values["count_out"]:
-        await save_count(count_in, count_out, occupancy)
-        _last_saved_values["count_in"] = count_in
-        _last_saved_values["count_out"] = count_out
-        return True
-    return False
+
+async def apply_late_counts(absolute: dict, increments: dict,
+                            spool_offset: Optional[Tuple[str, int]] = None,
+                            epoch: Optional[int] = None) -> dict:
+    """Bucht Zählwerte eines bereits abgeschlossenen Tages nach (z.B. vor
+    Mitternacht empfangen, aber erst nach dem Tages-Reset angewendet).
+
+    Die Werte kommen als neuer Eintrag zur Empfangszeit in counts dieses
+    Tages, aufbauend auf dessen letztem Eintrag. Die Live-Werte bleiben beim
+    heutigen Tag. Ein kumulativer Rohwert über dem heutigen Base-Offset zählt
+    noch zum alten Tag - der Offset wird auf ihn angehoben, damit dieser Teil
+    heute nicht ein zweites Mal gezählt wird.
+    """
+    if epoch is None:
+        epoch = now_epoch()
+    timestamp, local_day, local_hour, local_minute = local_keys(epoch)
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        await db.execute("BEGIN IMMEDIATE")
+        async with db.execute("SELECT * FROM live WHERE id = 1") as cursor:
+            live = await cursor.fetchone()
+        async with db.execute("""
+            SELECT count_in, count_out FROM counts
+            WHERE local_day = ? ORDER BY ts_epoch DESC, id DESC LIMIT 1
+        """, (local_day,)) as cursor:
+            row = await cursor.fetchone()
+        count_in, count_out = (row["count_in"], row["count_out"]) if row else (0, 0)
+
+        for counter, name in (("in", "fw"), ("out", "bw")):
+            if name not in absolute:
+                continue
+            raw = absolute[name]
+            base = live[f"base_{counter}"] or 0
+            if raw <= base:
+                continue  # schon im alten Tag enthalten
+            if counter == "in":
+                count_in += raw - base
+            else:
+                count_out += raw - base
+            await db.execute(
+                f"UPDATE live SET base_{counter} = ?, "
+                f"raw_{counter} = MAX(COALESCE(raw_{counter}, 0), ?) WHERE id = 1",
+                (raw, raw)
+            )
+        count_in += increments.get("fw", 0)
+        count_out += increments.get("bw", 0)
+
+        await db.execute("""
+            INSERT INTO counts (timestamp, ts_epoch, local_day, local_hour, local_minute,
+                                count_in, count_out, occupancy)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (timestamp, epoch, local_day, local_hour, local_minute,
+              count_in, count_out, max(0, count_in - count_out)))
+
+        if spool_offset:
+            name, offset = spool_offset
+            await db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (f"spool:{name}", str(offset))
+            )
+
+        await db.commit()
+        return {"count_in": count_in, "count_out": count_out, "saved": True}
+
+
+async def apply_counts(absolute: dict, increments: dict,
+                       spool_offset: Optional[Tuple[str, int]] = None,
+                       epoch: Optional[int] = None) -> dict:
+    """Wendet empfangene Zählwerte atomar auf Live-Tabelle und Historie an.
+
+    absolute: kumulative Sensorwerte aus dem Live Data Push ({"fw": .., "bw": ..})
+    increments: Intervall-Werte aus dem Logic Push ({"fw": .., "bw": ..})
+    spool_offset: (Spool-Datei, End-Offset) - wird in derselben Transaktion vermerkt
+    epoch: Empfangszeit der Werte (Standard: jetzt), z.B. beim Nachspielen des Spools
+
+    Lesen, Berechnen und Schreiben passieren in einer BEGIN IMMEDIATE-Transaktion,
+    so schreibt auch bei mehreren Worker-Prozessen immer nur einer (Single Writer).
+    """
+    if epoch is None:
+        epoch = now_epoch()
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        await db.execute("BEGIN IMMEDIATE")
+        async with db.execute("SELECT * FROM live WHERE id = 1") as cursor:
+            live = await cursor.fetchone()
+
+        count_in = live["count_in"] or 0
+        count_out = live["count_out"] or 0
+
+        # counter_value ist kumulativ - Base-Offset abziehen für Tageswert.
+        # Springt der Rohwert zurück (Sensor-Neustart, Überlauf), wird der
+        # Offset verschoben statt den Tageswert auf 0 zu klemmen. Veraltete
+        # Werte (verspätete Pushes, Replays) lassen den Tageswert stehen.
+        if "fw" in absolute:
+            base_in = await _track_raw(db, live, "in", absolute["fw"], epoch)
+            if base_in is not None:
+                count_in = max(0, absolute["fw"] - base_in)
+        if "bw" in absolute:
+            base_out = await _track_raw(db, live, "out", absolute["bw"], epoch)
+            if base_out is not None:
+                count_out = max(0, absolute["bw"] - base_out)
+        count_in += increments.get("fw", 0)
+        count_out += increments.get("bw", 0)
+
+        result = {"count_in": count_in, "count_out": count_out, "saved": False}
+        if count_in > 0 or count_out > 0:
+            occupancy = max(0, count_in - count_out)
+            # Liegt seit dem letzten Eintrag ein Leer-Zeitpunkt, Drift zuerst korrigieren
+            live = {**dict(live), **await advance_drift(db, live, epoch)}
+            occupancy_corrected = state_from_live(live, epoch).corrected(count_in, count_out)
+            await db.execute("""
+                UPDATE live SET
+                    count_in = ?,
+                    count_out = ?,
+                    occupancy = ?,
+                    occupancy_corrected = ?,
+                    last_update = MAX(COALESCE(last_update, ''), ?),
+                    last_reset_date = COALESCE(last_reset_date, ?)
+                WHERE id = 1
+            """, (count_in, count_out, occupancy, occupancy_corrected,
+                  from_epoch(epoch).strftime("%Y-%m-%d %H:%M:%S"),
+                  from_epoch(epoch).strftime("%Y-%m-%d")))
+            # Auch in Historie speichern für Charts
+            result["saved"] = await _insert_count_if_changed(
+                db, count_in, count_out, occupancy, occupancy_corrected, epoch
+            )
+            await record_flow(db, live, count_in, count_out, occupancy_corrected, epoch)
+            result["occupancy"] = occupancy
+            result["occupancy_corrected"] = occupancy_corrected
+
+        if spool_offset:
+            name, offset = spool_offset
+            await db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (f"spool:{name}", str(offset))
+            )
+
+        await db.commit()
+        return result
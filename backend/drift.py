@@ -0,0 +1,260 @@
+"""Drift-Korrektur der Belegung.
+
+Die Belegung ergibt sich aus Eintritten minus Austritten. Verpasste (oder
+doppelt gezählte) Austritte summieren sich über den Tag zu einer
+Phantom-Belegung, die bisher erst der Mitternachts-Reset beseitigt.
+
+Die Korrektur nutzt Zeitpunkte, zu denen das Gebäude bekanntermaßen leer
+ist (Anker):
+
+- closing: DRIFT_CLOSE_GRACE_MINUTES nach der Schließzeit (opening_hours.py)
+- idle:    nach DRIFT_IDLE_MINUTES ohne Ein- oder Austritt
+
+Die Roh-Belegung (count_in - count_out) am Anker ist der aufgelaufene
+Fehler. Er wird rückwirkend auf die Einträge seit dem letzten Anker
+verteilt, im Verhältnis der Eintritte (mehr Verkehr, mehr verpasste
+Austritte; ohne Eintritte linear in der Zeit). Nach dem Anker gilt der
+Fehler als Offset, bis zum nächsten Anker.
+
+Die korrigierte Belegung steht in counts.occupancy_corrected neben der
+Rohwert-Spalte occupancy, die aktuelle in live.occupancy_corrected. Der
+Ingest prüft bei jedem Ereignis, ob seit dem letzten Eintrag ein Anker
+liegt; die Schließzeit prüft zusätzlich ein geplanter Job. Abgeschlossene
+Tage werden beim Materialisieren vollständig neu korrigiert.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import aiosqlite
+
+from config import DRIFT_CLOSE_GRACE_MINUTES, DRIFT_IDLE_MINUTES
+from opening_hours import opening_calendar
+from sites import site_db
+from timeutil import day_key, from_epoch, now_epoch, to_epoch
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS drift_anchors (
+        local_day INTEGER NOT NULL,
+        anchor_epoch INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        residual INTEGER NOT NULL,
+        offset_before INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        PRIMARY KEY (local_day, anchor_epoch)
+    ) WITHOUT ROWID
+"""
+
+# (id, ts_epoch, count_in, count_out)
+Row = Tuple[int, int, int, int]
+
+
+def day_start(epoch: int) -> int:
+    """Epoch der lokalen Mitternacht vor `epoch`."""
+    local = from_epoch(epoch)
+    return to_epoch(datetime(local.year, local.month, local.day))
+
+
+def closing_epoch(epoch: int) -> Optional[int]:
+    """Ab wann das Gebäude am Tag von `epoch` als leer gilt (None an Schließtagen)."""
+    local = from_epoch(epoch)
+    info = opening_calendar.day_info(local)
+    if not info["is_open"]:
+        return None
+    midnight = datetime(local.year, local.month, local.day)
+    return to_epoch(midnight + timedelta(minutes=info["close_minute"] + DRIFT_CLOSE_GRACE_MINUTES))
+
+
+def next_anchor(last_epoch: int, now: int) -> Optional[Tuple[int, str]]:
+    """Erster Anker zwischen dem letzten Eintrag und `now` als (Epoch, Art)."""
+    closing = closing_epoch(last_epoch)
+    if closing is not None and last_epoch < closing <= now:
+        return closing, "closing"
+    if DRIFT_IDLE_MINUTES > 0 and now - last_epoch >= DRIFT_IDLE_MINUTES * 60:
+        return last_epoch + DRIFT_IDLE_MINUTES * 60, "idle"
+    return None
+
+
+class DriftState:
+    """Offset seit dem letzten Anker (entspricht den drift_*-Spalten in live)."""
+
+    def __init__(self, offset: int, anchor_epoch: int, anchor_in: int):
+        self.offset = offset
+        self.anchor_epoch = anchor_epoch
+        self.anchor_in = anchor_in
+
+    def corrected(self, count_in: int, count_out: int) -> int:
+        return max(0, count_in - count_out - self.offset)
+
+    def anchor(self, rows: List[Row], epoch: int, kind: str) -> Tuple[List[Tuple[int, int]], tuple]:
+        """Verteilt den Fehler auf `rows` (Einträge seit dem letzten Anker).
+
+        Gibt (id, korrigierte Belegung)-Paare und die Zeile für drift_anchors zurück.
+        """
+        offset_before = self.offset
+        updates = []
+        if rows:
+            _, last_ts, last_in, last_out = rows[-1]
+            residual = last_in - last_out
+            arrivals = last_in - self.anchor_in
+            span = last_ts - self.anchor_epoch
+            for row_id, ts, count_in, count_out in rows:
+                if arrivals > 0:
+                    weight = (count_in - self.anchor_in) / arrivals
+                else:
+                    weight = (ts - self.anchor_epoch) / span if span > 0 else 1.0
+                row_offset = offset_before + (residual - offset_before) * weight
+                updates.append((max(0, round(count_in - count_out - row_offset)), row_id))
+            self.offset = residual
+            self.anchor_in = last_in
+        self.anchor_epoch = epoch
+        record = (day_key(from_epoch(epoch)), epoch, kind, self.offset, offset_before, len(rows))
+        return updates, record
+
+
+async def _write(db, updates: List[Tuple[int, int]], records: List[tuple]):
+    await db.executemany("UPDATE counts SET occupancy_corrected = ? WHERE id = ?", updates)
+    await db.executemany(
+        "INSERT OR REPLACE INTO drift_anchors "
+        "(local_day, anchor_epoch, kind, residual, offset_before, rows) VALUES (?, ?, ?, ?, ?, ?)",
+        records
+    )
+
+
+def state_from_live(live, epoch: int) -> DriftState:
+    anchor_epoch = live["drift_anchor_epoch"]
+    if anchor_epoch is None:
+        anchor_epoch = day_start(epoch)
+    return DriftState(live["drift_offset"] or 0, anchor_epoch, live["drift_anchor_in"] or 0)
+
+
+async def advance(db, live, now: int) -> dict:
+    """Setzt einen Anker, falls seit dem letzten Eintrag einer liegt.
+
+    Läuft in einer Schreib-Transaktion (apply_counts oder check_anchor).
+    Gibt die geänderten live-Spalten zurück (leer, wenn kein Anker).
+    """
+    async with db.execute("SELECT ts_epoch FROM counts ORDER BY id DESC LIMIT 1") as cursor:
+        row = await cursor.fetchone()
+    if row is None or row[0] is None:
+        return {}
+    last_epoch = row[0]
+    state = state_from_live(live, last_epoch)
+    if last_epoch <= state.anchor_epoch:
+        return {}  # seit dem letzten Anker nichts Neues
+    anchor = next_anchor(last_epoch, now)
+    if anchor is None:
+        return {}
+
+    async with db.execute("""
+        SELECT id, ts_epoch, count_in, count_out FROM counts
+        WHERE ts_epoch > ? AND ts_epoch <= ? ORDER BY ts_epoch
+    """, (max(state.anchor_epoch, day_start(last_epoch)), last_epoch)) as cursor:
+        rows = await cursor.fetchall()
+    updates, record = state.anchor(rows, *anchor)
+    await _write(db, updates, [record])
+    if state.offset != record[4]:
+        logger.info(
+            f"Belegungs-Drift {state.offset - record[4]:+d} korrigiert "
+            f"({anchor[1]}, {len(rows)} Einträge)"
+        )
+
+    changes = {
+        "drift_offset": state.offset,
+        "drift_anchor_epoch": state.anchor_epoch,
+        "drift_anchor_in": state.anchor_in,
+        "occupancy_corrected": state.corrected(live["count_in"] or 0, live["count_out"] or 0),
+    }
+    await db.execute(
+        "UPDATE live SET drift_offset = ?, drift_anchor_epoch = ?, drift_anchor_in = ?, "
+        "occupancy_corrected = ? WHERE id = 1",
+        tuple(changes.values())
+    )
+    return changes
+
+
+async def check_anchor() -> bool:
+    """Periodische Prüfung (Schließzeit ohne weitere Ereignisse). True, wenn ein Anker gesetzt wurde."""
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        await db.execute("BEGIN IMMEDIATE")
+        async with db.execute("SELECT * FROM live WHERE id = 1") as cursor:
+            live = await cursor.fetchone()
+        changes = await advance(db, live, now_epoch())
+        await db.commit()
+    return bool(changes)
+
+
+async def correct_day(db, date: str):
+    """Korrigiert einen abgeschlossenen Tag vollständig neu (in der laufenden Transaktion)."""
+    local_day = day_key(date)
+    async with db.execute("""
+        SELECT id, ts_epoch, count_in, count_out FROM counts
+        WHERE local_day = ? ORDER BY ts_epoch
+    """, (local_day,)) as cursor:
+        rows = await cursor.fetchall()
+    await db.execute("DELETE FROM drift_anchors WHERE local_day = ?", (local_day,))
+    if not rows:
+        return
+
+    state = DriftState(0, day_start(rows[0][1]), 0)
+    updates, records = [], []
+    segment: List[Row] = []
+    end = min(now_epoch(), to_epoch(datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)))
+    for index, row in enumerate(rows):
+        segment.append(row)
+        following = rows[index + 1][1] if index + 1 < len(rows) else end
+        anchor = next_anchor(row[1], following)
+        if anchor is not None:
+            segment_updates, record = state.anchor(segment, *anchor)
+            updates += segment_updates
+            records.append(record)
+            segment = []
+    # Nach dem letzten Anker gilt dessen Offset
+    updates += [(state.corrected(count_in, count_out), row_id)
+                for row_id, _, count_in, count_out in segment]
+    await _write(db, updates, records)
+
+
+async def get_occupancy_series(date: datetime, minutes: int) -> List[dict]:
+    """Roh- und korrigierte Belegung je Intervall (Maximum) nebeneinander."""
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("""
+            SELECT local_minute / ? as bucket,
+                   MAX(occupancy) as occupancy,
+                   MAX(COALESCE(occupancy_corrected, occupancy)) as occupancy_corrected
+            FROM counts
+            WHERE local_day = ?
+            GROUP BY bucket
+            ORDER BY bucket
+        """, (minutes, day_key(date))) as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {'time': f"{row['bucket'] * minutes // 60:02d}:{row['bucket'] * minutes % 60:02d}",
+         'occupancy': row['occupancy'],
+         'occupancy_corrected': row['occupancy_corrected']}
+        for row in rows
+    ]
+
+
+async def get_anchors(date: datetime) -> List[dict]:
+    """Die Anker eines Tages mit dem jeweils festgestellten Fehler."""
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("""
+            SELECT anchor_epoch, kind, residual, offset_before, rows
+            FROM drift_anchors WHERE local_day = ?
+            ORDER BY anchor_epoch
+        """, (day_key(date),)) as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {'time': from_epoch(row['anchor_epoch']).strftime("%H:%M"),
+         'kind': row['kind'],
+         'drift': row['residual'] - row['offset_before'],
+         'residual': row['residual'],
+         'rows': row['rows']}
+        for row in rows
+    ]
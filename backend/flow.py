@@ -0,0 +1,230 @@
+"""Personenfluss und Verweildauer aus den Ein- und Austritten.
+
+Zwei Rollup-Tabellen je Standort-Datenbank:
+
+- flow_minutes: je lokaler Minute Eintritte, Austritte und die Belegung am
+  Minutenende. Das ist die Warteschlangen-Kurve A(t) - D(t) in Minuten-
+  auflösung (A, D: kumulative Ein-/Austritte).
+- flow_hourly:  je lokaler Stunde Eintritte, Austritte und das Integral
+  der Belegung über die Zeit (occupancy_seconds, Personen-Sekunden).
+
+Verweildauer nach Little's Law W = L / λ: mit L = occupancy_seconds / 3600
+(mittlere Belegung) und λ = Eintritte / 3600 ergibt sich
+W = occupancy_seconds / Eintritte.
+
+Fortgeschrieben werden die Tabellen in der Transaktion von apply_counts():
+die Belegung seit dem letzten Ereignis (live.flow_epoch) wird auf die
+berührten Stunden verteilt, höchstens bis Mitternacht (dort beginnt die
+Belegung mit dem Tages-Reset bei 0). Abgeschlossene Tage werden beim
+Materialisieren aus der counts-Tabelle neu berechnet, z.B. nach einem CSV-Import.
+
+Als Belegung dient die driftkorrigierte (drift.py). Für den laufenden Tag
+ist sie vorläufig; die rückwirkende Korrektur früherer Stunden fließt erst
+beim Materialisieren des Tages in die Rollups ein.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from sites import site_db
+from timeutil import day_key, from_epoch, local_keys, now_epoch, to_epoch
+
+# Alle Zeitzonen-Offsets sind Vielfache von 15 Minuten - in diesen Schritten
+# fallen Stundengrenzen immer auf eine Schrittgrenze
+STEP_SECONDS = 15 * 60
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS flow_hourly (
+        local_day INTEGER NOT NULL,
+        local_hour INTEGER NOT NULL,
+        arrivals INTEGER DEFAULT 0,
+        departures INTEGER DEFAULT 0,
+        occupancy_seconds INTEGER DEFAULT 0,
+        PRIMARY KEY (local_day, local_hour)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS flow_minutes (
+        local_day INTEGER NOT NULL,
+        local_minute INTEGER NOT NULL,
+        arrivals INTEGER DEFAULT 0,
+        departures INTEGER DEFAULT 0,
+        occupancy INTEGER DEFAULT 0,
+        PRIMARY KEY (local_day, local_minute)
+    ) WITHOUT ROWID
+    """,
+]
+
+
+def next_midnight(epoch: int) -> int:
+    """Epoch der lokalen Mitternacht nach `epoch`."""
+    local = from_epoch(epoch)
+    return to_epoch(datetime(local.year, local.month, local.day) + timedelta(days=1))
+
+
+class FlowAccumulator:
+    """Sammelt Fluss-Werte je Stunde und Minute, bevor sie geschrieben werden."""
+
+    def __init__(self, count_in: int = 0, count_out: int = 0, occupancy: int = 0,
+                 epoch: Optional[int] = None):
+        # Zustand nach dem letzten Ereignis
+        self.count_in = count_in
+        self.count_out = count_out
+        self.occupancy = occupancy
+        self.epoch = epoch
+        # (local_day, local_hour) -> [Eintritte, Austritte, Personen-Sekunden]
+        self.hours: Dict[Tuple[int, int], List[int]] = defaultdict(lambda: [0, 0, 0])
+        # (local_day, local_minute) -> [Eintritte, Austritte, Belegung am Minutenende]
+        self.minutes: Dict[Tuple[int, int], List[int]] = {}
+
+    def close(self, epoch: int):
+        """Bucht die bisherige Belegung bis `epoch` (höchstens bis Mitternacht)."""
+        if self.epoch is not None and self.occupancy > 0:
+            end = min(epoch, next_midnight(self.epoch))
+            t = self.epoch
+            while t < end:
+                step_end = min(end, (t // STEP_SECONDS + 1) * STEP_SECONDS)
+                _, local_day, local_hour, _ = local_keys(t)
+                self.hours[(local_day, local_hour)][2] += self.occupancy * (step_end - t)
+                t = step_end
+        if self.epoch is None or epoch > self.epoch:
+            self.epoch = epoch
+
+    def add(self, count_in: int, count_out: int, occupancy: int, epoch: int):
+        """Übernimmt einen neuen kumulativen Tageswert."""
+        self.close(epoch)
+        arrivals = max(0, count_in - self.count_in)
+        departures = max(0, count_out - self.count_out)
+        _, local_day, local_hour, local_minute = local_keys(epoch)
+        hour = self.hours[(local_day, local_hour)]
+        hour[0] += arrivals
+        hour[1] += departures
+        minute = self.minutes.setdefault((local_day, local_minute), [0, 0, 0])
+        minute[0] += arrivals
+        minute[1] += departures
+        minute[2] = occupancy
+        self.count_in, self.count_out, self.occupancy = count_in, count_out, occupancy
+
+    async def write(self, db):
+        """Addiert die gesammelten Werte zu den Rollups (in der laufenden Transaktion)."""
+        await db.executemany("""
+            INSERT INTO flow_hourly (local_day, local_hour, arrivals, departures, occupancy_seconds)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(local_day, local_hour) DO UPDATE SET
+                arrivals = arrivals + excluded.arrivals,
+                departures = departures + excluded.departures,
+                occupancy_seconds = occupancy_seconds + excluded.occupancy_seconds
+        """, [(*key, *values) for key, values in self.hours.items()])
+        await db.executemany("""
+            INSERT INTO flow_minutes (local_day, local_minute, arrivals, departures, occupancy)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(local_day, local_minute) DO UPDATE SET
+                arrivals = arrivals + excluded.arrivals,
+                departures = departures + excluded.departures,
+                occupancy = excluded.occupancy
+        """, [(*key, *values) for key, values in self.minutes.items()])
+
+
+def _from_live(live) -> FlowAccumulator:
+    occupancy = live["occupancy_corrected"]
+    if occupancy is None:
+        occupancy = live["occupancy"] or 0
+    return FlowAccumulator(live["count_in"] or 0, live["count_out"] or 0,
+                           occupancy, live["flow_epoch"])
+
+
+async def record_flow(db, live, count_in: int, count_out: int, occupancy: int, epoch: int):
+    """Schreibt ein Ingest-Ereignis fort. Läuft in der Transaktion von apply_counts()."""
+    flow = _from_live(live)
+    flow.add(count_in, count_out, occupancy, epoch)
+    await flow.write(db)
+    await db.execute("UPDATE live SET flow_epoch = ? WHERE id = 1", (flow.epoch,))
+
+
+async def close_flow(db, live, epoch: int):
+    """Bucht die Belegung bis zum Tages-Reset. Läuft in dessen Transaktion."""
+    flow = _from_live(live)
+    flow.close(epoch)
+    await flow.write(db)
+    await db.execute("UPDATE live SET flow_epoch = ? WHERE id = 1", (epoch,))
+
+
+async def rebuild_day(db, date: str):
+    """Berechnet die Rollups eines Tages aus counts neu (in der laufenden Transaktion)."""
+    local_day = day_key(date)
+    await db.execute("DELETE FROM flow_hourly WHERE local_day = ?", (local_day,))
+    await db.execute("DELETE FROM flow_minutes WHERE local_day = ?", (local_day,))
+    async with db.execute("""
+        SELECT ts_epoch, count_in, count_out, COALESCE(occupancy_corrected, occupancy)
+        FROM counts WHERE local_day = ? ORDER BY ts_epoch
+    """, (local_day,)) as cursor:
+        rows = await cursor.fetchall()
+    if not rows:
+        return
+
+    flow = FlowAccumulator()
+    for ts_epoch, count_in, count_out, occupancy in rows:
+        flow.add(count_in, count_out, occupancy, ts_epoch)
+    # Belegung nach dem letzten Eintrag bis Mitternacht (bzw. bis jetzt)
+    flow.close(min(now_epoch(), next_midnight(rows[-1][0])))
+    await flow.write(db)
+
+
+def _dwell_minutes(occupancy_seconds: int, arrivals: int) -> Optional[float]:
+    if not arrivals:
+        return None
+    return round(occupancy_seconds / arrivals / 60, 1)
+
+
+async def get_flow_hourly(date: datetime) -> List[dict]:
+    """Fluss je Stunde: Ein-/Austritte, mittlere Belegung und Verweildauer (Minuten)."""
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("""
+            SELECT local_hour, arrivals, departures, occupancy_seconds
+            FROM flow_hourly WHERE local_day = ?
+            ORDER BY local_hour
+        """, (day_key(date),)) as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {'hour': f"{row['local_hour']:02d}",
+         'arrivals': row['arrivals'],
+         'departures': row['departures'],
+         'occupancy_seconds': row['occupancy_seconds'],
+         'avg_occupancy': round(row['occupancy_seconds'] / 3600, 1),
+         'dwell_minutes': _dwell_minutes(row['occupancy_seconds'], row['arrivals'])}
+        for row in rows
+    ]
+
+
+async def get_flow_minutes(date: datetime) -> List[dict]:
+    """Minuten mit Ein-/Austritten und der Belegung am Minutenende."""
+    async with site_db() as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("""
+            SELECT local_minute, arrivals, departures, occupancy
+            FROM flow_minutes WHERE local_day = ?
+            ORDER BY local_minute
+        """, (day_key(date),)) as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {'time': f"{row['local_minute'] // 60:02d}:{row['local_minute'] % 60:02d}",
+         'arrivals': row['arrivals'],
+         'departures': row['departures'],
+         'occupancy': row['occupancy']}
+        for row in rows
+    ]
+
+
+def summarize(hours: List[dict]) -> dict:
+    """Tageswerte aus den Stundenzeilen (Verweildauer über den ganzen Tag)."""
+    arrivals = sum(h['arrivals'] for h in hours)
+    occupancy_seconds = sum(h['occupancy_seconds'] for h in hours)
+    return {
+        'total_arrivals': arrivals,
+        'total_departures': sum(h['departures'] for h in hours),
+        'dwell_minutes': _dwell_minutes(occupancy_seconds, arrivals),
+    }
@@ -6,19 +6,36 @@ CSV-Format (Xovis Export, 1-Minuten-Intervalle):
 
 Die Minutenwerte werden pro Stunde summiert und als kumulative
 Tageswerte in die counts-Tabelle geschrieben (gleich wie der
-Live-Webhook es tut).
+Live-Webhook es tut). Stunden, für die schon Daten existieren, werden
+übersprungen.
+
+Abgleich (--reconcile): der Export gilt als maßgeblich. Er wird in eine
+temporäre Tabelle geladen und je Stunde mit den gespeicherten Werten
+verglichen (Join über den Index local_day/local_hour). Fehlende oder
+abweichende Stunden abgeschlossener Tage werden durch die Minutenwerte des
+Exports ersetzt, die späteren Stunden des Tages um die Differenz
+verschoben - ein Tag pro Transaktion. Danach werden die betroffenen Tage
+neu materialisiert (Aggregate, Drift-Korrektur, Personenfluss). Ohne
+--apply wird nur der Bericht ausgegeben.
 
 Verwendung:
     python import_csv.py /pfad/zur/datei.csv
+    python import_csv.py /pfad/zur/datei.csv --reconcile [--apply] [--report diff.csv]
+    python import_csv.py /pfad/zur/datei.csv --site graz
 """
 
+import argparse
+import asyncio
 import csv
 import sqlite3
 import sys
 from collections import defaultdict
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 
-from config import DATABASE_PATH
+from sites import PRIMARY_SITE, SITES
+from timeutil import day_from_key, day_key, now_local, to_epoch
 
 
 def parse_timestamp(ts: str) -> datetime:
@@ -26,43 +43,50 @@ def parse_timestamp(ts: str) -> datetime:
     return datetime.strptime(ts.strip(), "%d/%m/%Y - %H:%M")
 
 
-def import_csv(csv_path: str):
-    # Minutendaten einlesen und pro Tag+Stunde summieren
-    # Struktur: {date: {hour: {"fw": X, "bw": Y}}}
-    daily_hourly = defaultdict(lambda: defaultdict(lambda: {"fw": 0, "bw": 0}))
-
+def read_minutes(csv_path: str) -> List[Tuple[datetime, int, int]]:
+    """Minutenzeilen der CSV als (Beginn, Eintritte, Austritte), auch leere Minuten."""
+    minutes = []
     with open(csv_path, "r", encoding="utf-8-sig") as f:
         reader = csv.DictReader(f)
         print(f"CSV-Spalten: {reader.fieldnames}")
-        row_count = 0
         for line_num, row in enumerate(reader, start=2):
             try:
                 fw_val = row.get("Forward counter") or "0"
                 bw_val = row.get("Backward counter") or "0"
                 fw = int(fw_val.strip())
                 bw = int(bw_val.strip())
-                if fw == 0 and bw == 0:
-                    continue
 
                 from_time = row.get("from-time") or ""
                 if not from_time.strip():
                     continue
 
-                dt = parse_timestamp(from_time)
-                date_str = dt.strftime("%Y-%m-%d")
-                hour = dt.hour
-                daily_hourly[date_str][hour]["fw"] += fw
-                daily_hourly[date_str][hour]["bw"] += bw
-                row_count += 1
+                minutes.append((parse_timestamp(from_time), fw, bw))
             except (ValueError, TypeError) as e:
                 print(f"  Zeile {line_num} übersprungen: {e} - {dict(row)}")
                 continue
+    return minutes
+
+
+def import_csv(csv_path: str, database: str):
+    # Minutendaten einlesen und pro Tag+Stunde summieren
+    # Struktur: {date: {hour: {"fw": X, "bw": Y}}}
+    daily_hourly = defaultdict(lambda: defaultdict(lambda: {"fw": 0, "bw": 0}))
+
+    row_count = 0
+    for dt, fw, bw in read_minutes(csv_path):
+        if fw == 0 and bw == 0:
+            continue
+        date_str = dt.strftime("%Y-%m-%d")
+        hour = dt.hour
+        daily_hourly[date_str][hour]["fw"] += fw
+        daily_hourly[date_str][hour]["bw"] += bw
+        row_count += 1
 
     print(f"CSV gelesen: {row_count} Zeilen mit Daten")
     print(f"Tage mit Daten: {len(daily_hourly)}")
 
     # In DB schreiben
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = sqlite3.connect(database, timeout=30)
     cursor = conn.cursor()
 
     # Tabelle sicherstellen
@@ -78,6 +102,12 @@ def import_csv(csv_path: str):
     cursor.execute(
         "CREATE INDEX IF NOT EXISTS idx_timestamp ON counts(timestamp)"
     )
+    # Zeit-Schlüssel (siehe timeutil.py) - falls die App die DB noch nicht migriert hat
+    for column in ["ts_epoch INTEGER", "local_day INTEGER", "local_hour INTEGER", "local_minute INTEGER"]:
+        try:
+            cursor.execute(f"ALTER TABLE counts ADD COLUMN {column}")
+        except sqlite3.OperationalError:
+            pass  # Spalte existiert bereits
 
     inserted = 0
     skipped = 0
@@ -94,20 +124,22 @@ def import_csv(csv_path: str):
 
             # Timestamp: Mitte der Stunde
             ts = f"{date_str} {hour:02d}:30:00"
+            local_day = day_key(date_str)
 
             # Prüfen ob bereits Daten für diese Stunde existieren
             cursor.execute(
-                "SELECT id FROM counts WHERE timestamp BETWEEN ? AND ?",
-                (f"{date_str} {hour:02d}:00:00", f"{date_str} {hour:02d}:59:59")
+                "SELECT id FROM counts WHERE local_day = ? AND local_hour = ?",
+                (local_day, hour)
             )
             if cursor.fetchone():
                 skipped += 1
                 continue
 
             cursor.execute(
-                "INSERT INTO counts (timestamp, count_in, count_out, occupancy) "
-                "VALUES (?, ?, ?, ?)",
-                (ts, cumulative_in, cumulative_out, occupancy)
+                "INSERT INTO counts (timestamp, ts_epoch, local_day, local_hour, local_minute, "
+                "count_in, count_out, occupancy) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (ts, to_epoch(datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")), local_day, hour,
+                 hour * 60 + 30, cumulative_in, cumulative_out, occupancy)
             )
             inserted += 1
 
@@ -123,13 +155,235 @@ def import_csv(csv_path: str):
     print(f"\nImport abgeschlossen: {inserted} Stunden eingefügt, {skipped} übersprungen (bereits vorhanden)")
 
 
+# ============== Abgleich ==============
+
+EXPORT_SCHEMA = """
+    CREATE TEMP TABLE IF NOT EXISTS export_minutes (
+        local_day INTEGER NOT NULL,
+        local_minute INTEGER NOT NULL,
+        fw INTEGER NOT NULL,
+        bw INTEGER NOT NULL,
+        PRIMARY KEY (local_day, local_minute)
+    ) WITHOUT ROWID
+"""
+
+
+@dataclass
+class HourDiff:
+    local_day: int
+    local_hour: int
+    export_in: int
+    export_out: int
+    # None: keine gespeicherten Einträge in dieser Stunde
+    stored_in: Optional[int]
+    stored_out: Optional[int]
+
+    @property
+    def status(self) -> str:
+        return "fehlt" if self.stored_in is None else "abweichend"
+
+
+@dataclass
+class DayPlan:
+    """Änderungen an einem Tag: ersetzte Stunden und Verschiebung der übrigen."""
+    local_day: int
+    diffs: List[HourDiff]
+    # Stunde -> kumulativer Stand vor der Stunde (neu)
+    replace: Dict[int, Tuple[int, int]]
+    # (Differenz IN, Differenz OUT, Stunde) für behaltene Stunden
+    shifts: List[Tuple[int, int, int]]
+
+
+def load_export(conn, minutes: List[Tuple[datetime, int, int]]):
+    """Lädt die Minutenwerte in die temporäre Tabelle export_minutes."""
+    conn.execute(EXPORT_SCHEMA)
+    conn.execute("DELETE FROM export_minutes")
+    # Doppelte Minuten (Zeitumstellung im Herbst) werden zusammengefasst
+    conn.executemany("""
+        INSERT INTO export_minutes (local_day, local_minute, fw, bw) VALUES (?, ?, ?, ?)
+        ON CONFLICT(local_day, local_minute) DO UPDATE SET
+            fw = fw + excluded.fw,
+            bw = bw + excluded.bw
+    """, [(day_key(dt), dt.hour * 60 + dt.minute, fw, bw) for dt, fw, bw in minutes])
+
+
+def plan_reconcile(conn, before_day: int) -> List[DayPlan]:
+    """Vergleicht Export und gespeicherte Werte je Stunde (nur Tage vor `before_day`)."""
+    export = defaultdict(dict)
+    for local_day, local_hour, fw, bw in conn.execute("""
+        SELECT local_day, local_minute / 60, SUM(fw), SUM(bw)
+        FROM export_minutes WHERE local_day < ?
+        GROUP BY 1, 2
+    """, (before_day,)):
+        export[local_day][local_hour] = (fw, bw)
+
+    # Tagesbereich des Exports gegen counts, je Tag über idx_counts_local
+    stored = defaultdict(dict)
+    for local_day, local_hour, cum_in, cum_out in conn.execute("""
+        SELECT c.local_day, c.local_hour, MAX(c.count_in), MAX(c.count_out)
+        FROM (SELECT DISTINCT local_day FROM export_minutes WHERE local_day < ?) d
+        JOIN counts c ON c.local_day = d.local_day
+        GROUP BY c.local_day, c.local_hour
+    """, (before_day,)):
+        stored[local_day][local_hour] = (cum_in, cum_out)
+
+    plans = []
+    for local_day in sorted(export):
+        plan = DayPlan(local_day, [], {}, [])
+        # alter und neuer kumulativer Stand am Ende der vorigen Stunde
+        old_in = old_out = new_in = new_out = 0
+        for hour in sorted(set(export[local_day]) | set(stored[local_day])):
+            end_in, end_out = stored[local_day].get(hour, (old_in, old_out))
+            stored_in, stored_out = end_in - old_in, end_out - old_out
+            exported = export[local_day].get(hour)
+            if exported is not None and exported != (stored_in, stored_out):
+                missing = hour not in stored[local_day]
+                plan.diffs.append(HourDiff(
+                    local_day, hour, *exported,
+                    None if missing else stored_in, None if missing else stored_out
+                ))
+                plan.replace[hour] = (new_in, new_out)
+                new_in, new_out = new_in + exported[0], new_out + exported[1]
+            else:
+                shift_in, shift_out = new_in - old_in, new_out - old_out
+                if (shift_in or shift_out) and hour in stored[local_day]:
+                    plan.shifts.append((shift_in, shift_out, hour))
+                new_in, new_out = end_in + shift_in, end_out + shift_out
+            old_in, old_out = end_in, end_out
+        if plan.diffs:
+            plans.append(plan)
+    return plans
+
+
+def apply_plan(conn, plan: DayPlan):
+    """Schreibt die Änderungen eines Tages in einer Transaktion."""
+    date_str = day_from_key(plan.local_day)
+    hours = list(plan.replace)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            f"DELETE FROM counts WHERE local_day = ? AND local_hour IN ({','.join('?' * len(hours))})",
+            (plan.local_day, *hours)
+        )
+        conn.executemany("""
+            UPDATE counts SET
+                count_in = count_in + ?1,
+                count_out = count_out + ?2,
+                occupancy = MAX(0, count_in + ?1 - count_out - ?2)
+            WHERE local_day = ?3 AND local_hour = ?4
+        """, [(shift_in, shift_out, plan.local_day, hour) for shift_in, shift_out, hour in plan.shifts]
+        )
+
+        rows = []
+        for hour, (cum_in, cum_out) in plan.replace.items():
+            for minute, fw, bw in conn.execute("""
+                SELECT local_minute, fw, bw FROM export_minutes
+                WHERE local_day = ? AND local_minute >= ? AND local_minute < ?
+                  AND (fw > 0 OR bw > 0)
+                ORDER BY local_minute
+            """, (plan.local_day, hour * 60, hour * 60 + 60)):
+                cum_in, cum_out = cum_in + fw, cum_out + bw
+                # Timestamp: Mitte der Minute
+                ts = f"{date_str} {minute // 60:02d}:{minute % 60:02d}:30"
+                rows.append((ts, to_epoch(datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")),
+                             plan.local_day, hour, minute, cum_in, cum_out, max(0, cum_in - cum_out)))
+        conn.executemany(
+            "INSERT INTO counts (timestamp, ts_epoch, local_day, local_hour, local_minute, "
+            "count_in, count_out, occupancy) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        # Drift-Korrektur stimmt nicht mehr - beim Materialisieren neu
+        conn.execute("UPDATE counts SET occupancy_corrected = NULL WHERE local_day = ?",
+                     (plan.local_day,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def print_report(plans: List[DayPlan], report_path: Optional[str] = None):
+    """Gibt die abweichenden Stunden aus, optional zusätzlich als CSV-Datei."""
+    diffs = [diff for plan in plans for diff in plan.diffs]
+    for diff in diffs:
+        stored = "-" if diff.stored_in is None else f"IN={diff.stored_in} OUT={diff.stored_out}"
+        print(f"  {day_from_key(diff.local_day)} {diff.local_hour:02d}:00  {diff.status:<10}  "
+              f"Export IN={diff.export_in} OUT={diff.export_out}  gespeichert {stored}")
+    missing = sum(1 for diff in diffs if diff.stored_in is None)
+    print(f"\nAbgleich: {len(plans)} Tage betroffen, {missing} Stunden fehlen, "
+          f"{len(diffs) - missing} weichen ab")
+
+    if report_path:
+        with open(report_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["date", "hour", "status", "export_in", "export_out",
+                             "stored_in", "stored_out"])
+            for diff in diffs:
+                writer.writerow([day_from_key(diff.local_day), diff.local_hour, diff.status,
+                                 diff.export_in, diff.export_out, diff.stored_in, diff.stored_out])
+        print(f"Bericht gespeichert: {report_path}")
+
+
+async def rematerialize(site_id: str, dates: List[str]):
+    """Aggregate, Drift-Korrektur und Fluss der geänderten Tage neu berechnen."""
+    from analytics import materialize_day
+    from sites import connections, use_site
+
+    try:
+        with use_site(site_id):
+            for date in dates:
+                await materialize_day(date)
+    finally:
+        # offene Verbindungs-Threads würden das Beenden blockieren
+        await connections.close()
+
+
+def reconcile_csv(csv_path: str, site_id: str, apply: bool = False,
+                  report_path: Optional[str] = None):
+    minutes = read_minutes(csv_path)
+    print(f"CSV gelesen: {len(minutes)} Minuten")
+
+    conn = sqlite3.connect(SITES[site_id].database, timeout=30, isolation_level=None)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(counts)")}
+        if "occupancy_corrected" not in columns:
+            print("Datenbank ist noch nicht migriert - bitte zuerst die App einmal starten.")
+            sys.exit(1)
+
+        load_export(conn, minutes)
+        plans = plan_reconcile(conn, day_key(now_local()))
+        print_report(plans, report_path)
+        if not apply:
+            if plans:
+                print("Trockenlauf - mit --apply werden die Stunden ersetzt.")
+            return
+
+        for plan in plans:
+            apply_plan(conn, plan)
+    finally:
+        conn.close()
+
+    dates = [day_from_key(plan.local_day) for plan in plans]
+    if dates:
+        asyncio.run(rematerialize(site_id, dates))
+        print(f"{len(dates)} Tage ersetzt und neu materialisiert")
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Verwendung: python import_csv.py <csv-datei>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Xovis-CSV-Export importieren oder abgleichen")
+    parser.add_argument("csv_path", help="CSV-Datei (1-Minuten-Intervalle)")
+    parser.add_argument("--site", default=PRIMARY_SITE, choices=list(SITES),
+                        help="Standort (Standard: erster Standort)")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Mit gespeicherten Daten abgleichen statt nur Lücken zu füllen")
+    parser.add_argument("--apply", action="store_true",
+                        help="Abweichungen schreiben (sonst nur Bericht)")
+    parser.add_argument("--report", help="Abweichungen zusätzlich als CSV speichern")
+    args = parser.parse_args()
 
-    csv_path = sys.argv[1]
-    print(f"Importiere: {csv_path}")
-    print(f"Datenbank: {DATABASE_PATH}")
+    print(f"Importiere: {args.csv_path}")
+    print(f"Datenbank: {SITES[args.site].database}")
     print()
-    import_csv(csv_path)
+    if args.reconcile:
+        reconcile_csv(args.csv_path, args.site, args.apply, args.report)
+    else:
+        import_csv(args.csv_path, SITES[args.site].database)
@@ -0,0 +1,257 @@
+"""Ingest-Warteschlange für Webhook-Daten.
+
+Webhooks schreiben nicht mehr selbst in die Datenbank, sondern stellen ihre
+Zählwerte in eine begrenzte Warteschlange. Ein einzelner Writer-Task holt
+alle wartenden Einträge eines Zeitfensters, fasst sie zusammen und schreibt
+sie mit einem einzigen apply_counts()-Aufruf. So bleiben Reconnect-Stürme
+des Sensors (viele gepufferte Pushes auf einmal) bei wenigen DB-Schreibvorgängen.
+
+Vor dem Einstellen wird jeder Eintrag an den Write-Ahead-Spool angehängt
+(siehe spool.py). Der Writer wendet immer alle noch offenen Spool-Einträge
+an; schlägt das fehl, versucht er es alle WEBHOOK_RETRY_AFTER Sekunden
+erneut. Spool-Dateien beendeter Prozesse werden beim Start nachgespielt.
+
+Jeder Standort hat eine eigene Warteschlange mit eigenem Writer und
+eigenem Spool-Verzeichnis (SPOOL_DIR/<standort>, der erste Standort
+direkt SPOOL_DIR).
+"""
+import asyncio
+import logging
+import os
+from itertools import groupby
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import SPOOL_DIR, WEBHOOK_COALESCE_WINDOW, WEBHOOK_QUEUE_SIZE, WEBHOOK_RETRY_AFTER
+from alerts import alert_engines
+from analytics import materialize_day
+from database import (
+    apply_counts, apply_late_counts, check_daily_reset, get_live_count, get_spool_offset,
+    purge_spool_offsets
+)
+from sites import PRIMARY_SITE, PerSite, use_site
+from spool import Spool, SpoolError, new_record, read_records
+from timeseries import today_buffer
+from timeutil import from_epoch, now_epoch, now_local
+
+logger = logging.getLogger(__name__)
+
+
+class IngestOverloaded(Exception):
+    """Warteschlange ist voll - der Sender soll es später erneut versuchen."""
+
+
+class IngestDeferred(Exception):
+    """DB-Schreiben fehlgeschlagen - der Eintrag liegt im Spool und wird später angewendet."""
+
+
+def merge_counts(items: List[Tuple[dict, dict]]) -> Tuple[dict, dict]:
+    """Fasst mehrere (absolute, increments)-Paare in Eingangsreihenfolge zusammen.
+
+    Ein kumulativer Wert (Live Data Push) ersetzt alles vorher Empfangene für
+    diesen Zähler, Intervall-Werte (Logic Push) danach werden aufaddiert.
+    """
+    absolute: Dict[str, int] = {}
+    increments: Dict[str, int] = {"fw": 0, "bw": 0}
+    for item_absolute, item_increments in items:
+        for name, value in item_absolute.items():
+            absolute[name] = value
+            increments[name] = 0
+        for name, value in item_increments.items():
+            increments[name] = increments.get(name, 0) + value
+    return absolute, increments
+
+
+def _record_day(record: dict) -> str:
+    """Lokaler Tag (YYYY-MM-DD) der Empfangszeit eines Spool-Eintrags."""
+    return from_epoch(record.get("ts") or now_epoch()).strftime("%Y-%m-%d")
+
+
+class IngestQueue:
+    """Begrenzte Warteschlange mit einem einzelnen, zusammenfassenden Writer."""
+
+    def __init__(self, site: str, maxsize: int = WEBHOOK_QUEUE_SIZE,
+                 window: float = WEBHOOK_COALESCE_WINDOW,
+                 retry_interval: float = WEBHOOK_RETRY_AFTER):
+        self.site = site
+        self.maxsize = maxsize
+        self.window = window
+        self.retry_interval = retry_interval
+        self.spool = Spool(SPOOL_DIR if site == PRIMARY_SITE else os.path.join(SPOOL_DIR, site))
+        self.recovered = asyncio.Event()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Offene Spool-Einträge nach einem fehlgeschlagenen Schreibvorgang
+        self._backlog = False
+        self._last_result = {"count_in": 0, "count_out": 0, "saved": False}
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        """Öffnet den Spool und startet den Writer-Task (im laufenden Event-Loop)."""
+        self.spool.open()
+        self.recovered.clear()
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        # Der Writer übernimmt den Standort-Kontext (DB-Zugriffe über site_db())
+        with use_site(self.site):
+            self._task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        """Schreibt noch wartende Einträge und beendet den Writer."""
+        if not self._task:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.spool.close()
+
+    def submit(self, absolute: dict, increments: dict) -> asyncio.Future:
+        """Schreibt Zählwerte in den Spool und stellt sie ein.
+
+        Das Future liefert das Ergebnis von apply_counts. Wirft SpoolError,
+        wenn der Eintrag nicht gesichert werden konnte.
+        """
+        if self._queue.full():
+            raise IngestOverloaded(f"Ingest-Warteschlange voll ({self.maxsize})")
+        self.spool.append(new_record(absolute, increments))
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(future)
+        return future
+
+    async def _writer(self):
+        await self._recover()
+        while True:
+            batch = []
+            try:
+                if self._backlog:
+                    # Offene Einträge spätestens nach retry_interval erneut versuchen
+                    batch.append(await asyncio.wait_for(self._queue.get(), self.retry_interval))
+                else:
+                    batch.append(await self._queue.get())
+            except asyncio.TimeoutError:
+                pass
+            # Kurz warten, damit gleichzeitig eintreffende Pushes zusammenkommen
+            if batch and self.window > 0:
+                await asyncio.sleep(self.window)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                await self._apply(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _apply(self, batch: List[asyncio.Future]):
+        # Einträge des Batches gemeinsam auf die Platte bringen (ein fsync pro Batch)
+        try:
+            await asyncio.to_thread(self.spool.sync)
+        except OSError as e:
+            self._fail(batch, SpoolError(f"Spool fsync fehlgeschlagen: {e}"))
+            return
+
+        records = self.spool.pending()
+        try:
+            if records:
+                await self._apply_records(records, self.spool.name, self.spool.mark_applied)
+                if len(records) > 1:
+                    logger.info(f"{len(records)} Webhooks zu einem Schreibvorgang zusammengefasst")
+            if self._backlog:
+                logger.info("Spool-Rückstand angewendet")
+            self._backlog = False
+        except Exception as e:
+            self._backlog = True
+            logger.error(f"Ingest fehlgeschlagen, {len(records)} Einträge bleiben im Spool: {e}")
+            self._fail(batch, IngestDeferred(str(e)))
+            return
+
+        for future in batch:
+            if not future.done():
+                future.set_result(self._last_result)
+
+    async def _apply_records(self, records: List[Tuple[int, dict]], spool_name: str,
+                             mark_applied: Optional[Callable[[int], None]] = None) -> dict:
+        """Fasst Spool-Einträge je lokalem Tag zusammen und wendet sie samt Spool-Offset an.
+
+        Maßgeblich ist die Empfangszeit im Eintrag, nicht die Zeit des Anwendens.
+        Einträge eines Tages, den der Tages-Reset schon abgeschlossen hat,
+        werden in dessen counts nachgebucht und der Tag neu materialisiert -
+        sonst landeten z.B. nach einem Neustart am Folgetag die gestrigen
+        Zählwerte im heutigen Tag.
+
+        mark_applied wird nach jedem Tag mit dessen End-Offset aufgerufen - ein
+        Fehler bei einem späteren Tag spielt die schon geschriebenen nicht erneut ab.
+        """
+        result = self._last_result
+        for day, group in groupby(records, key=lambda item: _record_day(item[1])):
+            group = list(group)
+            live_day = (await get_live_count()).get("last_reset_date")
+            if live_day and day > live_day:
+                # Mitternachts-Reset vor den ersten Werten des neuen Tages
+                if await check_daily_reset():
+                    logger.info("Täglicher Reset um Mitternacht durchgeführt")
+                live_day = (await get_live_count()).get("last_reset_date")
+
+            absolute, increments = merge_counts(
+                [(record["absolute"], record["increments"]) for _, record in group]
+            )
+            epoch = int(group[-1][1].get("ts") or now_epoch())
+            if live_day and day < live_day:
+                await apply_late_counts(absolute, increments, (spool_name, group[-1][0]), epoch)
+                if mark_applied:
+                    mark_applied(group[-1][0])
+                logger.warning(
+                    f"{len(group)} Spool-Einträge vom {day} nachgebucht (Tag bereits abgeschlossen)"
+                )
+                try:
+                    await materialize_day(day)
+                except Exception as e:
+                    logger.error(f"Tag {day} konnte nicht neu materialisiert werden: {e}")
+                continue
+
+            result = await apply_counts(absolute, increments, (spool_name, group[-1][0]), epoch)
+            if mark_applied:
+                mark_applied(group[-1][0])
+            if "occupancy" in result:
+                # Der Tagespuffer hält nur heute (Nachzügler von gestern stehen in counts)
+                if day == now_local().strftime("%Y-%m-%d"):
+                    today_buffer.record(result["count_in"], result["count_out"],
+                                        result["occupancy"], when=from_epoch(epoch),
+                                        sensor=self.site)
+                alert_engines[self.site].observe(result["count_in"], result["count_out"],
+                                                 result["occupancy_corrected"], epoch=epoch)
+        self._last_result = result
+        return result
+
+    async def _recover(self):
+        """Spielt Spool-Dateien beendeter Prozesse nach (z.B. nach Absturz oder Neustart)."""
+        try:
+            for path, fd in self.spool.orphans():
+                name = os.path.basename(path)
+                try:
+                    records = read_records(path, await get_spool_offset(name))
+                    if records:
+                        await self._apply_records(records, name)
+                        logger.info(f"Spool {name}: {len(records)} Einträge nachgespielt")
+                    os.unlink(path)
+                finally:
+                    os.close(fd)
+            await purge_spool_offsets(self.spool.names())
+        except Exception as e:
+            logger.error(f"Spool-Wiederherstellung fehlgeschlagen (nächster Start versucht es erneut): {e}")
+        self.recovered.set()
+
+    @staticmethod
+    def _fail(batch: List[asyncio.Future], error: Exception):
+        for future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+
+# Eine Instanz je Standort
+ingest_queues = PerSite(IngestQueue)
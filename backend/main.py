@@ -1,24 +1,47 @@
+import asyncio
+import hmac
 import json
 import logging
-import re
+import os
 import traceback
 from datetime import datetime, timedelta
 from contextlib import asynccontextmanager
-from typing import Dict, Any
+from typing import Dict, Optional, Tuple
+from xml.etree.ElementTree import ParseError
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from alerts import alert_engines
+from analytics import (
+    refresh_aggregates, refresh_calendar_flags, get_yearly_totals, get_year_comparison,
+    get_weekday_profile, get_peak_days, get_open_day_averages
+)
+from caching import CachedStaticFiles, etag_middleware, render_index, set_cache
+from config import (
+    WORKERS, LEADER_LOCK_TTL, BACKUP_DIR, BACKUP_HOUR, BACKUP_MINUTE, FRONTEND_DIR,
+    CACHE_LIVE_SECONDS, CACHE_TODAY_SECONDS, CACHE_STATS_SECONDS, CACHE_CLOSED_SECONDS, WEBHOOK_MAX_BODY_BYTES, WEBHOOK_MAX_CONCURRENCY,
+    WEBHOOK_RETRY_AFTER, WEBHOOK_RESPONSE_TIMEOUT
+)
+from coordination import LEADER_LOCK, leader_only, release_lock, renew_leadership
+from drift import check_anchor, get_anchors, get_occupancy_series, state_from_live
+from flow import get_flow_hourly, get_flow_minutes, summarize as summarize_flow
 from database import (
     init_db,
-    get_hourly_stats, get_daily_stats, get_monthly_stats,
-    update_live_count, get_live_count,
-    save_count_if_changed, check_daily_reset
+    get_hourly_stats, get_interval_stats, get_daily_stats, get_monthly_stats,
+    get_live_count, check_daily_reset, get_counter_events
 )
+from ingest import IngestDeferred, IngestOverloaded, ingest_queues
+from opening_hours import opening_calendar
+from readiness import readiness
+from sites import PRIMARY_SITE, SITES, SiteMiddleware, connections, get_site, use_site
+from spool import SpoolError
+from timeutil import SITE_TZ, now_local
+from timeseries import RESOLUTIONS, today_buffer
+from xml_ingest import parse_counters, to_push_counts
 
 # Logging konfigurieren
 logging.basicConfig(
@@ -27,38 +50,209 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Scheduler für täglichen Mitternachts-Reset
-scheduler = AsyncIOScheduler()
+# Scheduler für täglichen Mitternachts-Reset (wird erst nach dem Start angelegt)
+scheduler = None
 
 
+@leader_only
 async def scheduled_daily_reset():
-    """Geplanter täglicher Reset um Mitternacht."""
-    try:
-        reset_done = await check_daily_reset()
-        if reset_done:
-            logger.info("Geplanter täglicher Reset um Mitternacht durchgeführt")
-    except Exception as e:
-        logger.error(f"Fehler beim geplanten Reset: {e}")
+    """Geplanter täglicher Reset um Mitternacht (alle Standorte)."""
+    for site in SITES:
+        with use_site(site):
+            try:
+                reset_done = await check_daily_reset()
+                if reset_done:
+                    logger.info(f"Geplanter täglicher Reset um Mitternacht durchgeführt ({site})")
+            except Exception as e:
+                logger.error(f"Fehler beim geplanten Reset ({site}): {e}")
 
+    # Der gestrige Tag ist abgeschlossen - Aggregate nachziehen
+    await scheduled_refresh_aggregates()
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Startup und Shutdown Handler."""
-    await init_db()
-    logger.info("Datenbank initialisiert")
 
+@leader_only
+async def scheduled_refresh_aggregates():
+    """Materialisiert abgeschlossene Tage in die Aggregat-Tabellen (alle Standorte)."""
+    for site in SITES:
+        with use_site(site):
+            try:
+                await refresh_aggregates()
+                await refresh_calendar_flags()
+            except Exception as e:
+                logger.error(f"Fehler beim Aktualisieren der Aggregate ({site}): {e}")
+
+
+@leader_only
+async def scheduled_silence_check():
+    """Prüft ob ein Sensor während der Öffnungszeiten verstummt ist."""
+    is_open = opening_calendar.is_open_at(now_local())
+    for site in SITES:
+        with use_site(site):
+            try:
+                live = await get_live_count()
+                alert_engines[site].check_silence(live.get("last_update"), is_open)
+            except Exception as e:
+                logger.error(f"Fehler bei der Stille-Prüfung ({site}): {e}")
+
+
+@leader_only
+async def scheduled_drift_check():
+    """Setzt den Schließzeit-Anker der Drift-Korrektur auch ohne weitere Ereignisse."""
+    for site in SITES:
+        with use_site(site):
+            try:
+                await check_anchor()
+            except Exception as e:
+                logger.error(f"Fehler bei der Drift-Prüfung ({site}): {e}")
+
+
+@leader_only
+async def scheduled_backup():
+    """Geplantes Online-Backup der Datenbanken (weitere Standorte in Unterverzeichnissen)."""
+    from backup import run_backup
+
+    for site in SITES.values():
+        backup_dir = BACKUP_DIR if site.id == PRIMARY_SITE else os.path.join(BACKUP_DIR, site.id)
+        try:
+            path = await run_backup(backup_dir, site.database)
+            logger.info(f"Geplantes Backup erstellt: {path}")
+        except Exception as e:
+            logger.error(f"Fehler beim geplanten Backup ({site.id}): {e}")
+
+
+def start_scheduler():
+    """Plant die wiederkehrenden Jobs (APScheduler wird erst hier geladen)."""
+    global scheduler
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    scheduler = AsyncIOScheduler(timezone=SITE_TZ)
     # Täglichen Reset um Mitternacht planen
+    # (läuft in jedem Worker, ausgeführt wird er nur vom Leader)
     scheduler.add_job(
         scheduled_daily_reset,
         CronTrigger(hour=0, minute=0),
         id='daily_reset'
     )
+    # Tägliches Online-Backup
+    scheduler.add_job(
+        scheduled_backup,
+        CronTrigger(hour=BACKUP_HOUR, minute=BACKUP_MINUTE),
+        id='daily_backup'
+    )
+    # Sensor-Stille jede Minute prüfen
+    scheduler.add_job(
+        scheduled_silence_check,
+        IntervalTrigger(minutes=1),
+        id='silence_check'
+    )
+    # Drift-Anker (Schließzeit, Leerlauf) alle 5 Minuten prüfen
+    scheduler.add_job(
+        scheduled_drift_check,
+        IntervalTrigger(minutes=5),
+        id='drift_check'
+    )
+    # Leader-Lock regelmäßig verlängern, bevor er abläuft
+    scheduler.add_job(
+        renew_leadership,
+        IntervalTrigger(seconds=max(1, LEADER_LOCK_TTL // 3)),
+        id='leader_heartbeat'
+    )
     scheduler.start()
     logger.info("Mitternachts-Reset Scheduler gestartet")
 
+
+# Versuche je Aufwärm-Schritt (Pause dazwischen 2, 4, ... Sekunden)
+WARM_UP_ATTEMPTS = 3
+
+
+async def start_jobs():
+    """Scheduler starten - auch wenn die Leader-Wahl gerade fehlschlägt."""
+    try:
+        await renew_leadership()
+    except Exception as e:
+        # der Heartbeat-Job versucht es regelmäßig erneut
+        logger.error(f"Leader-Wahl fehlgeschlagen: {e}")
+    if scheduler is None:
+        start_scheduler()
+
+
+async def rebuild_buffer():
+    # Tagespuffer nur bei einem Worker - sonst sieht jeder Prozess nur seine Webhooks
+    if WORKERS == 1:
+        await today_buffer.rebuild(SITES)
+
+
+async def wait_for_spool():
+    # Spool-Dateien beendeter Prozesse sind nachgespielt
+    for site in SITES:
+        await ingest_queues[site].recovered.wait()
+
+
+async def warm_up_step(phase: str, step) -> bool:
+    """Führt einen Aufwärm-Schritt mit Wiederholungen aus.
+
+    Scheitert er endgültig, meldet /api/ready ihn unter "failed".
+    """
+    for attempt in range(1, WARM_UP_ATTEMPTS + 1):
+        try:
+            await step()
+            readiness.mark(phase)
+            return True
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Aufwärmen '{phase}' fehlgeschlagen ({attempt}/{WARM_UP_ATTEMPTS}): {e}")
+            if attempt < WARM_UP_ATTEMPTS:
+                await asyncio.sleep(2 ** attempt)
+    readiness.fail(phase, error)
+    return False
+
+
+async def warm_up():
+    """Alles, was für die Webhook-Annahme nicht nötig ist, nach dem Start erledigen.
+
+    Die Schritte hängen nicht voneinander ab: der Scheduler (Mitternachts-Reset,
+    Backups, Stille-Prüfung) läuft auch, wenn der Tagespuffer scheitert.
+    """
+    await warm_up_step("scheduler", start_jobs)
+    await warm_up_step("buffer", rebuild_buffer)
+    await warm_up_step("spool", wait_for_spool)
+    # Fehlende Tages-Aggregate nachziehen (erster Start: ganze Historie).
+    # Nicht Teil der Bereitschaft - das kann beim ersten Start lange dauern.
+    await warm_up_step("aggregates", scheduled_refresh_aggregates)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup und Shutdown Handler."""
+    readiness.mark("imports")
+    for site in SITES:
+        with use_site(site):
+            await init_db()
+    logger.info(f"Datenbank initialisiert ({len(SITES)} Standorte)")
+    readiness.mark("database")
+
+    # Ab hier können Webhooks angenommen werden
+    for site in SITES:
+        alert_engines[site].start()
+        ingest_queues[site].start()
+    readiness.expect("buffer", "spool", "scheduler")
+    warm_task = asyncio.create_task(warm_up())
+    readiness.mark("accepting")
+
     logger.info("Warte auf Daten vom Xovis-Sensor (Data Push)...")
     yield
-    scheduler.shutdown()
+    warm_task.cancel()
+    for site in SITES:
+        await ingest_queues[site].stop()
+        await alert_engines[site].stop()
+    if today_buffer.ready:
+        today_buffer.save_snapshot()
+    if scheduler:
+        scheduler.shutdown()
+    await release_lock(LEADER_LOCK)
+    await connections.close()
     logger.info("Server beendet")
 
 
@@ -79,125 +273,203 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Statische Dateien
-app.mount("/static", StaticFiles(directory="/app/frontend"), name="static")
+# ETag / 304 für cachebare API-Antworten (vor der Komprimierung berechnet)
+app.add_middleware(BaseHTTPMiddleware, dispatch=etag_middleware)
+
+# Antworten komprimieren (lange Zeiträume / Columnar-Format)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+# /sites/<id>/... auf den Standort umleiten (äußerste Middleware, setzt current_site)
+app.add_middleware(SiteMiddleware)
+
+# Statische Dateien (mit ?v=<hash> unveränderlich cachebar)
+app.mount("/static", CachedStaticFiles(directory=FRONTEND_DIR), name="static")
 
 
 @app.get("/")
 async def root():
-    """Hauptseite."""
-    return FileResponse("/app/frontend/index.html")
+    """Hauptseite mit versionierten Asset-URLs."""
+    return HTMLResponse(render_index(), headers={"Cache-Control": "no-cache"})
+
+
+def is_closed_period(year: int, month: Optional[int] = None) -> bool:
+    """Liegt der Zeitraum vollständig in der Vergangenheit (Daten ändern sich nicht mehr)?"""
+    now = now_local()
+    if month is None:
+        return year < now.year
+    return (year, month) < (now.year, now.month)
 
 
 # ============== WEBHOOK für Xovis Data Push ==============
 
-@app.post("/api/webhook")
-async def webhook_xovis(request: Request):
-    """Empfängt Live-Daten vom Xovis-Sensor."""
-    try:
-        content_type = request.headers.get("content-type", "")
-        body = await request.body()
-        body_text = body.decode("utf-8")
+# Begrenzt gleichzeitig verarbeitete Webhook-Requests (Body lesen + parsen)
+_webhook_slots = asyncio.Semaphore(WEBHOOK_MAX_CONCURRENCY)
 
-        logger.info(f"Webhook empfangen - Content-Type: {content_type}")
-        logger.info(f"Body: {body_text}")
 
-        data = json.loads(body_text)
+def overload_response(status_code: int, message: str) -> JSONResponse:
+    """Antwort bei Überlast - der Sensor soll nach Retry-After erneut senden."""
+    return JSONResponse(
+        {"status": "overloaded", "message": message},
+        status_code=status_code,
+        headers={"Retry-After": str(WEBHOOK_RETRY_AFTER)}
+    )
 
-        # Prüfen ob Mitternachts-Reset nötig ist
-        reset_done = await check_daily_reset()
-        if reset_done:
-            logger.info("Täglicher Reset um Mitternacht durchgeführt")
 
-        # Aktuelle Werte aus DB holen
-        live = await get_live_count()
-        count_in = live.get("count_in", 0)
-        count_out = live.get("count_out", 0)
-        base_in = live.get("base_in", 0)
-        base_out = live.get("base_out", 0)
-
-        # Format 1: Live Data Push (live_data mit frames/events)
-        if "live_data" in data:
-            live_data = data["live_data"]
-            frames = live_data.get("frames", [])
-            for frame in frames:
-                events = frame.get("events", [])
-                for event in events:
-                    if event.get("category") == "COUNT" and event.get("type") == "COUNT_INCREMENT":
-                        attrs = event.get("attributes", {})
-                        counter_name = attrs.get("counter_name", "")
-                        counter_value = attrs.get("counter_value", 0)
-                        # counter_value ist kumulativ - Base-Offset abziehen für Tageswert
-                        if counter_name == "fw":
-                            count_in = max(0, counter_value - base_in)
-                        elif counter_name == "bw":
-                            count_out = max(0, counter_value - base_out)
-
-        # Format 2: Logic Push (logics_data mit records) - Intervall-Werte addieren
-        elif "logics_data" in data:
-            logics_data = data["logics_data"]
-            logics = logics_data.get("logics", [])
-            for logic in logics:
-                records = logic.get("records", [])
-                for record in records:
-                    counts = record.get("counts", [])
-                    for count in counts:
-                        name = count.get("name", "")
-                        value = count.get("value", 0)
-                        if name == "fw":
-                            count_in += value
-                        elif name == "bw":
-                            count_out += value
-
-        # Speichern wenn Werte vorhanden
-        if count_in > 0 or count_out > 0:
-            occupancy = max(0, count_in - count_out)
-            await update_live_count(count_in, count_out, occupancy)
-            # Auch in Historie speichern für Charts
-            saved = await save_count_if_changed(count_in, count_out, occupancy)
-            if saved:
-                logger.info(
-                    f"Gespeichert: IN={count_in}, OUT={count_out}, Belegung={occupancy}"
+async def read_limited_body(request: Request) -> Optional[bytes]:
+    """Liest den Request-Body, bricht ab sobald WEBHOOK_MAX_BODY_BYTES überschritten ist."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > WEBHOOK_MAX_BODY_BYTES:
+        return None
+
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > WEBHOOK_MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def extract_push_counts(data: Dict) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Extrahiert Zählwerte aus einem Xovis-Push.
+
+    Gibt (absolute, increments) zurück: kumulative Zählerstände aus dem
+    Live Data Push bzw. Intervall-Werte aus dem Logic Push.
+    """
+    absolute = {}
+    increments = {"fw": 0, "bw": 0}
+
+    # Format 1: Live Data Push (live_data mit frames/events)
+    if "live_data" in data:
+        live_data = data["live_data"]
+        frames = live_data.get("frames", [])
+        for frame in frames:
+            events = frame.get("events", [])
+            for event in events:
+                if event.get("category") == "COUNT" and event.get("type") == "COUNT_INCREMENT":
+                    attrs = event.get("attributes", {})
+                    counter_name = attrs.get("counter_name", "")
+                    counter_value = attrs.get("counter_value", 0)
+                    # counter_value ist kumulativ (Base-Offset zieht apply_counts ab)
+                    if counter_name in ("fw", "bw"):
+                        absolute[counter_name] = counter_value
+
+    # Format 2: Logic Push (logics_data mit records) - Intervall-Werte addieren
+    elif "logics_data" in data:
+        logics_data = data["logics_data"]
+        logics = logics_data.get("logics", [])
+        for logic in logics:
+            records = logic.get("records", [])
+            for record in records:
+                counts = record.get("counts", [])
+                for count in counts:
+                    name = count.get("name", "")
+                    value = count.get("value", 0)
+                    if name in ("fw", "bw"):
+                        increments[name] += value
+
+    return absolute, increments
+
+
+def webhook_authorized(request: Request) -> bool:
+    """Prüft den Webhook-Token des Standorts (nur Header X-Webhook-Token).
+
+    Kein ?token= - Query-Parameter landen in den Access-Logs von nginx.
+    """
+    expected = get_site().webhook_token
+    if not expected:
+        return True
+    provided = request.headers.get("x-webhook-token", "")
+    return hmac.compare_digest(provided.encode("utf-8"), expected.encode("utf-8"))
+
+
+@app.post("/api/webhook")
+async def webhook_xovis(request: Request):
+    """Empfängt Live-Daten vom Xovis-Sensor (Standort über /sites/<id>/api/webhook)."""
+    if not webhook_authorized(request):
+        return JSONResponse({"status": "error", "message": "Ungültiger Token"}, status_code=401)
+    if _webhook_slots.locked():
+        return overload_response(503, "Zu viele gleichzeitige Webhooks")
+
+    async with _webhook_slots:
+        try:
+            content_type = request.headers.get("content-type", "")
+            body = await read_limited_body(request)
+            if body is None:
+                return JSONResponse(
+                    {"status": "error", "message": "Body zu groß"}, status_code=413
                 )
+            body_text = body.decode("utf-8")
+
+            logger.info(f"Webhook empfangen - Content-Type: {content_type}")
+            logger.info(f"Body: {body_text}")
+
+            # XML-Push (z.B. Count Data Push im XML-Format) oder JSON
+            if "xml" in content_type or body_text.lstrip().startswith("<"):
+                try:
+                    absolute, increments = to_push_counts(parse_counters(body))
+                except ParseError as e:
+                    logger.warning(f"Webhook abgelehnt, ungültiges XML: {e}")
+                    return JSONResponse(
+                        {"status": "error", "message": f"Ungültiges XML: {e}"}, status_code=400
+                    )
             else:
-                logger.info(f"Aktualisiert: IN={count_in}, OUT={count_out}, Belegung={occupancy}")
-        else:
-            logger.info("Keine Zählwerte im Webhook")
+                try:
+                    data = json.loads(body_text)
+                except json.JSONDecodeError as e:
+                    logger.warning(f"Webhook abgelehnt, ungültiges JSON: {e}")
+                    return JSONResponse(
+                        {"status": "error", "message": f"Ungültiges JSON: {e}"}, status_code=400
+                    )
+                absolute, increments = extract_push_counts(data)
+
+            # Zählwerte in den Spool schreiben und an den Ingest-Writer übergeben
+            try:
+                future = ingest_queues.current().submit(absolute, increments)
+            except IngestOverloaded as e:
+                logger.warning(f"Webhook abgelehnt: {e}")
+                return overload_response(429, str(e))
+            except SpoolError as e:
+                # Nicht gesichert - der Sensor soll erneut senden
+                logger.error(f"Webhook abgelehnt: {e}")
+                return overload_response(503, str(e))
 
-        return {"status": "ok", "count_in": count_in, "count_out": count_out}
+            try:
+                result = await asyncio.wait_for(future, WEBHOOK_RESPONSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Eintrag bleibt in der Warteschlange und wird noch geschrieben
+                readiness.webhook_accepted()
+                return JSONResponse({"status": "queued"}, status_code=202)
+            except IngestDeferred:
+                # DB nicht verfügbar - Eintrag liegt sicher im Spool
+                readiness.webhook_accepted()
+                return JSONResponse({"status": "spooled"}, status_code=202)
+            except SpoolError as e:
+                logger.error(f"Webhook abgelehnt: {e}")
+                return overload_response(503, str(e))
+
+            count_in = result["count_in"]
+            count_out = result["count_out"]
+
+            if "occupancy" in result:
+                occupancy = result["occupancy"]
+                if result["saved"]:
+                    logger.info(
+                        f"Gespeichert: IN={count_in}, OUT={count_out}, Belegung={occupancy}"
+                    )
+                else:
+                    logger.info(f"Aktualisiert: IN={count_in}, OUT={count_out}, Belegung={occupancy}")
+            else:
+                logger.info("Keine Zählwerte im Webhook")
 
-    except Exception as e:
-        logger.error(f"Webhook Fehler: {e}")
-        logger.error(traceback.format_exc())
-        return {"status": "error", "message": str(e)}
-
-
-def parse_xovis_xml(text: str) -> Dict[str, Any]:
-    """Parst Xovis XML-Daten."""
-    result: Dict[str, Any] = {"raw": text}
-
-    # Verschiedene XML-Patterns für Xovis
-    patterns = [
-        (r"<fw[^>]*>(\d+)</fw>", "fw"),
-        (r"<bw[^>]*>(\d+)</bw>", "bw"),
-        (r"<forward[^>]*>(\d+)</forward>", "forward"),
-        (r"<backward[^>]*>(\d+)</backward>", "backward"),
-        (r"<in[^>]*>(\d+)</in>", "in"),
-        (r"<out[^>]*>(\d+)</out>", "out"),
-        (r"<cnt[^>]*fw[^>]*>(\d+)</", "fw"),
-        (r"<cnt[^>]*bw[^>]*>(\d+)</", "bw"),
-        (r"cnt_in=\"(\d+)\"", "cnt_in"),
-        (r"cnt_out=\"(\d+)\"", "cnt_out"),
-        (r"\"fw\"\s*:\s*(\d+)", "fw"),
-        (r"\"bw\"\s*:\s*(\d+)", "bw"),
-    ]
-
-    for pattern, key in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            result[key] = int(match.group(1))
+            readiness.webhook_accepted()
+            return {"status": "ok", "count_in": count_in, "count_out": count_out}
 
-    return result
+        except Exception as e:
+            logger.error(f"Webhook Fehler: {e}")
+            logger.error(traceback.format_exc())
+            return {"status": "error", "message": str(e)}
 
 
 def extract_count(data: Dict, keys: list) -> int:
@@ -230,9 +502,62 @@ def extract_count(data: Dict, keys: list) -> int:
 
 # ============== API für Dashboard ==============
 
+# Spaltenzuordnung für das kompakte Antwortformat (?format=columnar)
+HOURLY_COLUMNS = {
+    "labels": "hour", "in": "total_in", "out": "total_out", "occupancy": "max_occupancy"
+}
+INTERVAL_COLUMNS = {
+    "labels": "time", "in": "total_in", "out": "total_out", "occupancy": "max_occupancy"
+}
+DAILY_COLUMNS = {
+    "labels": "date", "in": "total_in", "out": "total_out", "occupancy": "max_occupancy",
+    "open": "is_open"
+}
+FLOW_COLUMNS = {
+    "labels": "hour", "arrivals": "arrivals", "departures": "departures",
+    "avg_occupancy": "avg_occupancy", "dwell": "dwell_minutes"
+}
+FLOW_MINUTE_COLUMNS = {
+    "labels": "time", "arrivals": "arrivals", "departures": "departures", "occupancy": "occupancy"
+}
+
+OCCUPANCY_COLUMNS = {
+    "labels": "time", "occupancy": "occupancy", "corrected": "occupancy_corrected"
+}
+
+
+def with_calendar(rows: list) -> list:
+    """Ergänzt Tageszeilen um das is_open-Flag aus dem Öffnungskalender."""
+    for row in rows:
+        row["is_open"] = int(opening_calendar.day_info(row["date"])["is_open"])
+    return rows
+
+
+def to_columnar(rows: list, columns: Dict[str, str], nullable: Tuple[str, ...] = ()) -> Dict[str, list]:
+    """Wandelt Zeilen in parallele Arrays um (direkt von Chart.js verwendbar).
+
+    Spalten in `nullable` behalten None (Chart.js zeichnet dort eine Lücke).
+    """
+    result = {}
+    for key, field in columns.items():
+        if key == "labels" or key in nullable:
+            result[key] = [row[field] for row in rows]
+        else:
+            result[key] = [row[field] or 0 for row in rows]
+    return result
+
+
+def corrected_occupancy(live: dict) -> int:
+    """Driftkorrigierte Belegung aus den Live-Werten (siehe drift.py)."""
+    if "drift_offset" not in live:
+        return max(0, (live.get("count_in") or 0) - (live.get("count_out") or 0))
+    return state_from_live(live, 0).corrected(live["count_in"] or 0, live["count_out"] or 0)
+
+
 @app.get("/api/live")
-async def api_get_live():
+async def api_get_live(response: Response):
     """Aktuelle Zähldaten direkt aus der Live-Tabelle."""
+    set_cache(response, CACHE_LIVE_SECONDS)
     # Mitternachts-Reset auch ohne Webhooks sicherstellen (Frontend pollt alle 10s)
     reset_done = await check_daily_reset()
     if reset_done:
@@ -248,17 +573,20 @@ async def api_get_live():
             "count_in": count_in,
             "count_out": count_out,
             "occupancy": occupancy,
+            "occupancy_corrected": corrected_occupancy(live),
         },
-        "timestamp": datetime.now().isoformat()
+        "timestamp": now_local().isoformat()
     }
 
 
 @app.get("/api/status")
 async def get_status():
-    """Status des Systems."""
-    from config import XOVIS_SENSOR_IP, XOVIS_BASE_URL, XOVIS_USERNAME, XOVIS_PASSWORD
+    """Status des Systems (Sensor des aktuellen Standorts)."""
+    from config import XOVIS_SENSOR_PORT, XOVIS_USERNAME, XOVIS_PASSWORD
     import httpx
 
+    sensor_ip = get_site().sensor_ip
+
     live = await get_live_count()
     last_update = live.get("last_update")
 
@@ -267,57 +595,298 @@ async def get_status():
     if last_update:
         try:
             last_dt = datetime.fromisoformat(last_update)
-            webhook_active = (datetime.now() - last_dt).total_seconds() < 1800
+            webhook_active = (now_local() - last_dt).total_seconds() < 1800
         except Exception:
             pass
 
     # Methode 2: Direkte HTTP-Verbindung zum Sensor prüfen
     sensor_reachable = False
-    try:
-        async with httpx.AsyncClient(timeout=3.0) as client:
-            response = await client.get(XOVIS_BASE_URL, auth=(XOVIS_USERNAME, XOVIS_PASSWORD))
-            sensor_reachable = response.status_code < 400
-    except Exception:
-        pass
+    if sensor_ip:
+        try:
+            async with httpx.AsyncClient(timeout=3.0) as client:
+                response = await client.get(
+                    f"http://{sensor_ip}:{XOVIS_SENSOR_PORT}", auth=(XOVIS_USERNAME, XOVIS_PASSWORD)
+                )
+                sensor_reachable = response.status_code < 400
+        except Exception:
+            pass
 
     return {
         "sensor_connected": sensor_reachable or webhook_active,
-        "sensor_ip": XOVIS_SENSOR_IP,
+        "sensor_ip": sensor_ip,
         "last_update": last_update,
         "sensor_reachable": sensor_reachable,
         "webhook_active": webhook_active,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": now_local().isoformat()
+    }
+
+
+@app.get("/api/ready")
+async def get_ready():
+    """Bereitschaft: 200 sobald Datenbank und Caches aufgewärmt sind, sonst 503."""
+    report = readiness.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+
+# ============== Standorte ==============
+
+@app.get("/api/site")
+async def api_get_site():
+    """Der Standort dieser URL (für Titel und Untertitel im Dashboard)."""
+    site = get_site()
+    return {"id": site.id, "name": site.name}
+
+
+@app.get("/api/sites")
+async def api_get_sites():
+    """Alle konfigurierten Standorte mit ihrem URL-Präfix."""
+    return {"sites": [
+        {"id": site.id, "name": site.name,
+         "prefix": "" if site.id == PRIMARY_SITE else f"/sites/{site.id}"}
+        for site in SITES.values()
+    ]}
+
+
+async def site_summary(site_id: str) -> dict:
+    """Live-Werte eines Standorts (läuft als eigener Task im Kontext des Standorts)."""
+    with use_site(site_id) as site:
+        live = await get_live_count()
+    count_in = live.get("count_in") or 0
+    count_out = live.get("count_out") or 0
+    return {
+        "id": site.id,
+        "name": site.name,
+        "count_in": count_in,
+        "count_out": count_out,
+        "occupancy": max(0, count_in - count_out),
+        "occupancy_corrected": corrected_occupancy(live),
+        "last_update": live.get("last_update"),
     }
 
 
+@app.get("/api/sites/summary")
+async def api_get_sites_summary(response: Response):
+    """Heutige Werte aller Standorte, parallel abgefragt, plus Gesamtsumme."""
+    set_cache(response, CACHE_LIVE_SECONDS)
+    results = await asyncio.gather(*(site_summary(site) for site in SITES), return_exceptions=True)
+    sites = []
+    for site_id, result in zip(SITES, results):
+        if isinstance(result, Exception):
+            logger.error(f"Standort {site_id} nicht abfragbar: {result}")
+            result = {"id": site_id, "name": SITES[site_id].name, "error": str(result)}
+        sites.append(result)
+    return {
+        "sites": sites,
+        "total": {
+            key: sum(site.get(key, 0) for site in sites)
+            for key in ("count_in", "count_out", "occupancy", "occupancy_corrected")
+        },
+        "timestamp": now_local().isoformat(),
+    }
+
+
+@app.get("/api/counter-events")
+async def api_get_counter_events(limit: int = 50):
+    """Erkannte Zähler-Resets und -Überläufe des Sensors (neueste zuerst)."""
+    return {"events": await get_counter_events(min(max(limit, 1), 500))}
+
+
 @app.get("/api/stats/today")
-async def get_today_stats():
-    """Stündliche Statistiken für heute."""
-    today = datetime.now()
-    stats = await get_hourly_stats(today)
-    return {"date": today.strftime("%Y-%m-%d"), "hours": stats}
+async def get_today_stats(response: Response, fmt: str = Query("rows", alias="format"),
+                          resolution: str = "hour"):
+    """Statistiken für heute (Auflösung: minute, 15min oder hour)."""
+    set_cache(response, CACHE_TODAY_SECONDS)
+    if resolution not in RESOLUTIONS:
+        return JSONResponse(
+            {"error": f"Unbekannte Auflösung: {resolution}"}, status_code=400
+        )
+
+    today = now_local()
+    if today_buffer.ready:
+        # Aus dem In-Memory-Tagespuffer, ohne Datenbankzugriff
+        stats = today_buffer.stats(resolution)
+    elif resolution == "hour":
+        stats = await get_hourly_stats(today)
+    else:
+        stats = await get_interval_stats(today, RESOLUTIONS[resolution])
+
+    result = {
+        "date": today.strftime("%Y-%m-%d"),
+        "opening_hours": opening_calendar.day_info(today),
+        "chart_window": opening_calendar.chart_window(today),
+    }
+    key = "hours" if resolution == "hour" else "intervals"
+    if fmt == "columnar":
+        columns = HOURLY_COLUMNS if resolution == "hour" else INTERVAL_COLUMNS
+        return {**result, **to_columnar(stats, columns)}
+    return {**result, key: stats}
 
 
 @app.get("/api/stats/week")
-async def get_week_stats():
+async def get_week_stats(response: Response, fmt: str = Query("rows", alias="format")):
     """Statistiken der letzten 7 Tage."""
-    start = datetime.now() - timedelta(days=6)
-    stats = await get_daily_stats(start, 7)
-    return {
+    set_cache(response, CACHE_TODAY_SECONDS)
+    start = now_local() - timedelta(days=6)
+    stats = with_calendar(await get_daily_stats(start, 7))
+    result = {
         "start_date": start.strftime("%Y-%m-%d"),
-        "end_date": datetime.now().strftime("%Y-%m-%d"),
-        "days": stats
+        "end_date": now_local().strftime("%Y-%m-%d"),
     }
+    if fmt == "columnar":
+        return {**result, **to_columnar(stats, DAILY_COLUMNS)}
+    return {**result, "days": stats}
 
 
 @app.get("/api/stats/month")
-async def get_current_month_stats():
+async def get_current_month_stats(response: Response, fmt: str = Query("rows", alias="format")):
     """Statistiken des aktuellen Monats."""
-    now = datetime.now()
-    stats = await get_monthly_stats(now.year, now.month)
+    set_cache(response, CACHE_TODAY_SECONDS)
+    now = now_local()
+    stats = with_calendar(await get_monthly_stats(now.year, now.month))
+    if fmt == "columnar":
+        return {"year": now.year, "month": now.month, **to_columnar(stats, DAILY_COLUMNS)}
     return {"year": now.year, "month": now.month, "days": stats}
 
 
+@app.get("/api/stats/month/{year}/{month}")
+async def get_month_stats(response: Response, year: int, month: int,
+                          fmt: str = Query("rows", alias="format")):
+    """Statistiken für einen bestimmten Monat."""
+    set_cache(response, CACHE_CLOSED_SECONDS if is_closed_period(year, month) else CACHE_TODAY_SECONDS)
+    stats = with_calendar(await get_monthly_stats(year, month))
+    if fmt == "columnar":
+        return {"year": year, "month": month, **to_columnar(stats, DAILY_COLUMNS)}
+    return {"year": year, "month": month, "days": stats}
+
+
+# ============== Langzeit-Auswertungen (materialisierte Aggregate) ==============
+
+@app.get("/api/stats/years")
+async def get_years_stats(response: Response):
+    """Jahressummen aller Jahre."""
+    set_cache(response, CACHE_STATS_SECONDS)
+    return {"years": await get_yearly_totals()}
+
+
+@app.get("/api/stats/year/{year}")
+async def get_year_stats(response: Response, year: int):
+    """Monatssummen eines Jahres mit Vorjahresvergleich."""
+    set_cache(response, CACHE_CLOSED_SECONDS if is_closed_period(year) else CACHE_STATS_SECONDS)
+    return {"year": year, "months": await get_year_comparison(year)}
+
+
+@app.get("/api/stats/profile")
+async def get_profile_stats(response: Response, weekday: Optional[int] = None):
+    """Durchschnittlicher Tagesverlauf je Wochentag (0 = Montag ... 6 = Sonntag)."""
+    set_cache(response, CACHE_STATS_SECONDS)
+    return {"weekday": weekday, "hours": await get_weekday_profile(weekday)}
+
+
+@app.get("/api/stats/averages")
+async def get_average_stats(response: Response, days: int = 30):
+    """Durchschnittswerte der letzten `days` Tage - nur geöffnete Tage."""
+    set_cache(response, CACHE_STATS_SECONDS)
+    end = now_local() - timedelta(days=1)
+    start = end - timedelta(days=max(days, 1) - 1)
+    averages = await get_open_day_averages(start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+    return {"start_date": start.strftime("%Y-%m-%d"), "end_date": end.strftime("%Y-%m-%d"),
+            **averages}
+
+
+# ============== Personenfluss und Verweildauer ==============
+
+def parse_day(date: Optional[str]) -> Optional[datetime]:
+    """'YYYY-MM-DD' oder heute. None bei ungültigem Datum."""
+    if not date:
+        return now_local()
+    try:
+        return datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def set_day_cache(response: Response, day: datetime):
+    """Vergangene Tage ändern sich nicht mehr, der heutige schon."""
+    closed = day.date() < now_local().date()
+    set_cache(response, CACHE_CLOSED_SECONDS if closed else CACHE_TODAY_SECONDS)
+
+
+@app.get("/api/stats/flow")
+async def get_flow_stats(response: Response, date: Optional[str] = None,
+                         fmt: str = Query("rows", alias="format")):
+    """Ein-/Austritte, mittlere Belegung und Verweildauer (Little's Law) je Stunde."""
+    day = parse_day(date)
+    if day is None:
+        return JSONResponse({"error": f"Ungültiges Datum: {date}"}, status_code=400)
+    set_day_cache(response, day)
+    hours = await get_flow_hourly(day)
+    result = {
+        "date": day.strftime("%Y-%m-%d"),
+        "chart_window": opening_calendar.chart_window(day),
+        **summarize_flow(hours),
+    }
+    if fmt == "columnar":
+        return {**result, **to_columnar(hours, FLOW_COLUMNS, nullable=("dwell",))}
+    return {**result, "hours": hours}
+
+
+@app.get("/api/stats/flow/minutes")
+async def get_flow_minute_stats(response: Response, date: Optional[str] = None,
+                                fmt: str = Query("rows", alias="format")):
+    """Warteschlangen-Kurve: Ein-/Austritte und Belegung je Minute (nur Minuten mit Ereignissen)."""
+    day = parse_day(date)
+    if day is None:
+        return JSONResponse({"error": f"Ungültiges Datum: {date}"}, status_code=400)
+    set_day_cache(response, day)
+    minutes = await get_flow_minutes(day)
+    result = {"date": day.strftime("%Y-%m-%d"), "chart_window": opening_calendar.chart_window(day)}
+    if fmt == "columnar":
+        return {**result, **to_columnar(minutes, FLOW_MINUTE_COLUMNS)}
+    return {**result, "minutes": minutes}
+
+
+# ============== Belegungs-Korrektur ==============
+
+@app.get("/api/stats/occupancy")
+async def get_occupancy_stats(response: Response, date: Optional[str] = None,
+                              resolution: str = "15min",
+                              fmt: str = Query("rows", alias="format")):
+    """Roh- und driftkorrigierte Belegung je Intervall, dazu die Anker des Tages."""
+    if resolution not in RESOLUTIONS:
+        return JSONResponse({"error": f"Unbekannte Auflösung: {resolution}"}, status_code=400)
+    day = parse_day(date)
+    if day is None:
+        return JSONResponse({"error": f"Ungültiges Datum: {date}"}, status_code=400)
+    set_day_cache(response, day)
+    series = await get_occupancy_series(day, RESOLUTIONS[resolution])
+    result = {
+        "date": day.strftime("%Y-%m-%d"),
+        "resolution": resolution,
+        "chart_window": opening_calendar.chart_window(day),
+        "anchors": await get_anchors(day),
+    }
+    if fmt == "columnar":
+        return {**result, **to_columnar(series, OCCUPANCY_COLUMNS)}
+    return {**result, "data": series}
+
+
+@app.get("/api/calendar")
+async def get_calendar(response: Response, date: Optional[str] = None):
+    """Öffnungszeiten und Feiertags-Status für einen Tag (Standard: heute)."""
+    day = parse_day(date)
+    if day is None:
+        return JSONResponse({"error": f"Ungültiges Datum: {date}"}, status_code=400)
+    set_cache(response, CACHE_STATS_SECONDS)
+    return {**opening_calendar.day_info(day), "chart_window": opening_calendar.chart_window(day)}
+
+
+@app.get("/api/stats/peaks")
+async def get_peak_stats(response: Response, limit: int = 10):
+    """Die Tage mit den meisten Eintritten."""
+    set_cache(response, CACHE_STATS_SECONDS)
+    return {"days": await get_peak_days(min(max(limit, 1), 100))}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
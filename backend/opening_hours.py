@@ -0,0 +1,115 @@
+"""Öffnungszeiten- und Feiertagskalender.
+
+Öffnungszeiten werden als OPENING_HOURS konfiguriert, z.B.
+"Mo-Fr 07:00-19:00; Sa 08:00-12:00". Feiertage kommen aus HOLIDAYS
+(kommagetrennt) und optional aus HOLIDAYS_FILE (ein Datum pro Zeile,
+Kommentare mit #). Die Informationen pro Tag werden beim Materialisieren
+in daily_totals gespeichert, damit Auswertungen geschlossene Tage direkt
+in SQL ausfiltern können.
+"""
+import logging
+import os
+from datetime import date, datetime
+from typing import Dict, Optional, Set, Tuple, Union
+
+from config import HOLIDAYS, HOLIDAYS_FILE, OPENING_HOURS
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = {"mo": 0, "di": 1, "tu": 1, "mi": 2, "we": 2, "do": 3, "th": 3,
+            "fr": 4, "sa": 5, "so": 6, "su": 6}
+
+# Fallback für das Chart-Fenster, wenn keine Öffnungszeiten gelten
+DEFAULT_WINDOW = (6, 20)
+
+# Fallback bei ungültigem OPENING_HOURS (Standardwert aus config.py)
+DEFAULT_SPEC = "Mo-Fr 06:00-20:00"
+
+
+def _minutes(value: str) -> int:
+    hour, minute = value.strip().split(":")
+    return int(hour) * 60 + int(minute)
+
+
+def parse_opening_hours(spec: str) -> Dict[int, Tuple[int, int]]:
+    """Parst "Mo-Fr 07:00-19:00; Sa 08:00-12:00" zu {Wochentag: (von, bis)} in Minuten."""
+    result: Dict[int, Tuple[int, int]] = {}
+    for part in spec.split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        days, times = part.split()
+        start, end = times.split("-")
+        first, _, last = days.lower().partition("-")
+        first_day = WEEKDAYS[first[:2]]
+        last_day = WEEKDAYS[last[:2]] if last else first_day
+        for weekday in range(first_day, last_day + 1):
+            result[weekday] = (_minutes(start), _minutes(end))
+    return result
+
+
+def load_holidays(values: str = HOLIDAYS, path: str = HOLIDAYS_FILE) -> Set[str]:
+    """Feiertage aus Umgebungsvariable und optionaler Datei."""
+    holidays = {v.strip() for v in values.split(",") if v.strip()}
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    holidays.add(line)
+    return holidays
+
+
+class OpeningCalendar:
+    """Öffnungszeiten und Schließtage des Gebäudes."""
+
+    def __init__(self, spec: str = OPENING_HOURS, holidays: Optional[Set[str]] = None):
+        try:
+            self.hours = parse_opening_hours(spec)
+        except (ValueError, KeyError) as e:
+            logger.error(f"Ungültige Öffnungszeiten '{spec}' ({e!r}), verwende '{DEFAULT_SPEC}'")
+            self.hours = parse_opening_hours(DEFAULT_SPEC)
+        self.holidays = load_holidays() if holidays is None else holidays
+
+    def day_info(self, day: Union[str, date, datetime]) -> dict:
+        """Öffnungsinformationen für einen Tag."""
+        if isinstance(day, str):
+            day = datetime.strptime(day, "%Y-%m-%d")
+        day_str = day.strftime("%Y-%m-%d")
+        is_holiday = day_str in self.holidays
+        hours = None if is_holiday else self.hours.get(day.weekday())
+        return {
+            "date": day_str,
+            "is_open": hours is not None,
+            "is_holiday": is_holiday,
+            "open_minute": hours[0] if hours else None,
+            "close_minute": hours[1] if hours else None,
+        }
+
+    def is_open_at(self, when: datetime) -> bool:
+        """Ist das Gebäude zu diesem Zeitpunkt geöffnet?"""
+        info = self.day_info(when)
+        if not info["is_open"]:
+            return False
+        minute = when.hour * 60 + when.minute
+        return info["open_minute"] <= minute < info["close_minute"]
+
+    def chart_window(self, day: Union[str, date, datetime]) -> Tuple[int, int]:
+        """Stundenbereich (von, bis inkl.) für den Tages-Chart.
+
+        An geschlossenen Tagen wird das weiteste Fenster der Woche verwendet.
+        """
+        info = self.day_info(day)
+        if info["is_open"]:
+            spans = [(info["open_minute"], info["close_minute"])]
+        else:
+            spans = list(self.hours.values())
+        if not spans:
+            return DEFAULT_WINDOW
+        start = min(s for s, _ in spans) // 60
+        end = max(e for _, e in spans)
+        return start, (end - 1) // 60 if end % 60 else end // 60
+
+
+# Singleton-Instanz
+opening_calendar = OpeningCalendar()
@@ -0,0 +1,72 @@
+"""Start-Profil und Bereitschaft des Servers (/api/ready).
+
+Der Server nimmt Webhooks an, sobald die Datenbank initialisiert ist.
+Alles Weitere (Scheduler, Tagespuffer, Aggregate) wird danach im
+Hintergrund aufgewärmt; gescheiterte Schritte stehen unter "failed".
+Jede Phase wird mit ihrer Zeit seit Prozessstart protokolliert -
+darunter auch der erste angenommene Webhook.
+
+Startzeitpunkt ist XOVIS_START_TIME (von start.py gesetzt, bevor uvicorn
+geladen wird), sonst der Import dieses Moduls.
+"""
+import logging
+import os
+import time
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+PROCESS_START = float(os.getenv("XOVIS_START_TIME") or time.time())
+
+
+class Readiness:
+    """Zeitmarken der Startphasen und offene Aufwärm-Schritte."""
+
+    def __init__(self, start: float = PROCESS_START):
+        self.start = start
+        self.phases: Dict[str, int] = {}
+        self.pending: Set[str] = set()
+        # Endgültig gescheiterte Phasen mit Fehlermeldung
+        self.failed: Dict[str, str] = {}
+        self.first_webhook_ms: Optional[int] = None
+
+    def _elapsed_ms(self) -> int:
+        return int((time.time() - self.start) * 1000)
+
+    def mark(self, phase: str):
+        """Phase abgeschlossen (Millisekunden seit Prozessstart)."""
+        self.phases[phase] = self._elapsed_ms()
+        self.pending.discard(phase)
+        logger.info(f"Start-Phase '{phase}' nach {self.phases[phase]} ms")
+
+    def fail(self, phase: str, error: str):
+        """Phase endgültig gescheitert - bleibt offen und wird gemeldet."""
+        self.failed[phase] = error
+        logger.error(f"Start-Phase '{phase}' gescheitert: {error}")
+
+    def expect(self, *phases: str):
+        """Phasen, die vor der Bereitschaft noch abgeschlossen werden müssen."""
+        self.pending.update(phases)
+
+    @property
+    def ready(self) -> bool:
+        return "accepting" in self.phases and not self.pending
+
+    def webhook_accepted(self):
+        """Wird nach jedem angenommenen Webhook aufgerufen, zählt nur der erste."""
+        if self.first_webhook_ms is None:
+            self.first_webhook_ms = self._elapsed_ms()
+            logger.info(f"Erster Webhook angenommen nach {self.first_webhook_ms} ms")
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "pending": sorted(self.pending),
+            "failed": self.failed,
+            "phases_ms": self.phases,
+            "first_webhook_ms": self.first_webhook_ms,
+        }
+
+
+# Singleton-Instanz
+readiness = Readiness()
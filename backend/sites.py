@@ -0,0 +1,200 @@
+"""Mehrere Standorte (Gebäude) in einem Backend.
+
+Jeder Standort hat eine eigene SQLite-Datei. Die Standorte stehen in
+SITES_FILE (JSON):
+
+    {
+      "weiz": {"name": "MedZentrum Weiz", "webhook_token": "geheim"},
+      "graz": {"name": "Ärztehaus Graz", "database": "/data/graz.db"}
+    }
+
+Ohne SITES_FILE gibt es genau einen Standort DEFAULT_SITE mit
+DATABASE_PATH - wie bisher. Der erste Standort der Datei ist der Standard:
+er bekommt DATABASE_PATH und XOVIS_SENSOR_IP und beantwortet die Routen
+ohne Präfix. Weitere Standorte liegen unter <DB-Verzeichnis>/sites/<id>.db.
+
+Routing: /sites/<id>/api/... wird von SiteMiddleware auf /api/... umgeschrieben
+und setzt current_site. Alle DB-Zugriffe laufen über site_db(), das die
+Datei des aktuellen Standorts öffnet. Jeder Aufruf bekommt eine eigene
+Verbindung (wie früher aiosqlite.connect() pro Zugriff); freie Verbindungen
+werden in einem begrenzten Pool wiederverwendet. Lesezugriffe laufen so
+parallel zueinander und zu einem Schreiber (WAL), Schreiber warten über
+das busy_timeout von SQLite aufeinander - nicht über einen Lock im Prozess.
+"""
+import json
+import os
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import aiosqlite
+
+from config import (
+    DATABASE_PATH, DEFAULT_SITE, SITE_NAME, SITES_FILE, SITE_DB_CACHE_SIZE, WEBHOOK_TOKEN,
+    XOVIS_SENSOR_IP
+)
+
+
+@dataclass
+class Site:
+    id: str
+    name: str
+    database: str
+    webhook_token: str = ""
+    sensor_ip: str = ""
+
+
+def load_sites(path: str = SITES_FILE) -> Dict[str, Site]:
+    """Standorte aus SITES_FILE, sonst nur der Standard-Standort."""
+    if not path:
+        return {DEFAULT_SITE: Site(DEFAULT_SITE, SITE_NAME, DATABASE_PATH, WEBHOOK_TOKEN, XOVIS_SENSOR_IP)}
+
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    sites = {}
+    for index, (site_id, entry) in enumerate(entries.items()):
+        default_db = DATABASE_PATH if index == 0 else os.path.join(
+            os.path.dirname(DATABASE_PATH), "sites", f"{site_id}.db"
+        )
+        sites[site_id] = Site(
+            id=site_id,
+            name=entry.get("name", site_id),
+            database=entry.get("database", default_db),
+            webhook_token=entry.get("webhook_token", ""),
+            sensor_ip=entry.get("sensor_ip", XOVIS_SENSOR_IP if index == 0 else ""),
+        )
+    return sites
+
+
+SITES = load_sites()
+PRIMARY_SITE = next(iter(SITES))
+
+# Standort der laufenden Anfrage bzw. des laufenden Jobs
+current_site: ContextVar[str] = ContextVar("current_site", default=PRIMARY_SITE)
+
+
+def get_site(site_id: Optional[str] = None) -> Site:
+    return SITES[site_id or current_site.get()]
+
+
+@contextmanager
+def use_site(site_id: str):
+    """Führt den Block für einen bestimmten Standort aus."""
+    token = current_site.set(site_id)
+    try:
+        yield SITES[site_id]
+    finally:
+        current_site.reset(token)
+
+
+class ConnectionCache:
+    """Pool freier Verbindungen über alle Standorte (höchstens `size`).
+
+    Eine Verbindung gehört immer nur einem Aufrufer; wer keine freie findet,
+    öffnet eine neue. Zurückgegebene Verbindungen über der Grenze werden
+    geschlossen, die am längsten unbenutzte zuerst.
+    """
+
+    def __init__(self, size: int = SITE_DB_CACHE_SIZE):
+        self.size = max(1, size)
+        # (Standort, Verbindung), zuletzt zurückgegebene am Ende
+        self._idle: List[Tuple[str, aiosqlite.Connection]] = []
+        # Standorte, deren Datenbank-Verzeichnis schon angelegt ist
+        self._prepared: Set[str] = set()
+
+    async def _acquire(self, site_id: str) -> aiosqlite.Connection:
+        for index in range(len(self._idle) - 1, -1, -1):
+            if self._idle[index][0] == site_id:
+                return self._idle.pop(index)[1]
+        path = SITES[site_id].database
+        if site_id not in self._prepared:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._prepared.add(site_id)
+        return await aiosqlite.connect(path)
+
+    async def _release(self, site_id: str, db: aiosqlite.Connection):
+        self._idle.append((site_id, db))
+        while len(self._idle) > self.size:
+            _, oldest = self._idle.pop(0)
+            await oldest.close()
+
+    @asynccontextmanager
+    async def connection(self, site_id: str):
+        db = await self._acquire(site_id)
+        db.row_factory = None
+        try:
+            yield db
+        except BaseException:
+            await db.close()
+            raise
+        # Nicht abgeschlossene Transaktion nicht an den nächsten weitergeben
+        if db.in_transaction:
+            await db.rollback()
+        await self._release(site_id, db)
+
+    async def close(self):
+        """Schließt alle freien Verbindungen (beim Herunterfahren)."""
+        while self._idle:
+            _, db = self._idle.pop()
+            await db.close()
+
+
+connections = ConnectionCache()
+
+
+def site_db(site_id: Optional[str] = None):
+    """Verbindung zur Datenbank des (aktuellen) Standorts: `async with site_db() as db:`."""
+    return connections.connection(site_id or current_site.get())
+
+
+class PerSite(dict):
+    """Lazy erzeugte Instanz je Standort, z.B. Ingest-Warteschlange oder Alarm-Engine."""
+
+    def __init__(self, factory: Callable[[str], object]):
+        super().__init__()
+        self.factory = factory
+
+    def __missing__(self, site_id: str):
+        value = self[site_id] = self.factory(site_id)
+        return value
+
+    def current(self):
+        return self[current_site.get()]
+
+
+class SiteMiddleware:
+    """ASGI-Middleware: /sites/<id>/... -> /... mit gesetztem current_site."""
+
+    PREFIX = "/sites/"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        site_id, _, rest = scope["path"][len(self.PREFIX):].partition("/")
+        if site_id not in SITES:
+            await _not_found(send, site_id)
+            return
+
+        scope = dict(scope, path=f"/{rest}", root_path=scope.get("root_path", "") + f"/sites/{site_id}")
+        token = current_site.set(site_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_site.reset(token)
+
+
+async def _not_found(send, site_id: str):
+    body = json.dumps({"error": f"Unbekannter Standort: {site_id}"}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 404,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,176 @@
+"""Write-Ahead-Spool für Webhook-Daten auf der lokalen Platte.
+
+Jeder angenommene Webhook wird zuerst an eine Spool-Datei angehängt und
+erst danach in die Datenbank geschrieben. Schlägt der DB-Zugriff fehl
+(z.B. "database is locked" während eines Wartungsskripts), bleibt der
+Eintrag im Spool und wird später erneut angewendet - auch nach einem
+Neustart. Das ergibt At-least-once-Zustellung.
+
+Format: je Eintrag 4 Byte Länge (big endian) plus JSON. Angehängt wird
+ohne fsync; der Ingest-Writer ruft fsync einmal pro Batch auf, bevor er
+die Einträge anwendet. Wie weit eine Datei angewendet ist, steht in der
+meta-Tabelle (spool:<dateiname>) und wird in derselben Transaktion wie
+die Zählwerte aktualisiert.
+
+Jeder Worker-Prozess schreibt in eine eigene Datei und hält darauf einen
+fcntl-Lock. Dateien ohne Lock stammen von beendeten Prozessen und werden
+beim Start nachgespielt und danach gelöscht.
+"""
+import fcntl
+import glob
+import json
+import logging
+import os
+import struct
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from config import SPOOL_DIR, SPOOL_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">I")
+SUFFIX = ".spool"
+
+
+class SpoolError(Exception):
+    """Eintrag konnte nicht in den Spool geschrieben werden."""
+
+
+def read_records(path: str, offset: int = 0) -> List[Tuple[int, dict]]:
+    """Liest alle vollständigen Einträge ab `offset` als (End-Offset, Eintrag).
+
+    Ein unvollständiger letzter Eintrag (Absturz beim Schreiben) wird ignoriert.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+
+    records = []
+    pos = 0
+    while pos + HEADER.size <= len(data):
+        (length,) = HEADER.unpack_from(data, pos)
+        end = pos + HEADER.size + length
+        if end > len(data):
+            break
+        try:
+            record = json.loads(data[pos + HEADER.size:end])
+        except ValueError:
+            logger.error(f"Spool {path}: defekter Eintrag bei Offset {offset + pos}, Rest übersprungen")
+            break
+        records.append((offset + end, record))
+        pos = end
+    return records
+
+
+def _lock(path: str, create: bool = False) -> Optional[int]:
+    """Öffnet eine Spool-Datei mit exklusivem Lock. None, wenn sie ein anderer Prozess hält."""
+    flags = os.O_RDWR | os.O_APPEND | (os.O_CREAT if create else 0)
+    try:
+        fd = os.open(path, flags, 0o644)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    # Datei könnte zwischen open() und flock() von ihrem Besitzer gelöscht worden sein
+    try:
+        if os.fstat(fd).st_ino != os.stat(path).st_ino:
+            raise FileNotFoundError(path)
+    except FileNotFoundError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class Spool:
+    """Spool-Datei dieses Worker-Prozesses."""
+
+    def __init__(self, directory: str = SPOOL_DIR, max_bytes: int = SPOOL_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.path: Optional[str] = None
+        self.fd: Optional[int] = None
+        # Bis hierhin ist die Datei in der DB angewendet
+        self.applied = 0
+        self.size = 0
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    def open(self):
+        """Legt eine neue, gesperrte Spool-Datei an."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"ingest-{os.getpid()}-{uuid.uuid4().hex[:8]}{SUFFIX}")
+        fd = _lock(path, create=True)
+        if fd is None:
+            raise SpoolError(f"Spool {path} ist gesperrt")
+        self.path, self.fd = path, fd
+        self.applied = self.size = 0
+
+    def close(self):
+        """Gibt den Lock frei. Vollständig angewendete Dateien werden gelöscht."""
+        if self.fd is None:
+            return
+        if self.applied >= self.size:
+            os.unlink(self.path)
+        os.close(self.fd)
+        self.fd = None
+
+    def append(self, record: dict) -> int:
+        """Hängt einen Eintrag an (ohne fsync) und gibt den End-Offset zurück."""
+        data = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        try:
+            os.write(self.fd, HEADER.pack(len(data)) + data)
+        except (OSError, TypeError) as e:
+            raise SpoolError(f"Spool nicht beschreibbar: {e}")
+        self.size += HEADER.size + len(data)
+        return self.size
+
+    def sync(self):
+        os.fsync(self.fd)
+
+    def pending(self) -> List[Tuple[int, dict]]:
+        """Noch nicht angewendete Einträge."""
+        if self.applied >= self.size:
+            return []
+        return read_records(self.path, self.applied)
+
+    def mark_applied(self, offset: int):
+        """Nach dem DB-Commit aufrufen. Rotiert die Datei, wenn sie groß und leer gelaufen ist."""
+        self.applied = offset
+        if self.applied >= self.size and self.size >= self.max_bytes:
+            old_path, old_fd = self.path, self.fd
+            self.open()
+            os.unlink(old_path)
+            os.close(old_fd)
+
+    def names(self) -> List[str]:
+        """Dateinamen aller Spool-Dateien im Verzeichnis."""
+        return [os.path.basename(path) for path in glob.glob(os.path.join(self.directory, f"*{SUFFIX}"))]
+
+    def orphans(self) -> List[Tuple[str, int]]:
+        """Spool-Dateien beendeter Prozesse als (Pfad, gesperrter fd), älteste zuerst."""
+        paths = []
+        for path in glob.glob(os.path.join(self.directory, f"*{SUFFIX}")):
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                continue
+        result = []
+        for _, path in sorted(paths):
+            if path == self.path:
+                continue
+            fd = _lock(path)
+            if fd is not None:
+                result.append((path, fd))
+        return result
+
+
+def new_record(absolute: dict, increments: dict) -> dict:
+    """Spool-Eintrag mit Empfangszeit (UTC-Epoch) - beim Anwenden maßgeblich."""
+    return {"ts": round(time.time(), 3), "absolute": absolute, "increments": increments}
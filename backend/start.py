@@ -32,5 +32,18 @@ def _tcp_socketpair(family=socket.AF_UNIX, type=socket.SOCK_STREAM, proto=0):
 socket.socketpair = _tcp_socketpair
 
 if __name__ == "__main__":
+    import os
+    import sys
+    import time
+
+    # Startzeitpunkt für das Start-Profil (siehe readiness.py)
+    os.environ.setdefault("XOVIS_START_TIME", str(time.time()))
+
+    # STARTUP_PROFILE=1: Import-Zeiten aller Module nach stderr (python -X importtime)
+    if os.getenv("STARTUP_PROFILE") == "1" and not os.getenv("PYTHONPROFILEIMPORTTIME"):
+        os.environ["PYTHONPROFILEIMPORTTIME"] = "1"
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000)
+    from config import WORKERS
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS)
@@ -0,0 +1,173 @@
+"""In-Memory-Puffer für die heutigen Minutenwerte.
+
+Pro Standort (siehe sites.py) werden die Werte des laufenden Tages in drei Arrays mit je
+1440 Einträgen (eine Minute pro Slot) gehalten: kumulative Eintritte,
+kumulative Austritte und maximale Belegung. Der Speicherbedarf ist fest
+(~17 KB pro Standort). Mit dem Tageswechsel beginnt der Puffer von vorne.
+
+Gefüttert wird der Puffer direkt vom Ingest-Writer. Beim Herunterfahren
+wird er auf die Platte geschrieben, beim Start aus dem Snapshot geladen
+und mit den seitdem gespeicherten DB-Einträgen ergänzt. Damit können die
+heutigen Charts in jeder Auflösung ohne Datenbankzugriff geliefert werden.
+"""
+import json
+import logging
+import os
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from config import TIMESERIES_SNAPSHOT_PATH
+from database import get_counts_since, on_daily_reset
+from sites import current_site, use_site
+from timeutil import from_epoch, now_local, to_epoch
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+NO_DATA = -1
+
+# Unterstützte Auflösungen in Minuten
+RESOLUTIONS = {"minute": 1, "15min": 15, "hour": 60}
+
+
+class DayBuffer:
+    """Minutenwerte eines Tages für einen Standort (feste Größe, array-basiert)."""
+
+    def __init__(self, day: str):
+        self.day = day
+        self.count_in = array("i", [NO_DATA]) * MINUTES_PER_DAY
+        self.count_out = array("i", [NO_DATA]) * MINUTES_PER_DAY
+        self.occupancy = array("i", [NO_DATA]) * MINUTES_PER_DAY
+
+    def record(self, minute: int, count_in: int, count_out: int, occupancy: int):
+        """Speichert die kumulativen Tageswerte für eine Minute.
+
+        Kumulative Werte steigen innerhalb eines Tages nur - der größere Wert
+        gewinnt, auch wenn Ingest und Neuaufbau beim Start überlappen.
+        """
+        if count_in > self.count_in[minute]:
+            self.count_in[minute] = count_in
+        if count_out > self.count_out[minute]:
+            self.count_out[minute] = count_out
+        if occupancy > self.occupancy[minute]:
+            self.occupancy[minute] = occupancy
+
+    def buckets(self, minutes: int) -> List[dict]:
+        """Differenzwerte pro Intervall - gleiches Format wie get_hourly_stats()."""
+        result = []
+        prev_in = 0
+        prev_out = 0
+        for start in range(0, MINUTES_PER_DAY, minutes):
+            end = start + minutes
+            cumulative_in = max(self.count_in[start:end])
+            if cumulative_in == NO_DATA:
+                continue
+            cumulative_out = max(self.count_out[start:end])
+            row = {
+                'total_in': cumulative_in - prev_in,
+                'total_out': cumulative_out - prev_out,
+                'max_occupancy': max(self.occupancy[start:end]),
+            }
+            if minutes == 60:
+                row = {'hour': f"{start // 60:02d}", **row}
+            else:
+                row = {'time': f"{start // 60:02d}:{start % 60:02d}", **row}
+            result.append(row)
+            prev_in = cumulative_in
+            prev_out = cumulative_out
+        return result
+
+
+class TodayBuffer:
+    """Puffer der heutigen Minutenwerte für alle Standorte (Schlüssel: Standort-ID)."""
+
+    def __init__(self):
+        self._days: Dict[str, DayBuffer] = {}
+        self.ready = False
+
+    def _buffer(self, sensor: str, day: str) -> DayBuffer:
+        buffer = self._days.get(sensor)
+        if buffer is None or buffer.day != day:
+            # Neuer Tag: Slots werden wiederverwendet
+            buffer = DayBuffer(day)
+            self._days[sensor] = buffer
+        return buffer
+
+    def record(self, count_in: int, count_out: int, occupancy: int,
+               when: Optional[datetime] = None, sensor: Optional[str] = None):
+        """Übernimmt einen Ingest-Wert in den Puffer (Standard: aktueller Standort)."""
+        when = when or now_local()
+        buffer = self._buffer(sensor or current_site.get(), when.strftime("%Y-%m-%d"))
+        buffer.record(when.hour * 60 + when.minute, count_in, count_out, occupancy)
+
+    def reset(self, day: str):
+        """Verwirft die Werte des aktuellen Standorts (nach dessen Tages-Reset)."""
+        self._days[current_site.get()] = DayBuffer(day)
+
+    def stats(self, resolution: str = "hour", sensor: Optional[str] = None) -> List[dict]:
+        """Heutige Statistiken in der gewünschten Auflösung."""
+        today = now_local().strftime("%Y-%m-%d")
+        buffer = self._days.get(sensor or current_site.get())
+        if buffer is None or buffer.day != today:
+            return []
+        return buffer.buckets(RESOLUTIONS[resolution])
+
+    def save_snapshot(self, path: str = TIMESERIES_SNAPSHOT_PATH):
+        """Schreibt den Puffer als Header-Zeile (JSON) plus Rohdaten der Arrays."""
+        header = {
+            "saved_at": now_local().strftime("%Y-%m-%d %H:%M:%S"),
+            "sensors": [[sensor, buffer.day] for sensor, buffer in self._days.items()],
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            for buffer in self._days.values():
+                for values in (buffer.count_in, buffer.count_out, buffer.occupancy):
+                    values.tofile(f)
+        os.replace(tmp_path, path)
+
+    def load_snapshot(self, path: str = TIMESERIES_SNAPSHOT_PATH) -> Optional[datetime]:
+        """Lädt einen Snapshot von heute. Gibt dessen Zeitpunkt zurück (oder None)."""
+        if not os.path.exists(path):
+            return None
+        today = now_local().strftime("%Y-%m-%d")
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                days = {}
+                for sensor, day in header["sensors"]:
+                    buffer = DayBuffer(day)
+                    for values in (buffer.count_in, buffer.count_out, buffer.occupancy):
+                        values[:] = array("i")
+                        values.fromfile(f, MINUTES_PER_DAY)
+                    if day == today:
+                        days[sensor] = buffer
+        except (OSError, ValueError, EOFError, KeyError) as e:
+            logger.warning(f"Snapshot {path} nicht lesbar: {e}")
+            return None
+
+        self._days = days
+        if not days:
+            return None
+        return datetime.strptime(header["saved_at"], "%Y-%m-%d %H:%M:%S")
+
+    async def rebuild(self, sites: Iterable[str]):
+        """Snapshot laden und je Standort mit den neueren DB-Einträgen von heute ergänzen."""
+        start_of_day = now_local().replace(hour=0, minute=0, second=0, microsecond=0)
+        since = self.load_snapshot() or start_of_day
+        since = max(since, start_of_day)
+        total = 0
+        for site in sites:
+            with use_site(site):
+                rows = await get_counts_since(to_epoch(since))
+                for ts_epoch, count_in, count_out, occupancy in rows:
+                    self.record(count_in, count_out, occupancy, from_epoch(ts_epoch))
+            total += len(rows)
+        self.ready = True
+        logger.info(f"Tagespuffer aufgebaut ({total} Einträge aus der DB seit {since})")
+
+
+# Singleton-Instanz
+today_buffer = TodayBuffer()
+on_daily_reset(today_buffer.reset)
@@ -0,0 +1,70 @@
+"""Zeitzonen-Handling: Speicherung in UTC, Auswertung in Standort-Zeit.
+
+Jeder Historien-Eintrag speichert den Zeitpunkt als UTC-Epoch (ts_epoch)
+und dazu vorberechnete lokale Schlüssel in SITE_TIMEZONE:
+
+- local_day:    YYYYMMDD als Integer
+- local_hour:   Stunde 0-23
+- local_minute: Minute des Tages 0-1439
+
+Abfragen filtern und gruppieren damit über indizierte Integer-Spalten
+statt strftime() auf jeder Zeile. An Tagen mit Zeitumstellung stimmen
+die Tagessummen: im Herbst fallen beide 02-Uhr-Stunden in denselben
+Stunden-Bucket, im Frühling fehlt die 02-Uhr-Stunde einfach.
+"""
+import time
+from datetime import date, datetime, timedelta
+from typing import Tuple, Union
+from zoneinfo import ZoneInfo
+
+from config import SITE_TIMEZONE
+
+SITE_TZ = ZoneInfo(SITE_TIMEZONE)
+
+
+def now_local() -> datetime:
+    """Aktuelle Standort-Zeit (naiv, wie die übrigen lokalen Zeitangaben)."""
+    return datetime.now(SITE_TZ).replace(tzinfo=None)
+
+
+def now_epoch() -> int:
+    return int(time.time())
+
+
+def from_epoch(epoch: float) -> datetime:
+    """UTC-Epoch -> naive Standort-Zeit."""
+    return datetime.fromtimestamp(epoch, SITE_TZ).replace(tzinfo=None)
+
+
+def to_epoch(local: datetime) -> int:
+    """Naive Standort-Zeit -> UTC-Epoch (bei doppelter Stunde gilt die erste)."""
+    return int(local.replace(tzinfo=SITE_TZ).timestamp())
+
+
+def utc_offset(local: datetime) -> int:
+    """UTC-Offset der Standort-Zeitzone in Sekunden für eine lokale Zeit."""
+    return int(local.replace(tzinfo=SITE_TZ).utcoffset().total_seconds())
+
+
+def day_key(day: Union[date, datetime, str]) -> int:
+    """Datum -> local_day-Schlüssel (YYYYMMDD)."""
+    if isinstance(day, str):
+        day = datetime.strptime(day, "%Y-%m-%d")
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+def day_from_key(key: int) -> str:
+    """local_day-Schlüssel -> 'YYYY-MM-DD'."""
+    return f"{key // 10000:04d}-{key // 100 % 100:02d}-{key % 100:02d}"
+
+
+def local_keys(epoch: float) -> Tuple[str, int, int, int]:
+    """Lokaler Zeitstempel-Text sowie (local_day, local_hour, local_minute) für einen Epoch."""
+    local = from_epoch(epoch)
+    return (local.strftime("%Y-%m-%d %H:%M:%S"), day_key(local),
+            local.hour, local.hour * 60 + local.minute)
+
+
+def day_range(start: Union[date, datetime], days: int) -> Tuple[int, int]:
+    """local_day-Schlüssel von `start` bis einschließlich `start + days - 1`."""
+    return day_key(start), day_key(start + timedelta(days=days - 1))
@@ -0,0 +1,158 @@
+"""Gemeinsamer XML-Parser für Xovis-Daten (Webhook, Sensor-API, Exporte).
+
+Das Dokument wird mit einem inkrementellen Pull-Parser genau einmal
+durchlaufen. Dabei werden alle Zählwerte samt Sensor- und Zähllinien-
+Kennung gesammelt - auch bei Exporten mit vielen Linien oder Zählern.
+Verarbeitete Elemente werden sofort freigegeben, der Speicherbedarf
+bleibt dadurch auch bei großen Dateien klein.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+# Element-/Attributnamen (kleingeschrieben) -> normalisierter Zählername
+COUNTER_ALIASES = {
+    "fw": "fw", "forward": "fw", "in": "fw", "countin": "fw", "cnt_in": "fw",
+    "bw": "bw", "backward": "bw", "out": "bw", "countout": "bw", "cnt_out": "bw",
+    "occupancy": "occupancy", "current": "occupancy", "fill": "occupancy",
+}
+
+# Elemente mit Zählername im Attribut, z.B. <cnt name="fw">12</cnt>
+COUNTER_ELEMENTS = ("cnt", "count", "counter", "value")
+COUNTER_NAME_ATTRS = ("name", "type", "direction", "id")
+
+# Elemente, die Sensor bzw. Zähllinie kennzeichnen (exakte Namen, ohne Namespace)
+SENSOR_ELEMENTS = ("sensor", "sensor-info", "device", "device-info")
+LINE_ELEMENTS = ("line", "count-line", "countline", "logic")
+
+# Elemente, die einen Zeitintervall-Datensatz beschreiben (Logic Push / Export)
+INTERVAL_ELEMENTS = ("record", "interval", "bin")
+
+CHUNK_SIZE = 64 * 1024
+
+XmlSource = Union[str, bytes, Iterable[bytes]]
+
+
+def _local_name(tag: str) -> str:
+    """Entfernt den Namespace ({uri}tag -> tag) und normalisiert auf Kleinbuchstaben."""
+    return tag.rsplit("}", 1)[-1].lower()
+
+
+def _to_int(text: Optional[str]) -> Optional[int]:
+    if text is None:
+        return None
+    text = text.strip()
+    return int(text) if text.isdigit() else None
+
+
+def _chunks(source: XmlSource) -> Iterable[bytes]:
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, bytes):
+        for i in range(0, len(source), CHUNK_SIZE):
+            yield source[i:i + CHUNK_SIZE]
+    else:
+        yield from source
+
+
+def parse_counters(source: XmlSource) -> List[Dict[str, Any]]:
+    """Liest alle Zählwerte aus einem Xovis-XML-Dokument in einem Durchlauf.
+
+    Jeder Eintrag enthält: sensor, line, counter (fw/bw/occupancy), value und
+    interval (True wenn der Wert zu einem Zeitintervall-Datensatz gehört,
+    also ein Inkrement statt eines kumulativen Zählerstands ist).
+    """
+    parser = XMLPullParser(events=("start", "end"))
+    counters: List[Dict[str, Any]] = []
+    # Kontext je offenem Element: (sensor, line, interval)
+    stack: List[Tuple[Optional[str], Optional[str], bool]] = [(None, None, False)]
+
+    def handle(events):
+        for event, elem in events:
+            name = _local_name(elem.tag)
+            if event == "start":
+                sensor, line, interval = stack[-1]
+                attrs = elem.attrib
+                if name in SENSOR_ELEMENTS:
+                    sensor = attrs.get("serial") or attrs.get("id") or attrs.get("name") or sensor
+                elif name in LINE_ELEMENTS:
+                    line = attrs.get("id") or attrs.get("name") or line
+                if name in INTERVAL_ELEMENTS or "from" in attrs or "start" in attrs:
+                    interval = True
+                stack.append((sensor, line, interval))
+                continue
+
+            sensor, line, interval = stack.pop()
+
+            # <fw>12</fw>, <forward>12</forward>, ...
+            counter = COUNTER_ALIASES.get(name)
+            # <cnt name="fw">12</cnt>
+            if counter is None and name in COUNTER_ELEMENTS:
+                for attr in COUNTER_NAME_ATTRS:
+                    counter = COUNTER_ALIASES.get((elem.get(attr) or "").lower())
+                    if counter:
+                        break
+            value = _to_int(elem.text) if counter else None
+            if value is not None:
+                counters.append({
+                    "sensor": sensor, "line": line, "counter": counter,
+                    "value": value, "interval": interval,
+                })
+
+            # <line cnt_in="12" cnt_out="7"/>
+            for attr, attr_value in elem.attrib.items():
+                attr_counter = COUNTER_ALIASES.get(attr.lower())
+                attr_int = _to_int(attr_value)
+                if attr_counter and attr_int is not None and attr.lower().startswith("cnt_"):
+                    counters.append({
+                        "sensor": sensor, "line": line, "counter": attr_counter,
+                        "value": attr_int, "interval": interval,
+                    })
+
+            # Verarbeitete Elemente freigeben (Speicher bleibt begrenzt)
+            elem.clear()
+
+    for chunk in _chunks(source):
+        parser.feed(chunk)
+        handle(parser.read_events())
+    parser.close()
+    handle(parser.read_events())
+    return counters
+
+
+def totals(counters: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Summiert die Zählwerte je Zähler über alle Linien/Sensoren."""
+    result: Dict[str, int] = {}
+    for entry in counters:
+        result[entry["counter"]] = result.get(entry["counter"], 0) + entry["value"]
+    return result
+
+
+def to_push_counts(counters: List[Dict[str, Any]]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Wandelt geparste Zählwerte in (absolute, increments) für den Ingest um.
+
+    Werte aus Intervall-Datensätzen werden addiert, alle anderen gelten als
+    kumulative Zählerstände und werden über die Linien summiert.
+    """
+    absolute = totals([c for c in counters if not c["interval"] and c["counter"] != "occupancy"])
+    increments = {"fw": 0, "bw": 0}
+    for name, value in totals([c for c in counters if c["interval"]]).items():
+        if name in increments:
+            increments[name] += value
+    return absolute, increments
+
+
+def parse_xovis_xml(text: XmlSource) -> Dict[str, Any]:
+    """Parst Xovis XML-Daten.
+
+    Gibt die Summen je Zähler (fw, bw, occupancy) sowie alle Einzelwerte unter
+    "counters" zurück. Ungültiges XML liefert nur {"raw": text}.
+    """
+    raw = text if isinstance(text, (str, bytes)) else None
+    try:
+        counters = parse_counters(text)
+    except ParseError:
+        return {"raw": raw}
+
+    result: Dict[str, Any] = {"raw": raw, "counters": counters}
+    result.update(totals(counters))
+    return result
@@ -5,6 +5,7 @@ from config import (
     XOVIS_BASE_URL, XOVIS_USERNAME, XOVIS_PASSWORD,
     XOVIS_API_COUNT, XOVIS_API_LINES, XOVIS_API_LIVE
 )
+from xml_ingest import parse_xovis_xml
 
 logger = logging.getLogger(__name__)
 
@@ -45,21 +46,17 @@ class XovisClient:
         return None
 
     def _parse_xml(self, xml_text: str) -> Dict[str, Any]:
-        """Einfacher XML-Parser für Xovis-Daten."""
-        import re
+        """XML-Antwort des Sensors über den gemeinsamen XML-Parser auswerten."""
+        parsed = parse_xovis_xml(xml_text)
         result: Dict[str, Any] = {}
 
-        # Versuche, count_in, count_out, occupancy aus XML zu extrahieren
-        patterns = {
-            "count_in": r"<(?:in|countIn|forward)[^>]*>(\d+)</",
-            "count_out": r"<(?:out|countOut|backward)[^>]*>(\d+)</",
-            "occupancy": r"<(?:occupancy|current|fill)[^>]*>(\d+)</",
-        }
-
-        for key, pattern in patterns.items():
-            match = re.search(pattern, xml_text, re.IGNORECASE)
-            if match:
-                result[key] = int(match.group(1))
+        # Summen über alle Zähllinien
+        if "fw" in parsed:
+            result["count_in"] = parsed["fw"]
+        if "bw" in parsed:
+            result["count_out"] = parsed["bw"]
+        if "occupancy" in parsed:
+            result["occupancy"] = parsed["occupancy"]
 
         return result if result else {"raw": xml_text}
 
@@ -1,12 +1,15 @@
 // Xovis Dashboard - Frontend JavaScript
 
-const API_BASE = '';
+// Standort-Präfix aus der URL übernehmen (/sites/<id>/ -> /sites/<id>/api/...)
+const API_BASE = (location.pathname.match(/^\/sites\/[^\/]+/) || [''])[0];
 const MAX_OCCUPANCY = 50; // Maximale Gebäudebelegung für Ring-Anzeige
 
 // Chart.js Instanzen
 let chartToday = null;
 let chartWeek = null;
 let chartMonth = null;
+let chartFlow = null;
+let chartQueue = null;
 
 // Farben
 const COLORS = {
@@ -93,12 +96,22 @@ async function updateLiveData() {
     if (!data) return;
 
     const current = data.current || {};
+    // Driftkorrigierte Belegung anzeigen (verpasste Austritte verfälschen sonst den Abend)
+    const occupancy = current.occupancy_corrected ?? current.occupancy;
 
-    animateValue('current-occupancy', current.occupancy);
+    animateValue('current-occupancy', occupancy);
     animateValue('count-in', current.count_in);
     animateValue('count-out', current.count_out);
 
-    updateOccupancyRing(current.occupancy || 0);
+    updateOccupancyRing(occupancy || 0);
+}
+
+async function updateSite() {
+    const data = await fetchAPI('/api/site');
+    if (!data) return;
+
+    document.querySelector('.logo-subtitle').textContent = data.name;
+    document.title = `Besucherzähler - ${data.name}`;
 }
 
 async function updateStatus() {
@@ -134,25 +147,27 @@ async function updateStatus() {
 
 // ==================== Chart Summary ====================
 
-function renderSummary(containerId, data, type) {
+function renderSummary(containerId, data, type, averages) {
     const el = document.getElementById(containerId);
-    if (!el || !data) return;
+    if (!el || !data || !data.labels) return;
 
+    const sum = values => values.reduce((s, v) => s + v, 0);
     let html = '';
 
     if (type === 'today') {
-        const totalIn = data.reduce((s, h) => s + (h.total_in || 0), 0);
-        const totalOut = data.reduce((s, h) => s + (h.total_out || 0), 0);
-        const peakHour = data.reduce((max, h) =>
-            (h.total_in || 0) > (max.total_in || 0) ? h : max, data[0] || {});
+        const totalIn = sum(data.in);
+        const totalOut = sum(data.out);
+        const peakIndex = data.in.indexOf(Math.max(...data.in));
+        const peakHour = data.labels[peakIndex];
         html = `
             <span class="stat">Eintritte: <span class="stat-value">${totalIn}</span></span>
             <span class="stat">Austritte: <span class="stat-value">${totalOut}</span></span>
-            ${peakHour?.hour ? `<span class="stat">Peak: <span class="stat-value">${peakHour.hour}:00</span></span>` : ''}
+            ${peakHour ? `<span class="stat">Peak: <span class="stat-value">${peakHour}:00</span></span>` : ''}
         `;
     } else {
-        const totalIn = data.reduce((s, d) => s + (d.total_in || 0), 0);
-        const avgIn = data.length ? Math.round(totalIn / data.length) : 0;
+        // Durchschnitt nur über geöffnete, abgeschlossene Tage (/api/stats/averages)
+        const totalIn = sum(data.in);
+        const avgIn = averages && averages.open_days ? Math.round(averages.avg_in) : '–';
         html = `
             <span class="stat">Gesamt: <span class="stat-value">${totalIn}</span></span>
             <span class="stat">Durchschnitt/Tag: <span class="stat-value">${avgIn}</span></span>
@@ -228,23 +243,25 @@ function createChart(ctx, type, labels, datasets, extraOpts = {}) {
 }
 
 async function updateTodayChart() {
-    const data = await fetchAPI('/api/stats/today');
-    if (!data || !data.hours) return;
+    const data = await fetchAPI('/api/stats/today?format=columnar');
+    if (!data || !data.labels) return;
 
     const labels = [];
     const dataIn = [];
     const dataOut = [];
     const dataOccupancy = [];
 
-    for (let h = 6; h <= 20; h++) {
+    // Chart-Fenster aus den Öffnungszeiten des Servers
+    const [fromHour, toHour] = data.chart_window || [6, 20];
+    for (let h = fromHour; h <= toHour; h++) {
         labels.push(`${h.toString().padStart(2, '0')}:00`);
-        const hourData = data.hours.find(d => parseInt(d.hour) === h);
-        dataIn.push(hourData?.total_in || 0);
-        dataOut.push(hourData?.total_out || 0);
-        dataOccupancy.push(hourData?.max_occupancy || 0);
+        const i = data.labels.findIndex(label => parseInt(label) === h);
+        dataIn.push(i >= 0 ? data.in[i] : 0);
+        dataOut.push(i >= 0 ? data.out[i] : 0);
+        dataOccupancy.push(i >= 0 ? data.occupancy[i] : 0);
     }
 
-    renderSummary('today-summary', data.hours, 'today');
+    renderSummary('today-summary', data, 'today');
 
     const ctx = document.getElementById('chart-today');
 
@@ -298,17 +315,18 @@ async function updateTodayChart() {
 }
 
 async function updateWeekChart() {
-    const data = await fetchAPI('/api/stats/week');
-    if (!data || !data.days) return;
+    const [data, averages] = await Promise.all([
+        fetchAPI('/api/stats/week?format=columnar'),
+        fetchAPI('/api/stats/averages?days=7')
+    ]);
+    if (!data || !data.labels) return;
 
-    const labels = data.days.map(d => {
-        const date = new Date(d.date);
-        return date.toLocaleDateString('de-DE', { weekday: 'short', day: 'numeric' });
-    });
-    const dataIn = data.days.map(d => d.total_in || 0);
-    const dataOut = data.days.map(d => d.total_out || 0);
+    const labels = data.labels.map(d =>
+        new Date(d).toLocaleDateString('de-DE', { weekday: 'short', day: 'numeric' }));
+    const dataIn = data.in;
+    const dataOut = data.out;
 
-    renderSummary('week-summary', data.days, 'week');
+    renderSummary('week-summary', data, 'week', averages);
 
     const ctx = document.getElementById('chart-week');
 
@@ -342,14 +360,19 @@ async function updateWeekChart() {
 }
 
 async function updateMonthChart() {
-    const data = await fetchAPI('/api/stats/month');
-    if (!data || !data.days) return;
+    // Abgeschlossene Tage des Monats; am Monatsersten gibt es noch keinen
+    const elapsed = new Date().getDate() - 1;
+    const [data, averages] = await Promise.all([
+        fetchAPI('/api/stats/month?format=columnar'),
+        elapsed ? fetchAPI(`/api/stats/averages?days=${elapsed}`) : null
+    ]);
+    if (!data || !data.labels) return;
 
-    const labels = data.days.map(d => new Date(d.date).getDate().toString());
-    const dataIn = data.days.map(d => d.total_in || 0);
-    const dataOut = data.days.map(d => d.total_out || 0);
+    const labels = data.labels.map(d => new Date(d).getDate().toString());
+    const dataIn = data.in;
+    const dataOut = data.out;
 
-    renderSummary('month-summary', data.days, 'month');
+    renderSummary('month-summary', data, 'month', averages);
 
     const ctx = document.getElementById('chart-month');
 
@@ -382,6 +405,123 @@ async function updateMonthChart() {
     }
 }
 
+async function updateFlowChart() {
+    const data = await fetchAPI('/api/stats/flow?format=columnar');
+    if (!data || !data.labels) return;
+
+    const labels = [];
+    const dwell = [];
+    const avgOccupancy = [];
+    const [fromHour, toHour] = data.chart_window || [6, 20];
+    for (let h = fromHour; h <= toHour; h++) {
+        labels.push(`${h.toString().padStart(2, '0')}:00`);
+        const i = data.labels.findIndex(label => parseInt(label) === h);
+        dwell.push(i >= 0 ? data.dwell[i] : null);
+        avgOccupancy.push(i >= 0 ? data.avg_occupancy[i] : 0);
+    }
+
+    const el = document.getElementById('flow-summary');
+    if (el) {
+        el.innerHTML = `
+            <span class="stat">Ø Verweildauer: <span class="stat-value">${data.dwell_minutes != null ? `${data.dwell_minutes} min` : '--'}</span></span>
+            <span class="stat">Eintritte: <span class="stat-value">${data.total_arrivals}</span></span>
+        `;
+    }
+
+    if (chartFlow) {
+        chartFlow.data.labels = labels;
+        chartFlow.data.datasets[0].data = dwell;
+        chartFlow.data.datasets[1].data = avgOccupancy;
+        chartFlow.update();
+    } else {
+        chartFlow = createChart(document.getElementById('chart-flow'), 'bar', labels, [
+            {
+                label: 'Verweildauer (min)',
+                data: dwell,
+                backgroundColor: COLORS.occupancy,
+                borderColor: 'transparent',
+                borderWidth: 0,
+                borderRadius: 6,
+                borderSkipped: false
+            },
+            {
+                type: 'line',
+                label: 'Ø Belegung',
+                data: avgOccupancy,
+                borderColor: COLORS.in,
+                backgroundColor: COLORS.inBg,
+                borderWidth: 2,
+                tension: 0.35,
+                pointRadius: 0,
+                pointHoverRadius: 5
+            }
+        ], {
+            plugins: {
+                ...chartDefaults().plugins,
+                tooltip: {
+                    ...chartDefaults().plugins.tooltip,
+                    callbacks: { label: ctx => ` ${ctx.dataset.label}: ${ctx.parsed.y ?? '--'}` }
+                }
+            }
+        });
+    }
+
+    await updateQueueChart(fromHour, toHour);
+}
+
+async function updateQueueChart(fromHour, toHour) {
+    const data = await fetchAPI('/api/stats/flow/minutes?format=columnar');
+    if (!data || !data.labels) return;
+
+    // Minuten ohne Ereignis auffüllen: kumulative Zu-/Abgänge A(t), D(t) und Belegung
+    const byMinute = new Map(data.labels.map((label, i) => [label, i]));
+    const labels = [];
+    const arrivals = [];
+    const departures = [];
+    const occupancy = [];
+    let a = 0, d = 0, occ = 0;
+    data.labels.forEach((label, i) => {
+        if (parseInt(label) < fromHour) {
+            a += data.arrivals[i];
+            d += data.departures[i];
+            occ = data.occupancy[i];
+        }
+    });
+    for (let h = fromHour; h <= toHour; h++) {
+        for (let m = 0; m < 60; m++) {
+            const label = `${h.toString().padStart(2, '0')}:${m.toString().padStart(2, '0')}`;
+            const i = byMinute.get(label);
+            if (i !== undefined) {
+                a += data.arrivals[i];
+                d += data.departures[i];
+                occ = data.occupancy[i];
+            }
+            labels.push(label);
+            arrivals.push(a);
+            departures.push(d);
+            occupancy.push(occ);
+        }
+    }
+
+    if (chartQueue) {
+        chartQueue.data.labels = labels;
+        chartQueue.data.datasets[0].data = arrivals;
+        chartQueue.data.datasets[1].data = departures;
+        chartQueue.data.datasets[2].data = occupancy;
+        chartQueue.update();
+    } else {
+        const line = (label, values, color, extra = {}) => ({
+            label, data: values, borderColor: color, borderWidth: 2,
+            stepped: true, pointRadius: 0, pointHoverRadius: 4, fill: false, ...extra
+        });
+        chartQueue = createChart(document.getElementById('chart-queue'), 'line', labels, [
+            line('Zugänge', arrivals, COLORS.in),
+            line('Abgänge', departures, COLORS.out),
+            line('Belegung', occupancy, COLORS.occupancy, { borderDash: [6, 4] })
+        ]);
+    }
+}
+
 // ==================== Tab Navigation ====================
 
 function setupTabs() {
@@ -401,6 +541,7 @@ function setupTabs() {
                 case 'today': updateTodayChart(); break;
                 case 'week': updateWeekChart(); break;
                 case 'month': updateMonthChart(); break;
+                case 'flow': updateFlowChart(); break;
             }
         });
     });
@@ -413,6 +554,7 @@ async function init() {
     updateClock();
     setInterval(updateClock, 30000);
 
+    await updateSite();
     await updateStatus();
     await updateLiveData();
     await updateTodayChart();